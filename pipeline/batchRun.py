@@ -0,0 +1,246 @@
+import os
+import re
+import sys
+import csv
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from stageProfile import profileCommand
+from nustarPipeline import privatePfiles
+
+""" Run test_heasoft_install.sh for many observations in one go, a few at a time.
+
+    The observations are listed in a manifest CSV with a header row and the columns
+        tarball, obsid[, gti, rega, regb][, name]
+    where an empty (or missing) gti/rega/regb uses the script's defaults and name (default: the OBSID) labels the
+    observation's run. Relative paths are relative to the manifest. Each observation is a separate run of the script with
+    its own run directory and log, e.g., for a benchmark benchmark_<name>/ and run_benchmark_<name>_heasoft_install.log,
+    and for a new run (--new <tag>) new<tag>_<name>/ compared to benchmark_<name>/. The script's terminal output for each
+    observation goes to <batch directory>/<name>.console.log and each observation has its own HEASoft parameter file
+    directory (<batch directory>/pfiles/<name>) so runs at the same time don't share parameter files.
+
+    At the end the Passed/Failed test lines of every run's log and each run's time are collected into one report.
+
+    Run as, e.g.,
+        python3 batchRun.py observations.csv --jobs 2
+        python3 batchRun.py observations.csv --new 2024-09 --jobs 2 --parallel --report batch_report.json
+"""
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(SCRIPT_DIR, "test_heasoft_install.sh")
+TEST_LINE = re.compile(r"^Test(?P<test>[^:]+):(?P<label>.*) - (?P<status>Passed|Failed)$")
+COLUMNS = ["tarball", "obsid", "gti", "rega", "regb", "name"]
+
+
+def readManifest(manifest):
+    """Read the observations from a manifest CSV.
+
+    Parameters
+    ----------
+    manifest : str
+        The CSV file (header row with at least tarball and obsid, rows starting with "#" are skipped).
+
+    Returns
+    -------
+    A list of dictionaries (one for each observation) with every column in COLUMNS, file paths made absolute.
+    """
+    here = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, "r", newline="") as m:
+        rows = [r for r in csv.DictReader(m) if not str(r.get("tarball", "")).strip().startswith("#")]
+
+    observations = []
+    for n, row in enumerate(rows):
+        obs = {c:str(row.get(c) or "").strip() for c in COLUMNS}
+        if (obs["tarball"]=="") or (obs["obsid"]==""):
+            raise ValueError(f"Row {n+1} of {manifest} needs a tarball and an obsid.")
+        for c in ["tarball", "gti", "rega", "regb"]:
+            if obs[c]!="":
+                obs[c] = os.path.abspath(os.path.join(here, obs[c]))
+        obs["name"] = obs["obsid"] if obs["name"]=="" else obs["name"]
+        observations.append(obs)
+
+    names = [o["name"] for o in observations]
+    duplicates = sorted({n for n in names if names.count(n)>1})
+    assert len(duplicates)==0, f"Each observation needs its own name (repeated: {duplicates}), add a name column."
+    return observations
+
+
+def runPaths(obs, new=None):
+    """The arguments to test_heasoft_install.sh for an observation and where its run directory and log will be.
+
+    Parameters
+    ----------
+    obs : dict
+        The observation (see readManifest()).
+
+    new : str or None
+        The tag for a new run (compared to the observation's benchmark), None for a benchmark run.
+        Default: None
+
+    Returns
+    -------
+    A tuple of (arguments, run directory, log file).
+    """
+    suffix = "_"+obs["name"]
+    args = [obs["tarball"], "-o", obs["obsid"], "-b", suffix]
+    if new is not None:
+        args += ["-n", new+suffix]
+        runDir, log = f"new{new}{suffix}", f"run_new{new}{suffix}_heasoft_install.log"
+    else:
+        runDir, log = f"benchmark{suffix}", f"run_benchmark{suffix}_heasoft_install.log"
+    for flag, c in [("-g", "gti"), ("-ra", "rega"), ("-rb", "regb")]:
+        if obs[c]!="":
+            args += [flag, obs[c]]
+    return args, os.path.join(SCRIPT_DIR, runDir), os.path.join(SCRIPT_DIR, log)
+
+
+def testResults(log):
+    """The result of every test in a run's log.
+
+    Parameters
+    ----------
+    log : str
+        The log file (TERM_OUTFILE) of the run.
+
+    Returns
+    -------
+    A list of dictionaries with the "test" number, "label" and "passed" (bool), in the order they finished.
+    """
+    if not os.path.isfile(log):
+        return []
+    results = []
+    with open(log, "r", errors="replace") as l:
+        for line in l:
+            match = TEST_LINE.match(line.rstrip("\n"))
+            if match is not None:
+                results.append({"test":match["test"], "label":match["label"].strip(), "passed":match["status"]=="Passed"})
+    return results
+
+
+def stageTimes(log):
+    """The wall time of each stage of a run from its stage profile (see stageProfile.py), {} if there isn't one."""
+    try:
+        with open(log[:-len(".log")]+"_stage_profile.json", "r") as p:
+            return {r["name"].strip():r["wall"] for r in json.load(p)}
+    except (OSError, ValueError):
+        return {}
+
+
+def runObservation(obs, batchDir, new=None, extraArgs=[]):
+    """Run test_heasoft_install.sh for one observation.
+
+    Parameters
+    ----------
+    obs : dict
+        The observation (see readManifest()).
+
+    batchDir : str
+        Where to put the script's terminal output (<name>.console.log).
+
+    new : str or None
+        See runPaths().
+        Default: None
+
+    extraArgs : list of str
+        Other arguments for the script, e.g., ["-p"].
+        Default: []
+
+    Returns
+    -------
+    A dictionary describing the run (see batchRun()).
+    """
+    args, runDir, log = runPaths(obs, new=new)
+    console = os.path.join(batchDir, obs["name"]+".console.log")
+    env = privatePfiles(os.path.join(batchDir, "pfiles", obs["name"]))
+    with open(console, "w") as c:
+        try:
+            returncode, record, _ = profileCommand(obs["name"], ["zsh", SCRIPT]+args+extraArgs, cwd=SCRIPT_DIR, env=env,
+                                                   stdout=c, stderr=c, kind="observation")
+        except FileNotFoundError as e:
+            c.write(f"{e}\n")
+            returncode, record = 127, {"wall":0, "user":0, "sys":0}
+
+    tests = testResults(log)
+    failed = [f"Test{t['test']}:{t['label']}" for t in tests if not t["passed"]]
+    return {"name":obs["name"], "obsid":obs["obsid"], "tarball":obs["tarball"],
+            "run_dir":runDir, "log":log, "console":console, "returncode":returncode,
+            # the script carries on after a failed test so it only passed if every test passed (and there were some)
+            "passed":(returncode==0) and (len(tests)>0) and (len(failed)==0),
+            "tests":tests, "failed":failed,
+            "wall":record["wall"], "cpu":record["user"]+record["sys"], "stages":stageTimes(log)}
+
+
+def batchRun(observations, batchDir, jobs=1, new=None, extraArgs=[]):
+    """Run many observations, at most jobs at the same time.
+
+    Parameters
+    ----------
+    observations : list of dict
+        The observations (see readManifest()).
+
+    batchDir : str
+        Directory for the terminal output of each run (created if needed).
+
+    jobs : int
+        The most observations to run at the same time.
+        Default: 1
+
+    new : str or None
+        The tag for new runs (each compared to its benchmark_<name>), None for benchmark runs.
+        Default: None
+
+    extraArgs : list of str
+        Other arguments for every run of the script, e.g., ["-p"].
+        Default: []
+
+    Returns
+    -------
+    A list of dictionaries (in manifest order) with the observation's "name", "obsid", "tarball", "run_dir", "log",
+    "console", "returncode", "passed", "tests" (each test's result), "failed" (names of failed tests), "wall" and
+    "cpu" (seconds for the whole run), and "stages" (wall time of each stage).
+    """
+    os.makedirs(batchDir, exist_ok=True)
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {pool.submit(runObservation, obs, batchDir, new, extraArgs):obs["name"] for obs in observations}
+        for done in as_completed(running):
+            result = done.result()
+            results[running[done]] = result
+            print(f"{result['name']} ({result['obsid']}): {'Passed' if result['passed'] else 'Failed'} in {result['wall']:.1f} s", flush=True)
+    return [results[obs["name"]] for obs in observations]
+
+
+def writeReport(results, report):
+    """Print a table of the batch results and write them all to a .json file (or None to only print)."""
+    _l = max([len(r["name"]) for r in results]+[len("Observation")])
+    print("Observation".ljust(_l)+"    OBSID          Result    Tests passed    Wall [s]     CPU [s]")
+    for r in results:
+        print(f"{r['name'].ljust(_l)}    {r['obsid']:<13}  {'Passed' if r['passed'] else 'Failed':<6}    "
+              f"{sum([t['passed'] for t in r['tests']]):>5}/{len(r['tests']):<6}    {r['wall']:>8.1f}    {r['cpu']:>8.1f}")
+        for f in r["failed"]:
+            print(" "*(_l+4)+f"failed: {f}")
+    passed = sum([r["passed"] for r in results])
+    print(f"{passed}/{len(results)} observation(s) passed.")
+
+    if report is not None:
+        with open(report, "w") as rep:
+            json.dump({"passed":passed==len(results), "observations":results}, rep, indent=1)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Run test_heasoft_install.sh for every observation in a manifest.")
+    parser.add_argument("manifest", help="CSV with columns tarball, obsid[, gti, rega, regb][, name].")
+    parser.add_argument("--new", default=None, help="Tag for new runs (new<tag>_<name>, compared to benchmark_<name>), default is a benchmark run.")
+    parser.add_argument("--jobs", type=int, default=1, help="Most observations to run at the same time (default: 1).")
+    parser.add_argument("--parallel", action="store_true", help="Run each observation's stages as a dependency graph (-p).")
+    parser.add_argument("--cache", default=None, help="Stage cache directory shared by the runs (-c).")
+    parser.add_argument("--batch-dir", default=None, help="Directory for each run's terminal output (default: batch_<benchmark|new<tag>> next to the script).")
+    parser.add_argument("--report", default=None, help="JSON file to write the consolidated report to.")
+    args = parser.parse_args()
+
+    extraArgs = (["-p"] if args.parallel else [])+([] if args.cache is None else ["-c", os.path.abspath(args.cache)])
+    batchDir = args.batch_dir if args.batch_dir is not None else os.path.join(SCRIPT_DIR, "batch_"+("benchmark" if args.new is None else "new"+args.new))
+    results = batchRun(readManifest(args.manifest), batchDir, jobs=args.jobs, new=args.new, extraArgs=extraArgs)
+    writeReport(results, args.report)
+    sys.exit(0 if all([r["passed"] for r in results]) else 1)
@@ -0,0 +1,352 @@
+import os
+import shutil
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from stageProfile import profileCommand
+
+""" Run the stages of the test as a dependency graph, running any stages that don't depend on each other at the same time.
+
+    Each Stage says which files it needs (inputs) and makes (outputs), and any other stages it has to come after. A stage
+    that needs a file another stage makes automatically comes after that stage. Pipeline.run() starts every stage as soon
+    as all of the stages it comes after have passed, so (e.g.) the FPMA fit can start while FPMB is still in nuproducts.
+
+    The terminal lines (Test<n>:<label> - Running/Passed/Failed) and the log file blocks are the same as test_line and
+    normal_line in test_heasoft_install.sh. Each stage's block is written to the log in one go when the stage finishes so
+    stages running at the same time don't mix their output.
+"""
+
+# same colours as test_heasoft_install.sh
+DEFAULT_C = "\033[0m"
+RUNNING_C = "\033[48;5;30m"
+PASSED_C = "\033[48;5;28m"
+FAILED_C = "\033[48;5;1m"
+
+
+class Copy:
+    """A copy of a file as a stage command, logged like "cp <source> <destination>".
+
+    Parameters
+    ----------
+    source : str
+        The file to copy.
+
+    destination : str
+        Where to copy it to (a directory or file name).
+    """
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+
+    def __call__(self, cwd=None):
+        source = self.source if cwd is None else os.path.join(cwd, self.source)
+        destination = self.destination if cwd is None else os.path.join(cwd, self.destination)
+        shutil.copy2(source, destination)
+        return ""
+
+    def __str__(self):
+        return f"cp {self.source} {self.destination}"
+
+
+class Stage:
+    """One step of the pipeline.
+
+    Parameters
+    ----------
+    name : str
+        A unique name for the stage (used for "after" and in error messages).
+
+    command : str, callable, or list of them
+        Shell command(s) (run like "eval" in test_line) or Python callables that take the working directory,
+        return any output as a string, and raise an exception if they fail. Run in order, stopping at the first failure.
+
+    inputs : list of str
+        Files the stage needs, relative to cwd unless absolute.
+        Default: []
+
+    outputs : list of str
+        Files the stage makes, relative to cwd unless absolute.
+        Default: []
+
+    after : list of str
+        Names of other stages that must have passed before this one starts (on top of the stages making its inputs).
+        Default: []
+
+    cwd : str or None
+        The directory to run the stage in, None for the current directory.
+        Default: None
+
+    label : str or None
+        The test description, e.g., "Screen counts to grade 0 (FPMA, nuscreen)   ". If given the stage is logged
+        and printed like test_line, if None then like normal_line (and nothing is printed to the terminal).
+        Default: None
+
+    test : str
+        The test number, e.g., "2a".
+        Default: ""
+
+    info : str
+        Extra line written to the log before the output (the 4th input of test_line).
+        Default: ""
+
+    env : dict or None
+        Environment variables for the command(s), None for the same environment as this process.
+        Default: None
+
+    cache : bool
+        Reuse the stage's products from the Pipeline's StageCache (see stageCache.py) if it has been run with
+        the same inputs before.
+        Default: False
+
+    keyFiles : list of str
+        Files that aren't inputs of the stage but whose contents decide what it makes (e.g., the tarball the
+        data were extracted from), used for the cache key.
+        Default: []
+
+    products : list of str
+        Files, directories or glob patterns (relative to cwd unless absolute) the stage makes on top of its
+        outputs that should be kept in the cache, e.g., all of nupipeline's "event_cl" directory.
+        Default: []
+    """
+    def __init__(self, name, command, inputs=[], outputs=[], after=[], cwd=None, label=None, test="", info="", env=None,
+                 cache=False, keyFiles=[], products=[]):
+        self.name = name
+        self.commands = command if type(command)==list else [command]
+        self.cwd = cwd
+        self.inputs = [self._path(f) for f in inputs]
+        self.outputs = [self._path(f) for f in outputs]
+        self.after = list(after)
+        self.label = label
+        self.test = test
+        self.info = info
+        self.env = env
+        self.cache = cache
+        self.keyFiles = [self._path(f) for f in keyFiles]
+        self.products = list(products)
+        self.status = None
+        self.key = None
+
+    def _path(self, f):
+        return os.path.abspath(f if (self.cwd is None) or os.path.isabs(f) else os.path.join(self.cwd, f))
+
+    def execute(self, profileFile=None):
+        """Run the command(s) of the stage.
+
+        Parameters
+        ----------
+        profileFile : str or None
+            Add a record of the resources each shell command used to this file (see stageProfile.py).
+            Default: None
+
+        Returns
+        -------
+        A tuple of (passed, log) where passed is True if every command worked and log is the text for the
+        log file (each command and its output, like normal_line, or the output only for a test stage).
+        """
+        log = ""
+        for command in self.commands:
+            if self.label is None:
+                log += str(command)+"\n"
+            if callable(command):
+                try:
+                    log += command(self.cwd)
+                except Exception as e:
+                    return False, log+f"{type(e).__name__}: {e}\n"
+            else:
+                name = self.name if self.label is None else f"Test{self.test}:{self.label.strip()}"
+                returncode, _, output = profileCommand(name, command, cwd=self.cwd, env=self.env, profileFile=profileFile,
+                                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                log += output
+                if returncode!=0:
+                    return False, log
+
+        missing = [f for f in self.outputs if not os.path.exists(f)]
+        if len(missing)>0:
+            return False, log+f"Expected output(s) not made: {missing}\n"
+        return True, log
+
+
+class Pipeline:
+    """A set of Stages that are run as soon as what they depend on has passed.
+
+    Parameters
+    ----------
+    termOutfile : str or None
+        The log file to add the output of each stage to (TERM_OUTFILE in test_heasoft_install.sh), None for no log.
+
+    max_workers : int or None
+        The most stages to run at the same time. None for as many as could run at once.
+        Default: None
+
+    cache : StageCache or None
+        The cache for stages with cache=True, None to always run them.
+        Default: None
+
+    profileFile : str or None
+        The file to record the resources used by each stage in (see stageProfile.py), None to not keep them.
+        Default: None
+
+    Example
+    -------
+    # screen both FPMs at the same time once nupipeline is done
+    pipeline = Pipeline("run.log")
+    pipeline.add(Stage("nupipeline", "nupipeline ...", outputs=["event_cl/nu80414202001A06_cl.evt", "event_cl/nu80414202001B06_cl.evt"], label="Get orbit and CHU EVT files (nupipeline)     ", test="1"))
+    pipeline.add(Stage("nuscreenA", "nuscreen ...", inputs=["event_cl/nu80414202001A06_cl.evt"], label="Screen counts to grade 0 (FPMA, nuscreen)   ", test="2a"))
+    pipeline.add(Stage("nuscreenB", "nuscreen ...", inputs=["event_cl/nu80414202001B06_cl.evt"], label="Screen counts to grade 0 (FPMB, nuscreen)   ", test="2b"))
+    allPassed = pipeline.run()
+    """
+    def __init__(self, termOutfile, max_workers=None, cache=None, profileFile=None):
+        self.termOutfile = termOutfile
+        self.max_workers = max_workers
+        self.cache = cache
+        self.profileFile = profileFile
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage):
+        """Add a Stage to the pipeline (and return it)."""
+        assert stage.name not in self.stages, f"There is already a stage called \'{stage.name}\'."
+        self.stages[stage.name] = stage
+        return stage
+
+    def dependencies(self):
+        """The names of the stages each stage has to wait for (from "after" and from the inputs/outputs)."""
+        makers = {}
+        for stage in self.stages.values():
+            for f in stage.outputs:
+                makers[f] = stage.name
+
+        depends = {}
+        for stage in self.stages.values():
+            unknown = [a for a in stage.after if a not in self.stages]
+            assert len(unknown)==0, f"Stage \'{stage.name}\' comes after unknown stage(s) {unknown}."
+            depends[stage.name] = set(stage.after)|{makers[f] for f in stage.inputs if (f in makers) and (makers[f]!=stage.name)}
+        self._order(depends)
+        return depends
+
+    @staticmethod
+    def _order(depends):
+        """The stage names in an order where every stage comes after the ones it depends on, making
+        sure no stage ends up waiting on itself."""
+        order, visiting = [], set()
+        def visit(name, path):
+            if name in order:
+                return
+            assert name not in visiting, f"Stages depend on each other in a loop: {' -> '.join(path+[name])}."
+            visiting.add(name)
+            for d in sorted(depends[name]):
+                visit(d, path+[name])
+            visiting.remove(name)
+            order.append(name)
+        for name in depends:
+            visit(name, [])
+        return order
+
+    def _stageKeys(self, depends):
+        """Give every stage its cache key, upstream stages first since their keys go into the later ones."""
+        made = {f for stage in self.stages.values() for f in stage.outputs}
+        for name in self._order(depends):
+            stage = self.stages[name]
+            external = [f for f in stage.inputs if f not in made]+stage.keyFiles
+            stage.key = self.cache.stageKey(stage, external, [self.stages[d].key for d in depends[name]])
+
+    def _print(self, stage, status):
+        """Print a test stage's line to the terminal, like test_line."""
+        colour = {"Running":RUNNING_C, "Passed":PASSED_C, "Failed":FAILED_C}[status]
+        with self._lock:
+            print(f"Test{stage.test}:{stage.label} - {DEFAULT_C}{colour}{status}{DEFAULT_C}", flush=True)
+
+    def _log(self, stage, passed, output):
+        """Add a finished stage's block to the log file in the same format as test_line/normal_line."""
+        if stage.label is None:
+            block = output+"\n\n\n"
+        else:
+            block = (f"Test{stage.test}:{stage.label} - Running\n"
+                     f"COMMAND:\n    {'; '.join([str(c) for c in stage.commands])}\n"
+                     "OUTPUT:\n"
+                     f"{stage.info}\n"
+                     f"{output}"
+                     f"Test{stage.test}:{stage.label} - {'Passed' if passed else 'Failed'}\n"
+                     "\n\n\n\n")
+        if self.termOutfile is not None:
+            with self._lock, open(self.termOutfile, "a") as log:
+                log.write(block)
+
+    def _runStage(self, stage):
+        """Run one stage, checking its inputs are there first."""
+        if stage.label is not None:
+            self._print(stage, "Running")
+
+        useCache = (self.cache is not None) and stage.cache
+        restored = self.cache.restore(stage, stage.key) if useCache else None
+        missing = [f for f in stage.inputs if not os.path.exists(f)]
+        if restored is not None:
+            passed, output = True, f"STAGE CACHE: hit {stage.key}, restored {restored} file(s).\n"
+        elif len(missing)>0:
+            passed, output = False, f"Missing input(s): {missing}\n"
+        else:
+            passed, output = stage.execute(profileFile=self.profileFile)
+            if useCache:
+                try:
+                    stored = f", stored {self.cache.store(stage, stage.key)} file(s)" if passed else ""
+                except OSError as e:
+                    stored = f", could not store the products ({e})"
+                output = f"STAGE CACHE: miss {stage.key}{stored}.\n"+output
+
+        self._log(stage, passed, output)
+        if stage.label is not None:
+            self._print(stage, "Passed" if passed else "Failed")
+        return passed
+
+    def _skip(self, stage, failed):
+        """Fail a stage without running it since a stage it depends on failed."""
+        if stage.label is not None:
+            self._print(stage, "Running")
+        self._log(stage, False, f"Not run as stage(s) {sorted(failed)} failed.\n")
+        if stage.label is not None:
+            self._print(stage, "Failed")
+
+    def run(self):
+        """Run all the stages, each one as soon as the stages it depends on have passed.
+
+        Returns
+        -------
+        True if every stage passed, False otherwise.
+        """
+        depends = self.dependencies()
+        if self.cache is not None:
+            self._stageKeys(depends)
+        waiting = dict(depends)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers if self.max_workers is not None else max(len(self.stages), 1)) as pool:
+            while (len(waiting)>0) or (len(running)>0):
+                # start everything that can start, in the order the stages were added
+                for name in [n for n in self.stages if n in waiting]:
+                    if any([self.stages[d].status is None for d in waiting[name]]):
+                        continue
+                    del waiting[name]
+                    failed = {d for d in depends[name] if not self.stages[d].status}
+                    if len(failed)>0:
+                        self._skip(self.stages[name], failed)
+                        self.stages[name].status = False
+                    else:
+                        running[pool.submit(self._runStage, self.stages[name])] = name
+
+                if len(running)==0:
+                    # only skipped stages this time round, go again to start anything waiting on them
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.stages[name].status = future.result()
+                    except Exception as e:
+                        self._log(self.stages[name], False, f"{type(e).__name__}: {e}\n")
+                        if self.stages[name].label is not None:
+                            self._print(self.stages[name], "Failed")
+                        self.stages[name].status = False
+
+        return all([s.status for s in self.stages.values()])
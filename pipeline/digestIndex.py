@@ -0,0 +1,255 @@
+import os
+import sys
+import gzip
+import json
+import fnmatch
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from productDiff import fitsProducts, IGNORE
+
+""" Work out a digest of every FITS product of a run that only changes if the science in it does.
+
+    Each file is walked block by block (FITS files are 2880 byte blocks: a header of 80 character cards ending with END,
+    then the data) without opening it with astropy. For each HDU the header cards are normalised (trailing spaces taken
+    off, keywords in IGNORE such as DATE, CHECKSUM, DATASUM, HISTORY and CREATOR left out) and hashed, and the data
+    (its size from BITPIX, NAXISn, PCOUNT and GCOUNT, not including the padding) is hashed with large sequential reads.
+    Files are hashed at the same time in a pool of threads (hashlib and file reads release the GIL).
+
+    The digests go to <run directory>/digests.json, with each file's size and modification time so a file is only
+    hashed again if it has changed. Comparing the digests of two runs is then a dictionary comparison that says which
+    products are identical and which need comparing with productDiff.py.
+
+    Run as, e.g.,
+        python3 digestIndex.py index ../benchmark
+        python3 digestIndex.py diff ../benchmark ../new2
+"""
+
+BLOCK = 2880
+CARD = 80
+READ_CHUNK = 1<<23
+INDEX_FILE = "digests.json"
+
+
+def _open(path):
+    return gzip.open(path, "rb") if path.lower().endswith(".gz") else open(path, "rb")
+
+
+def _cardValue(card):
+    """The value of a header card as a string (no comment or quotes)."""
+    return card[10:].split("/")[0].strip().strip("'").strip()
+
+
+def _readHeader(f):
+    """Read the next header from f as a list of 80 character cards (up to and including END), None at the end of the file."""
+    cards = []
+    while True:
+        block = f.read(BLOCK)
+        if len(block)==0 and len(cards)==0:
+            return None
+        if len(block)<BLOCK:
+            raise ValueError("The file ends part way through a header.")
+        block = block.decode("ascii", errors="replace")
+        for i in range(0, BLOCK, CARD):
+            cards.append(block[i:i+CARD])
+            if cards[-1][:8].rstrip()=="END":
+                return cards
+
+
+def dataSize(cards):
+    """The size (bytes, without the padding) of the data following a header.
+
+    Parameters
+    ----------
+    cards : list of str
+        The header cards.
+
+    Returns
+    -------
+    The number of bytes.
+    """
+    values = {c[:8].rstrip():_cardValue(c) for c in cards if c[8:10]=="= "}
+    naxis = int(values.get("NAXIS", 0))
+    if naxis==0:
+        return 0
+    axes = [int(values[f"NAXIS{n}"]) for n in range(1, naxis+1)]
+    # random groups have NAXIS1 = 0
+    if (values.get("GROUPS", "F")=="T") and (axes[0]==0):
+        axes = axes[1:]
+    size = 1
+    for a in axes:
+        size *= a
+    return abs(int(values["BITPIX"]))//8*int(values.get("GCOUNT", 1))*(int(values.get("PCOUNT", 0))+size)
+
+
+def normalisedHeader(cards, ignore=IGNORE):
+    """The header cards that are hashed: trailing spaces taken off, blank cards, END and keywords matching ignore left out."""
+    keep = []
+    for c in cards:
+        keyword = c[:8].rstrip()
+        if (c.strip()=="") or (keyword=="END") or any([fnmatch.fnmatchcase(keyword, i) for i in ignore]):
+            continue
+        keep.append(c.rstrip())
+    return keep
+
+
+def fitsDigest(path, ignore=IGNORE):
+    """The digest of every HDU of a FITS file.
+
+    Parameters
+    ----------
+    path : str
+        The FITS file (can be gzipped).
+
+    ignore : list of str
+        Header keywords (fnmatch patterns) to leave out of the header hashes.
+        Default: IGNORE
+
+    Returns
+    -------
+    A dictionary with "hdus" (for each HDU its "name", the sha256 of its normalised "header" and of its "data") and
+    "sha256", a digest of them all.
+    """
+    hdus = []
+    with _open(path) as f:
+        while True:
+            cards = _readHeader(f)
+            if cards is None:
+                break
+            header = "\n".join(normalisedHeader(cards, ignore=ignore))
+            names = [_cardValue(c) for c in cards if c[:8].rstrip()=="EXTNAME"]
+
+            size = dataSize(cards)
+            data = hashlib.sha256()
+            left = size
+            while left>0:
+                chunk = f.read(min(READ_CHUNK, left))
+                if len(chunk)==0:
+                    raise ValueError(f"{path} ends part way through the data of HDU {len(hdus)}.")
+                data.update(chunk)
+                left -= len(chunk)
+            # skip the padding to the end of the last block
+            f.read((-size)%BLOCK)
+
+            hdus.append({"name":names[0] if len(names)>0 else ("PRIMARY" if len(hdus)==0 else ""),
+                         "header":hashlib.sha256(header.encode()).hexdigest(), "data":data.hexdigest()})
+
+    total = hashlib.sha256(json.dumps([[h["header"], h["data"]] for h in hdus]).encode()).hexdigest()
+    return {"hdus":hdus, "sha256":total}
+
+
+def _loadIndex(indexFile):
+    try:
+        with open(indexFile, "r") as i:
+            return json.load(i)
+    except (OSError, ValueError):
+        return {}
+
+
+def digestIndex(runDir, ignore=IGNORE, max_workers=None, indexFile=None):
+    """Work out the digests of every FITS product of a run and write them to digests.json in the run directory.
+
+    Parameters
+    ----------
+    runDir : str
+        The run directory (e.g., benchmark).
+
+    ignore : list of str
+        See fitsDigest(). Files are hashed again if this changes.
+        Default: IGNORE
+
+    max_workers : int or None
+        Number of threads to hash files with. None for ThreadPoolExecutor's default.
+        Default: None
+
+    indexFile : str or None
+        Where to write the digests, None for <runDir>/digests.json.
+        Default: None
+
+    Returns
+    -------
+    A dictionary of each file's path in runDir and its "size", "mtime_ns", "stage", "hdus" and "sha256" (see fitsDigest()),
+    or "error" if it couldn't be read.
+    """
+    indexFile = os.path.join(runDir, INDEX_FILE) if indexFile is None else indexFile
+    known = _loadIndex(indexFile)
+    known = known.get("files", {}) if known.get("ignore")==list(ignore) else {}
+
+    def _digest(item):
+        path, stage = item
+        stat = os.stat(os.path.join(runDir, path))
+        old = known.get(path)
+        if (old is not None) and (old["size"]==stat.st_size) and (old["mtime_ns"]==stat.st_mtime_ns) and ("error" not in old):
+            return path, old
+        entry = {"size":stat.st_size, "mtime_ns":stat.st_mtime_ns, "stage":stage}
+        try:
+            entry.update(fitsDigest(os.path.join(runDir, path), ignore=ignore))
+        except (OSError, ValueError, KeyError, EOFError) as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+        return path, entry
+
+    # the biggest files first so one large event file isn't left until the end
+    products = sorted(fitsProducts(runDir).items(), key=lambda item: -os.path.getsize(os.path.join(runDir, item[0])))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        files = dict(sorted(pool.map(_digest, products)))
+
+    tmp = indexFile+f".tmp.{os.getpid()}"
+    with open(tmp, "w") as i:
+        json.dump({"ignore":list(ignore), "files":files}, i, indent=1)
+    os.replace(tmp, indexFile)
+    return files
+
+
+def diffIndexes(benchmark, new):
+    """Compare the digests of two runs.
+
+    Parameters
+    ----------
+    benchmark, new : dict
+        The output of digestIndex() for each run.
+
+    Returns
+    -------
+    A dictionary with the lists of paths that are the "same", "different" (including files that couldn't be read),
+    "only in benchmark" and "only in new", and for each different file the HDUs whose "header" or "data" differ
+    ("hdus").
+    """
+    both = [p for p in benchmark if p in new]
+    same = [p for p in both if ("error" not in benchmark[p]) and ("error" not in new[p]) and benchmark[p]["sha256"]==new[p]["sha256"]]
+    different = [p for p in both if p not in set(same)]
+
+    hdus = {}
+    for p in different:
+        b, n = benchmark[p].get("hdus", []), new[p].get("hdus", [])
+        changed = [f"HDU {h} ({bh['name']}) {part}" for h, (bh, nh) in enumerate(zip(b, n)) for part in ["header", "data"] if bh[part]!=nh[part]]
+        if len(b)!=len(n):
+            changed.append(f"{len(b)} HDUs -> {len(n)}")
+        hdus[p] = changed
+    return {"same":same, "different":different, "only in benchmark":[p for p in benchmark if p not in new],
+            "only in new":[p for p in new if p not in benchmark], "hdus":hdus}
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Digests of the FITS products of runs that ignore volatile header keywords.")
+    parser.add_argument("mode", choices=["index", "diff"], help="index: write <run>/digests.json for each run, diff: index two runs and compare them.")
+    parser.add_argument("runs", nargs="+", help="Run directories (the benchmark then the new run for diff).")
+    parser.add_argument("--ignore", nargs="*", default=IGNORE, help=f"Header keywords to leave out, fnmatch patterns allowed (default: {' '.join(IGNORE)}).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of threads to hash files with.")
+    args = parser.parse_args()
+
+    indexes = [digestIndex(r, ignore=args.ignore, max_workers=args.workers) for r in args.runs]
+    if args.mode=="index":
+        for r, index in zip(args.runs, indexes):
+            print(f"{r}: {len(index)} file(s), written to {os.path.join(r, INDEX_FILE)}")
+        sys.exit(0)
+
+    assert len(args.runs)==2, "diff needs a benchmark and a new run directory."
+    diff = diffIndexes(*indexes)
+    print(f"{len(diff['same'])} identical, {len(diff['different'])} different, {len(diff['only in benchmark'])} only in benchmark, {len(diff['only in new'])} only in new")
+    for p in diff["different"]:
+        print(f"    {p}: "+", ".join(diff["hdus"][p] if len(diff["hdus"][p])>0 else [indexes[0][p].get("error", indexes[1][p].get("error", "different"))]))
+    for kind in ["only in benchmark", "only in new"]:
+        for p in diff[kind]:
+            print(f"    {p}: {kind}")
+    sys.exit(0 if len(diff["same"])==len(indexes[0])==len(indexes[1]) else 1)
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import zlib
+import shutil
+import tarfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+""" Extract the downloaded NuSTAR data (w3browse-*.tar) and decompress the observation's .gz files in one go.
+
+    Replaces copying the tarball into the run directory, "tar -xf", "gunzip -r <OBSID>" and removing the tarball copy. The
+    tarball is read once as a stream (no copy), every member is written to disk once, and the .gz members under the OBSID
+    directory are decompressed as they come out of the tarball by a pool of threads (zlib releases the GIL so they run on
+    separate cores) while the next members are being read.
+
+    Run as, e.g.,
+        python3 extractTar.py w3browse-68892.tar ./ --obsid 80414202001
+"""
+
+CHUNK = 1<<20
+
+
+def _safePath(destination, name):
+    """Where a member goes, making sure it stays inside destination (no absolute paths or "..")."""
+    path = os.path.realpath(os.path.join(destination, name))
+    root = os.path.realpath(destination)
+    if os.path.commonpath([root, path])!=root:
+        raise ValueError(f"Tar member \'{name}\' would be extracted outside of {destination}.")
+    return path
+
+
+def _gunzipBytes(compressed, path, mode=None):
+    """Decompress gzip data (which can have more than one gzip member, like gunzip) into a file.
+
+    Parameters
+    ----------
+    compressed : bytes
+        The .gz file's contents.
+
+    path : str
+        The file to write the decompressed data to.
+
+    mode : int or None
+        Permissions to give the file.
+        Default: None
+
+    Returns
+    -------
+    The number of bytes written.
+    """
+    written = 0
+    with open(path, "wb") as out:
+        data = compressed
+        while len(data)>0:
+            gz = zlib.decompressobj(wbits=31)
+            # decompress at most CHUNK bytes at a time so a big file is never all in memory decompressed
+            tail = data
+            while not gz.eof:
+                chunk = gz.decompress(tail, CHUNK)
+                tail = gz.unconsumed_tail
+                if (len(chunk)==0) and (len(tail)==0):
+                    raise EOFError(f"Compressed data for {path} ended early.")
+                out.write(chunk)
+                written += len(chunk)
+            # anything after the end of this gzip member is the next member (or padding)
+            data = gz.unused_data.lstrip(b"\x00")
+    if mode is not None:
+        os.chmod(path, mode)
+    return written
+
+
+def extractTar(tarball, destination="./", obsid=None, max_workers=None, maxPending=None):
+    """Extract a tarball, decompressing the .gz files under the OBSID directory on the way out.
+
+    Parameters
+    ----------
+    tarball : str
+        The tar file (can itself be compressed, e.g., .tar.gz).
+
+    destination : str
+        The directory to extract into.
+        Default: "./"
+
+    obsid : str or None
+        Only .gz members inside this directory of the tarball are decompressed (like "gunzip -r <obsid>"),
+        None to decompress every .gz member.
+        Default: None
+
+    max_workers : int or None
+        The number of threads decompressing, None for the number of CPUs.
+        Default: None
+
+    maxPending : int or None
+        The most .gz members that can be held in memory waiting to be decompressed, None for twice max_workers.
+        Default: None
+
+    Returns
+    -------
+    A dictionary of "files" (number written), "read" (bytes of the tarball), "written" (bytes written),
+    and "time" (seconds).
+    """
+    start = time.time()
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    maxPending = 2*max_workers if maxPending is None else maxPending
+    os.makedirs(destination, exist_ok=True)
+
+    files, written = 0, 0
+    pending = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool, tarfile.open(tarball, "r|*") as tar:
+        for member in tar:
+            path = _safePath(destination, member.name)
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+                continue
+            if not member.isfile():
+                # links, devices, etc. aren't in the NuSTAR downloads
+                continue
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            parts = os.path.normpath(member.name).split(os.sep)
+            decompress = member.name.endswith(".gz") and ((obsid is None) or ((len(parts)>1) and (parts[0]==obsid)))
+            source = tar.extractfile(member)
+
+            if decompress:
+                # the member has to be read now (the stream moves on) but can be decompressed later
+                pending.append(pool.submit(_gunzipBytes, source.read(), path[:-3], member.mode))
+                # don't hold too many compressed files in memory, wait for the oldest
+                while len(pending)>=maxPending:
+                    written += pending.pop(0).result()
+                    files += 1
+            else:
+                with open(path, "wb") as out:
+                    shutil.copyfileobj(source, out, CHUNK)
+                os.chmod(path, member.mode)
+                written += member.size
+                files += 1
+
+        for p in pending:
+            written += p.result()
+            files += 1
+
+    return {"files":files, "read":os.path.getsize(tarball), "written":written, "time":time.time()-start}
+
+
+def throughput(stats):
+    """A line describing how fast the extraction went."""
+    t = max(stats["time"], 1e-9)
+    return (f"Extracted {stats['files']} file(s) in {stats['time']:.2f} s: "
+            f"read {stats['read']} bytes ({stats['read']/t:.3e} bytes/s), "
+            f"wrote {stats['written']} bytes ({stats['written']/t:.3e} bytes/s).")
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Stream a tarball out to disk, decompressing .gz members in parallel.")
+    parser.add_argument("tarball", help="The downloaded data, e.g., w3browse-68892.tar.")
+    parser.add_argument("destination", nargs="?", default="./", help="Directory to extract into (default: ./).")
+    parser.add_argument("--obsid", default=None, help="Only decompress .gz files inside this directory.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of decompressing threads.")
+    args = parser.parse_args()
+
+    stats = extractTar(args.tarball, args.destination, obsid=args.obsid, max_workers=args.workers)
+    print(throughput(stats))
+    sys.exit(0)
@@ -0,0 +1,189 @@
+import os
+import sys
+import argparse
+import tempfile
+
+from dag import Pipeline, Stage, Copy
+from stageCache import StageCache
+
+""" The stages of test_heasoft_install.sh (from nupipeline to plotting the XSPEC results) as a dependency graph.
+
+    After nupipeline the FPMA and FPMB branches (nuscreen, nuproducts, and the single FPM fits) don't depend on each other
+    so they are run at the same time, and the combined FPMA+FPMB fit starts once both spectra are ready. The terminal and
+    log output is the same as the shell script's except the XSPEC fits are tests 4a, 4b and 4ab.
+
+    With a stage cache (--cache <directory> --tarball <w3browse-*.tar>) the HEASoft stages (nupipeline, nuscreen, nuproducts)
+    reuse the products of an earlier run with the same tarball, OBSID, GTI and region files, parameters and $HEADAS instead of
+    running again (see stageCache.py).
+
+    Run from test_heasoft_install.sh with -p/--parallel (or -c/--cache), after the data have been extracted, or as
+        python3 nustarPipeline.py <run directory> <TERM_OUTFILE> --obsid 80414202001 --gti <gti file> --rega <reg file> --regb <reg file>
+"""
+
+STATUSEXPR = "STATUS==b0000xx00xx0xx000"
+
+
+def privatePfiles(directory):
+    """Environment with a parameter file directory only for this stage.
+
+    HEASoft tools write their parameters to a file in PFILES when they run so the same tool running twice at
+    the same time (e.g., nuscreen for FPMA and FPMB) would use the same file. Each stage gets its own user
+    directory in front of the system parameter files.
+
+    Parameters
+    ----------
+    directory : str
+        The directory for this stage's parameter files (created if needed).
+
+    Returns
+    -------
+    A copy of os.environ with PFILES set.
+    """
+    os.makedirs(directory, exist_ok=True)
+    pfiles = os.environ.get("PFILES", "")
+    system = pfiles.split(";")[-1] if ";" in pfiles else os.path.join(os.environ.get("HEADAS", ""), "syspfiles")
+    return dict(os.environ, PFILES=f"{directory};{system}")
+
+
+def nustarPipeline(runDir, termOutfile, obsid, gtiFile, regionFiles, pfilesDir, max_workers=None, cacheDir=None, tarball=None,
+                   profileFile=None):
+    """Build the pipeline for one run (a copy of replacement_directory).
+
+    Parameters
+    ----------
+    runDir : str
+        The run directory, e.g., $SCRIPT_DIR/benchmark, with the observation extracted into 2-nuproducts-test/<obsid>.
+
+    termOutfile : str
+        The log file (TERM_OUTFILE).
+
+    obsid : str
+        The NuSTAR observation ID.
+
+    gtiFile : str
+        The GTI file for nuproducts.
+
+    regionFiles : dict
+        The region file for each FPM, {"A":<file>, "B":<file>}.
+
+    pfilesDir : str
+        Directory to keep each HEASoft stage's parameter files in (see privatePfiles()).
+
+    max_workers : int or None
+        The most stages to run at the same time (see Pipeline).
+        Default: None
+
+    cacheDir : str or None
+        The stage cache directory, None to not use a cache.
+        Default: None
+
+    tarball : str or None
+        The downloaded data the observation was extracted from (needed for the cache key of nupipeline).
+        Default: None
+
+    profileFile : str or None
+        The file to record the resources used by each stage in (see stageProfile.py), None to not keep them.
+        Default: None
+
+    Returns
+    -------
+    The Pipeline, ready to run.
+    """
+    obsDir = os.path.join(runDir, "2-nuproducts-test", obsid)
+    eventDir = os.path.join(obsDir, "event_cl")
+    screenDir = os.path.join(runDir, "3-nuscreen-test")
+    productDir = os.path.join(runDir, "4-nuproducts-timeAndSpaceSelection-test")
+    xspecDir = os.path.join(runDir, "5-xspec-test")
+    resultDir = os.path.join(runDir, "6-xspec-test-result")
+    stem = f"nu{obsid}"
+    fpms = ["A", "B"]
+
+    assert (cacheDir is None) or (tarball is not None), "The tarball is needed to use the stage cache."
+    cache = None if cacheDir is None else StageCache(cacheDir, runDir)
+    pipeline = Pipeline(termOutfile, max_workers=max_workers, cache=cache, profileFile=profileFile)
+
+    # test nupipeline
+    common = [f"{stem}_att.fits", f"{stem}_mast.fits"]
+    perFpm = {m:[f"{stem}{m}_fpm.hk", f"{stem}{m}_det1.fits", f"{stem}{m}_oa.fits"] for m in fpms}
+    pipeline.add(Stage("nupipeline",
+                       f"nupipeline obsmode=SCIENCE_SC indir={obsDir} steminputs={stem} outdir=event_cl entrystage=1 exitstage=2 pntra=OBJECT pntdec=OBJECT statusexpr={STATUSEXPR} cleanflick=no hkevtexpr=NONE clobber=yes runsplitsc=yes splitmode=STRICT",
+                       outputs=[os.path.join("event_cl", f) for f in [f"{stem}{m}06_cl.evt" for m in fpms]+common+perFpm["A"]+perFpm["B"]],
+                       cwd=obsDir, label="Get orbit and CHU EVT files (nupipeline)     ", test="1",
+                       env=privatePfiles(os.path.join(pfilesDir, "nupipeline")),
+                       cache=True, keyFiles=[] if tarball is None else [tarball], products=["event_cl"]))
+
+    # move the files needed to filter with time and space
+    pipeline.add(Stage("copyCommon", [Copy(f"./{f}", screenDir+"/") for f in common],
+                       inputs=common, outputs=[os.path.join(screenDir, f) for f in common], cwd=eventDir))
+
+    for m in fpms:
+        # screen the event files, testing nuscreen
+        pipeline.add(Stage(f"nuscreen{m}",
+                           f"nuscreen infile={stem}{m}06_cl.evt gtiscreen=no evtscreen=yes gtiexpr=NONE gradeexpr=0 statusexpr=NONE outdir={screenDir}/ hkfile=./{stem}{m}_fpm.hk outfile={stem}{m}06_cl_grade0.evt",
+                           inputs=[f"{stem}{m}06_cl.evt", f"{stem}{m}_fpm.hk"], outputs=[os.path.join(screenDir, f"{stem}{m}06_cl_grade0.evt")],
+                           cwd=eventDir, label=f"Screen counts to grade 0 (FPM{m}, nuscreen)   ", test=f"2{m.lower()}",
+                           env=privatePfiles(os.path.join(pfilesDir, f"nuscreen{m}")), cache=True))
+
+        pipeline.add(Stage(f"copy{m}", [Copy(f"./{f}", screenDir+"/") for f in perFpm[m]],
+                           inputs=perFpm[m], outputs=[os.path.join(screenDir, f) for f in perFpm[m]], cwd=eventDir))
+
+        # filter w.r.t. time and space, testing nuproducts
+        spectrum = [f"{stem}{m}06_cl_grade0_sr.{ext}" for ext in ["pha", "arf", "rmf"]]
+        pipeline.add(Stage(f"nuproducts{m}",
+                           f"nuproducts indir=./ instrument=FPM{m} steminputs={stem} outdir=../4-nuproducts-timeAndSpaceSelection-test/ extended=no runmkarf=yes runmkrmf=yes infile={stem}{m}06_cl_grade0.evt bkgextract=no srcregionfile={regionFiles[m]} attfile=./{stem}_att.fits hkfile=./{stem}{m}_fpm.hk usrgtifile={gtiFile}",
+                           inputs=[f"{stem}{m}06_cl_grade0.evt"]+common+perFpm[m]+[gtiFile, regionFiles[m]],
+                           outputs=[os.path.join(productDir, f) for f in spectrum],
+                           cwd=screenDir, label=f"Filter to time and region (FPM{m}, nuproducts)", test=f"3{m.lower()}",
+                           env=privatePfiles(os.path.join(pfilesDir, f"nuproducts{m}")),
+                           cache=True, products=[os.path.join(productDir, f"{stem}{m}06_cl_grade0*")]))
+
+        # take the spectral files and move them to the XSPEC directory
+        pipeline.add(Stage(f"copySpectrum{m}", [Copy(f"./{f}", xspecDir+"/") for f in spectrum],
+                           inputs=spectrum, outputs=[os.path.join(xspecDir, f) for f in spectrum], cwd=productDir))
+
+    pipeline.add(Stage("createXcm", f"python3 create_xcm.py {obsid}",
+                       outputs=[f"apec1fit_{f}_cstat.xcm" for f in ["fpma", "fpmb", "fpmab"]], cwd=xspecDir))
+
+    # fit the data, testing XSPEC, each fit starts as soon as its spectra are there
+    fitResults = []
+    for fit, modules in [("fpma", ["A"]), ("fpmb", ["B"]), ("fpmab", ["A", "B"])]:
+        results = [f"mod_apec1fit_{fit}_cstat.{ext}" for ext in ["txt", "fits"]]
+        fitResults += results
+        pipeline.add(Stage(f"xspec_{fit}", f"python3 runXspec.py apec1fit_{fit}_cstat.xcm",
+                           inputs=[f"apec1fit_{fit}_cstat.xcm"]+[f"{stem}{m}06_cl_grade0_sr.{ext}" for m in modules for ext in ["pha", "arf", "rmf"]],
+                           outputs=results, cwd=xspecDir,
+                           label=f"Run XSPEC code ({fit.upper()}, xspec)".ljust(45), test=f"4{fit[3:]}",
+                           info=f"See log files in {xspecDir} directory."))
+
+        # take the products from fitting, ready to be plotted
+        pipeline.add(Stage(f"copyResult_{fit}", [Copy(f"./{f}", resultDir+"/") for f in results],
+                           inputs=results, outputs=[os.path.join(resultDir, f) for f in results], cwd=xspecDir))
+
+    # plot the fits to the data, testing the output of xspec makes sense
+    pipeline.add(Stage("plot", "python3 plotXspec.py", inputs=fitResults, cwd=resultDir,
+                       label="Plot XSPEC result (xspec)                    ", test="5",
+                       info=f"See plots in {resultDir} directory."))
+
+    return pipeline
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Run the HEASoft test stages as a dependency graph.")
+    parser.add_argument("runDir", help="The run directory (copy of replacement_directory) with the data extracted.")
+    parser.add_argument("termOutfile", help="The log file to add to.")
+    parser.add_argument("--obsid", default="80414202001", help="NuSTAR observation ID.")
+    parser.add_argument("--gti", required=True, help="GTI file for nuproducts.")
+    parser.add_argument("--rega", required=True, help="FPMA region file.")
+    parser.add_argument("--regb", required=True, help="FPMB region file.")
+    parser.add_argument("--workers", type=int, default=None, help="Most stages to run at the same time.")
+    parser.add_argument("--cache", default=None, help="Stage cache directory to reuse HEASoft products from.")
+    parser.add_argument("--tarball", default=None, help="The downloaded data (w3browse-*.tar), needed with --cache.")
+    parser.add_argument("--profile", default=os.environ.get("STAGE_PROFILE_FILE"), help="File to record each stage's resource use in (default: $STAGE_PROFILE_FILE).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="pfiles_") as pfilesDir:
+        pipeline = nustarPipeline(os.path.abspath(args.runDir), args.termOutfile, args.obsid, args.gti,
+                                  {"A":args.rega, "B":args.regb}, pfilesDir, max_workers=args.workers,
+                                  cacheDir=args.cache, tarball=args.tarball, profileFile=args.profile)
+        passed = pipeline.run()
+    sys.exit(0 if passed else 1)
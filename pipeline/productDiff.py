@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import fnmatch
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+""" Compare every FITS product of a benchmark run to a new run, stage by stage.
+
+    The run directories have the same stage directories as replacement_directory (2-nuproducts-test, the nupipeline
+    products under <OBSID>/event_cl, to 6-xspec-test-result). Both trees are walked, the FITS files (event lists, hk,
+    attitude, pha/arf/rmf, mod_*.fits, ...) are paired up by their path in the run directory and each pair is compared in
+    a pool of processes:
+        * the number and names of the HDUs,
+        * every header keyword other than those matching IGNORE (e.g., DATE, CHECKSUM, HISTORY), float values within
+          the tolerances,
+        * the data, floats within the tolerances (rtol, atol as in np.isclose) and everything else exactly, column by
+          column for tables.
+    The files are reported by stage in the order the stages run, so the first stage with differences shows which HEASoft
+    tool changed first.
+
+    Run as, e.g.,
+        python3 productDiff.py ../benchmark ../new2 --report product_diff.json
+"""
+
+STAGES = [("2-nuproducts-test", "nupipeline"),
+          ("3-nuscreen-test", "nuscreen"),
+          ("4-nuproducts-timeAndSpaceSelection-test", "nuproducts"),
+          ("5-xspec-test", "xspec"),
+          ("6-xspec-test-result", "xspec results")]
+FITS_EXTENSIONS = (".fits", ".fit", ".fts", ".evt", ".hk", ".att", ".pha", ".arf", ".rmf", ".img", ".lc", ".gti")
+IGNORE = ["DATE", "CHECKSUM", "DATASUM", "HISTORY", "CREATOR", "PROCVER", "SOFTVER"]
+SKIP_DIRS = [".xspec_cache", "__pycache__"]
+
+
+def isFits(name):
+    """Is the file a FITS product (by its extension, optionally gzipped)?"""
+    name = name.lower()
+    return (name[:-3] if name.endswith(".gz") else name).endswith(FITS_EXTENSIONS)
+
+
+def fitsProducts(runDir):
+    """Every FITS file under the stage directories of a run.
+
+    Parameters
+    ----------
+    runDir : str
+        The run directory (e.g., benchmark).
+
+    Returns
+    -------
+    A dictionary of each file's path in runDir and its stage directory.
+    """
+    products = {}
+    for stage, _ in STAGES:
+        for root, dirs, files in os.walk(os.path.join(runDir, stage)):
+            dirs[:] = sorted([d for d in dirs if d not in SKIP_DIRS])
+            for f in sorted(files):
+                if isFits(f):
+                    products[os.path.relpath(os.path.join(root, f), runDir)] = stage
+    return products
+
+
+def _ignored(keyword, ignore):
+    return any([fnmatch.fnmatchcase(keyword, i) for i in ignore])
+
+
+def _close(a, b, rtol, atol):
+    """Are two values (or arrays) the same, floats within the tolerances and anything else exactly?"""
+    a, b = np.asarray(a), np.asarray(b)
+    if a.shape!=b.shape:
+        return False
+    if np.issubdtype(a.dtype, np.floating) or np.issubdtype(b.dtype, np.floating):
+        return bool(np.all(np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True)))
+    return bool(np.array_equal(a, b))
+
+
+def compareHeaders(benchmark, new, ignore=IGNORE, rtol=0, atol=0):
+    """The differences between two FITS headers.
+
+    Parameters
+    ----------
+    benchmark, new : astropy.io.fits.Header
+        The headers.
+
+    ignore : list of str
+        Keywords (fnmatch patterns, e.g., "DATE*") to leave out.
+        Default: IGNORE
+
+    rtol, atol : float
+        Tolerances for float values.
+        Default: 0
+
+    Returns
+    -------
+    A list of strings describing each difference.
+    """
+    def _cards(header):
+        cards = {}
+        for card in header.cards:
+            if (card.keyword=="") or _ignored(card.keyword, ignore):
+                continue
+            # repeated keywords (e.g., COMMENT) are compared in order
+            cards.setdefault(card.keyword, []).append(card.value)
+        return cards
+
+    b, n = _cards(benchmark), _cards(new)
+    differences = [f"keyword {k} only in benchmark" for k in b if k not in n]
+    differences += [f"keyword {k} only in new" for k in n if k not in b]
+    for k in [k for k in b if k in n]:
+        same = len(b[k])==len(n[k])
+        for x, y in zip(b[k], n[k]):
+            if isinstance(x, float) and isinstance(y, (int, float)) and not isinstance(y, bool):
+                same &= _close(x, y, rtol, atol)
+            else:
+                same &= x==y
+        if not same:
+            differences.append(f"keyword {k}: {b[k][0] if len(b[k])==1 else b[k]} -> {n[k][0] if len(n[k])==1 else n[k]}")
+    return differences
+
+
+def _columnValues(column):
+    """A table column as one array (variable-length arrays are joined together, with their lengths)."""
+    if column.dtype==object:
+        lengths = np.array([np.size(c) for c in column])
+        return lengths, (np.concatenate([np.ravel(c) for c in column]) if len(column)>0 else np.empty(0))
+    return None, np.asarray(column)
+
+
+def compareData(benchmark, new, rtol=0, atol=0):
+    """The differences between the data of two HDUs.
+
+    Parameters
+    ----------
+    benchmark, new : astropy.io.fits HDUs
+        The HDUs.
+
+    rtol, atol : float
+        Tolerances for float values.
+        Default: 0
+
+    Returns
+    -------
+    A list of strings describing each difference.
+    """
+    b, n = benchmark.data, new.data
+    if (b is None) or (n is None):
+        return [] if (b is None) and (n is None) else ["data only in "+("new" if b is None else "benchmark")]
+
+    if not hasattr(b, "columns"):
+        # an image
+        if b.shape!=n.shape:
+            return [f"image shape {b.shape} -> {n.shape}"]
+        if _close(b, n, rtol, atol):
+            return []
+        with np.errstate(invalid="ignore"):
+            diff = np.abs(np.asarray(n, dtype=np.float64)-np.asarray(b, dtype=np.float64))
+        return [f"image differs in {int(np.sum(~np.isclose(b, n, rtol=rtol, atol=atol, equal_nan=True)))} pixels, max |diff| {np.nanmax(diff):.3g}"]
+
+    differences = []
+    if len(b)!=len(n):
+        differences.append(f"rows {len(b)} -> {len(n)}")
+    b_names, n_names = b.columns.names, n.columns.names
+    differences += [f"column {c} only in benchmark" for c in b_names if c not in n_names]
+    differences += [f"column {c} only in new" for c in n_names if c not in b_names]
+    if len(b)!=len(n):
+        return differences
+
+    # column by column so only one column of each file is in memory at a time
+    for c in [c for c in b_names if c in n_names]:
+        (b_lengths, b_values), (n_lengths, n_values) = _columnValues(b[c]), _columnValues(n[c])
+        if (b_lengths is not None) and ((n_lengths is None) or not np.array_equal(b_lengths, n_lengths)):
+            differences.append(f"column {c} row lengths differ")
+        elif not _close(b_values, n_values, rtol, atol):
+            if b_values.shape!=n_values.shape:
+                differences.append(f"column {c} shape {b_values.shape} -> {n_values.shape}")
+            else:
+                numeric = np.issubdtype(b_values.dtype, np.number) and np.issubdtype(n_values.dtype, np.number)
+                different = ~np.isclose(b_values, n_values, rtol=rtol, atol=atol, equal_nan=True) if numeric else b_values!=n_values
+                # variable-length columns are counted by element, the rest by row
+                where = f"{int(different.sum())} elements" if b_lengths is not None else f"{int(different.reshape(len(b), -1).any(axis=1).sum())} rows"
+                largest = f", max |diff| {np.nanmax(np.abs(n_values[different].astype(np.float64)-b_values[different].astype(np.float64))):.3g}" if numeric else ""
+                differences.append(f"column {c} differs in {where}{largest}")
+    return differences
+
+
+def compareFiles(benchmarkFile, newFile, ignore=IGNORE, rtol=0, atol=0):
+    """Compare two FITS files HDU by HDU.
+
+    Parameters
+    ----------
+    benchmarkFile, newFile : str
+        The files.
+
+    ignore, rtol, atol :
+        See compareHeaders() and compareData().
+
+    Returns
+    -------
+    A list of strings describing each difference (each starting with the HDU), [] if they're the same.
+    """
+    # astropy is only needed in the worker processes
+    from astropy.io import fits
+
+    try:
+        with fits.open(benchmarkFile, memmap=True) as b, fits.open(newFile, memmap=True) as n:
+            differences = [] if len(b)==len(n) else [f"{len(b)} HDUs -> {len(n)}"]
+            for h, (bh, nh) in enumerate(zip(b, n)):
+                name = f"HDU {h} ({bh.name})"
+                if bh.name!=nh.name:
+                    differences.append(f"{name}: name {bh.name} -> {nh.name}")
+                differences += [f"{name}: {d}" for d in compareHeaders(bh.header, nh.header, ignore=ignore, rtol=rtol, atol=atol)]
+                differences += [f"{name}: {d}" for d in compareData(bh, nh, rtol=rtol, atol=atol)]
+    except Exception as e:
+        # a broken or unreadable file is a difference, not a reason to stop comparing the rest
+        return [f"could not compare: {type(e).__name__}: {e}"]
+    return differences
+
+
+def _compareProduct(args):
+    path, benchmarkDir, newDir, ignore, rtol, atol = args
+    return path, compareFiles(os.path.join(benchmarkDir, path), os.path.join(newDir, path), ignore=ignore, rtol=rtol, atol=atol)
+
+
+def productDiff(benchmarkDir, newDir, ignore=IGNORE, rtol=0, atol=0, max_workers=None, paths=None):
+    """Compare the FITS products of two runs, every file pair in parallel.
+
+    Parameters
+    ----------
+    benchmarkDir, newDir : str
+        The run directories.
+
+    ignore, rtol, atol :
+        See compareHeaders() and compareData().
+
+    max_workers : int or None
+        Number of processes to compare files with. None for as many as there are CPUs.
+        Default: None
+
+    paths : list of str or None
+        Only compare these files (paths in the run directories), the others in both runs are taken to be the same (e.g.,
+        they have the same digest, see digestIndex.py). None to compare all of them.
+        Default: None
+
+    Returns
+    -------
+    A list of dictionaries, one for each stage in STAGES order, with the "stage" directory, the "tool", the number of
+    "files" and "different" files, and "results", a dictionary of each file's path and a dictionary with its "status"
+    ("same", "different", "only in benchmark" or "only in new") and "differences".
+    """
+    benchmark, new = fitsProducts(benchmarkDir), fitsProducts(newDir)
+    both = [p for p in benchmark if p in new]
+    results = {}
+    if paths is not None:
+        results.update({p:{"status":"same", "differences":[]} for p in both if p not in set(paths)})
+        both = [p for p in both if p in set(paths)]
+
+    results.update({p:{"status":"only in benchmark", "differences":[]} for p in benchmark if p not in new})
+    results.update({p:{"status":"only in new", "differences":[]} for p in new if p not in benchmark})
+    # the biggest files first so one large event file isn't left until the end
+    both.sort(key=lambda p: -os.path.getsize(os.path.join(benchmarkDir, p)))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for path, differences in pool.map(_compareProduct, [(p, benchmarkDir, newDir, ignore, rtol, atol) for p in both]):
+            results[path] = {"status":"different" if len(differences)>0 else "same", "differences":differences}
+
+    stageOf = {**benchmark, **new}
+    stages = []
+    for stage, tool in STAGES:
+        stageResults = {p:results[p] for p in sorted(results) if stageOf[p]==stage}
+        stages.append({"stage":stage, "tool":tool, "files":len(stageResults),
+                       "different":sum([r["status"]!="same" for r in stageResults.values()]), "results":stageResults})
+    return stages
+
+
+def printReport(stages, maxLines=5):
+    """Print the differences stage by stage and which stage first had any, returns True if there were none."""
+    first = None
+    for s in stages:
+        print(f"{s['stage']} ({s['tool']}): {s['files']-s['different']}/{s['files']} file(s) the same")
+        for path, r in s["results"].items():
+            if r["status"]=="same":
+                continue
+            print(f"    {path}: {r['status']}")
+            for d in r["differences"][:maxLines]:
+                print(f"        {d}")
+            if len(r["differences"])>maxLines:
+                print(f"        ... and {len(r['differences'])-maxLines} more")
+        if (first is None) and (s["different"]>0):
+            first = s
+    print("No differences." if first is None else f"First stage with differences: {first['stage']} ({first['tool']})")
+    return first is None
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Compare the FITS products of a benchmark run and a new run, stage by stage.")
+    parser.add_argument("benchmark", help="Benchmark run directory.")
+    parser.add_argument("new", help="New run directory.")
+    parser.add_argument("--ignore", nargs="*", default=IGNORE, help=f"Header keywords to ignore, fnmatch patterns allowed (default: {' '.join(IGNORE)}).")
+    parser.add_argument("--rtol", type=float, default=0, help="Relative tolerance for floats (default: 0).")
+    parser.add_argument("--atol", type=float, default=0, help="Absolute tolerance for floats (default: 0).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes to compare files with.")
+    parser.add_argument("--report", default=None, help="Write a .json report to this file.")
+    parser.add_argument("--digests", action="store_true", help="Only compare the files whose digests differ (see digestIndex.py).")
+    args = parser.parse_args()
+
+    paths = None
+    if args.digests:
+        from digestIndex import digestIndex, diffIndexes
+        paths = diffIndexes(digestIndex(args.benchmark, ignore=args.ignore, max_workers=args.workers),
+                            digestIndex(args.new, ignore=args.ignore, max_workers=args.workers))["different"]
+        print(f"{len(paths)} file(s) with different digests to compare.")
+
+    stages = productDiff(args.benchmark, args.new, ignore=args.ignore, rtol=args.rtol, atol=args.atol, max_workers=args.workers, paths=paths)
+    same = printReport(stages)
+    if args.report is not None:
+        with open(args.report, "w") as rep:
+            json.dump({"benchmark":args.benchmark, "new":args.new, "same":same, "stages":stages}, rep, indent=1)
+    sys.exit(0 if same else 1)
@@ -0,0 +1,217 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import threading
+
+""" Keep the products of pipeline stages so a stage that is run again with exactly the same inputs can be skipped.
+
+    Each stage gets a key, a sha256 hash of:
+        * its command(s) (with the run directory replaced so benchmark and new runs can share the cache),
+        * the contents of any files it reads that no other stage makes (e.g., the downloaded tarball, GTI and region files),
+        * the HEASoft version in use ($HEADAS),
+        * the keys of the stages it depends on.
+    So a stage's key changes if anything upstream of it changes. The files a stage makes are stored once in the cache
+    directory under their key and hard linked (or copied if that isn't possible) into the run directory on later runs.
+
+    The hashes of large files (e.g., the tarball) are remembered by their path, size and modification time so they are
+    only worked out once.
+"""
+
+RUN_DIR = "<RUN_DIR>"
+HASH_CHUNK = 1<<22
+
+
+class StageCache:
+    """A directory of stage products, stored by stage key.
+
+    Parameters
+    ----------
+    directory : str
+        Where to keep the cache (created if needed).
+
+    runDir : str
+        The run directory (e.g., $SCRIPT_DIR/benchmark), replaced in the commands when making the keys.
+
+    link : bool
+        Hard link the cached files into the run directory instead of copying them (falls back to copying
+        if the cache is on a different file system).
+        Default: True
+
+    Example
+    -------
+    # run the pipeline, reusing the products of any stages already run with the same inputs
+    cache = StageCache("stage_cache", "benchmark")
+    pipeline = Pipeline("run.log", cache=cache)
+    """
+    def __init__(self, directory, runDir, link=True):
+        self.directory = os.path.abspath(directory)
+        self.runDir = os.path.abspath(runDir)
+        self.link = link
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._digestFile = os.path.join(self.directory, "digests.json")
+        self._digests = self._loadDigests()
+        self._lock = threading.Lock()
+
+    def _loadDigests(self):
+        try:
+            with open(self._digestFile, "r") as d:
+                return json.load(d)
+        except (OSError, ValueError):
+            return {}
+
+    def fileDigest(self, path):
+        """The sha256 of a file's contents, only read again if its size or modification time has changed.
+
+        Parameters
+        ----------
+        path : str
+            The file.
+
+        Returns
+        -------
+        The hex digest (or "missing" if the file doesn't exist).
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return "missing"
+
+        with self._lock:
+            known = self._digests.get(path)
+        if (known is not None) and (known["size"]==stat.st_size) and (known["mtime_ns"]==stat.st_mtime_ns):
+            return known["sha256"]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                sha.update(chunk)
+
+        with self._lock:
+            self._digests[path] = {"size":stat.st_size, "mtime_ns":stat.st_mtime_ns, "sha256":sha.hexdigest()}
+            tmp = self._digestFile+f".tmp.{os.getpid()}"
+            with open(tmp, "w") as d:
+                json.dump(self._digests, d)
+            os.replace(tmp, self._digestFile)
+        return sha.hexdigest()
+
+    def _normalise(self, text):
+        """Replace the run directory so the same stage in different runs gives the same key."""
+        return str(text).replace(self.runDir, RUN_DIR)
+
+    def stageKey(self, stage, externalFiles, upstreamKeys):
+        """Work out a stage's key.
+
+        Parameters
+        ----------
+        stage : Stage
+            The stage.
+
+        externalFiles : list of str
+            Files the stage reads that no other stage makes (their contents go into the key).
+
+        upstreamKeys : list of str
+            The keys of the stages this one depends on.
+
+        Returns
+        -------
+        The key (hex sha256).
+        """
+        key = {"commands":[self._normalise(c) for c in stage.commands],
+               "files":{self._normalise(os.path.abspath(f)):self.fileDigest(f) for f in sorted(externalFiles)},
+               "headas":os.environ.get("HEADAS", ""),
+               "upstream":sorted(upstreamKeys)}
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _products(self, stage):
+        """The files a stage made: its outputs and anything matching its products (files or directories)."""
+        files = set(stage.outputs)
+        for pattern in stage.products:
+            for match in glob.glob(stage._path(pattern)):
+                if os.path.isdir(match):
+                    files |= {os.path.join(root, f) for root,_,names in os.walk(match) for f in names}
+                else:
+                    files.add(match)
+        return sorted([f for f in files if os.path.isfile(f)])
+
+    def restore(self, stage, key):
+        """Put a stage's cached products into the run directory.
+
+        Parameters
+        ----------
+        stage : Stage
+            The stage.
+
+        key : str
+            The stage's key.
+
+        Returns
+        -------
+        The number of files restored, or None if the stage isn't in the cache.
+        """
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, "stage.json"), "r") as s:
+                files = json.load(s)["files"]
+        except (OSError, ValueError):
+            return None
+
+        for f in files:
+            source = os.path.join(entry, "files", f)
+            destination = os.path.join(self.runDir, f)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            if os.path.lexists(destination):
+                os.remove(destination)
+            if self.link:
+                try:
+                    os.link(source, destination)
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(source, destination)
+        return len(files)
+
+    def store(self, stage, key):
+        """Keep a (passed) stage's products in the cache.
+
+        Only files inside the run directory are kept. The cache entry is built in a temporary directory and
+        renamed into place so a half-stored stage is never used.
+
+        Parameters
+        ----------
+        stage : Stage
+            The stage.
+
+        key : str
+            The stage's key.
+
+        Returns
+        -------
+        The number of files stored.
+        """
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return 0
+
+        files = [os.path.relpath(f, self.runDir) for f in self._products(stage) if f.startswith(self.runDir+os.sep)]
+        tmp = entry+f".tmp.{os.getpid()}.{threading.get_ident()}"
+        for f in files:
+            destination = os.path.join(tmp, "files", f)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copy2(os.path.join(self.runDir, f), destination)
+        os.makedirs(tmp, exist_ok=True)
+        with open(os.path.join(tmp, "stage.json"), "w") as s:
+            json.dump({"stage":stage.name, "commands":[self._normalise(c) for c in stage.commands], "files":files}, s, indent=1)
+
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # stored by another run in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+        return len(files)
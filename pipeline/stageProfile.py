@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import argparse
+import threading
+import subprocess
+
+""" Record the resources each stage of the test uses: wall time, user and system CPU time, peak memory, and bytes read and written.
+
+    The CPU time, the peak RSS of the largest single process and the blocks read/written come from the kernel when the stage's
+    process is waited for (os.wait4) so they include every process the stage started (once they have finished). The peak RSS
+    of the whole process tree at any one time is found by sampling /proc (Linux only, None elsewhere). Each stage adds a record
+    to a JSON file (test_heasoft_install.sh puts it next to the run log) that can be printed as a table at the end of the run.
+
+    Run as, e.g.,
+        python3 stageProfile.py run --name "Test1:nupipeline" --profile run_stage_profile.json -- nupipeline ...
+        python3 stageProfile.py run --name "./apec1fit_fpma_cstat.xcm" --kind fit --profile run_stage_profile.json -- xspec
+        python3 stageProfile.py summary run_stage_profile.json
+"""
+
+# ru_inblock/ru_oublock count 512 byte blocks
+BLOCK_SIZE = 512
+# ru_maxrss is in kilobytes on Linux (bytes on macOS)
+MAXRSS_UNIT = 1 if sys.platform=="darwin" else 1024
+
+
+def _children():
+    """Map of each process id to the ids of its children, from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as s:
+                # the process name is in brackets and can have spaces so split after it
+                ppid = int(s.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def treeRss(pid, includeRoot=True):
+    """The total resident memory (bytes) of a process and all of its descendants right now.
+
+    Parameters
+    ----------
+    pid : int
+        The process at the top of the tree.
+
+    includeRoot : bool
+        Count the memory of pid itself, or only its descendants.
+        Default: True
+
+    Returns
+    -------
+    The total RSS in bytes (0 if the processes can't be read).
+    """
+    children = _children()
+    tree, todo = [], [pid]
+    while len(todo)>0:
+        p = todo.pop()
+        tree.append(p)
+        todo += children.get(p, [])
+
+    total = 0
+    for p in tree if includeRoot else tree[1:]:
+        try:
+            with open(f"/proc/{p}/statm", "r") as s:
+                total += int(s.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class RssSampler:
+    """Keep track of the peak total RSS of a process tree in a background thread.
+
+    Parameters
+    ----------
+    pid : int
+        The process at the top of the tree.
+
+    interval : float
+        Seconds between samples.
+        Default: 0.1
+
+    includeRoot : bool
+        See treeRss().
+        Default: True
+
+    Example
+    -------
+    with RssSampler(process.pid) as sampler:
+        process.wait()
+    sampler.peak
+    """
+    def __init__(self, pid, interval=0.1, includeRoot=True):
+        self.pid = pid
+        self.interval = interval
+        self.includeRoot = includeRoot
+        self.peak = None if not os.path.isdir("/proc") else 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while True:
+            self.peak = max(self.peak, treeRss(self.pid, includeRoot=self.includeRoot))
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def appendProfile(profileFile, record):
+    """Add a record to a profile file, safe for many processes adding records at the same time.
+
+    Parameters
+    ----------
+    profileFile : str
+        The JSON file (a list of records), created if it isn't there.
+
+    record : dict
+        The record to add.
+
+    Returns
+    -------
+    None.
+    """
+    with open(profileFile, "a+") as p:
+        fcntl.flock(p, fcntl.LOCK_EX)
+        p.seek(0)
+        text = p.read()
+        records = json.loads(text) if len(text.strip())>0 else []
+        records.append(record)
+        p.seek(0)
+        p.truncate()
+        json.dump(records, p, indent=1)
+        p.flush()
+        fcntl.flock(p, fcntl.LOCK_UN)
+
+
+def profileCommand(name, command, cwd=None, env=None, profileFile=None, interval=0.1, kind="stage", stdout=None, stderr=None):
+    """Run a command and record the resources it used.
+
+    Parameters
+    ----------
+    name : str
+        What to call the stage in the profile.
+
+    command : str or list of str
+        The command, a string is run by the shell.
+
+    cwd, env :
+        Passed to subprocess.Popen.
+        Default: None
+
+    profileFile : str or None
+        The profile file to add the record to, None to only return it.
+        Default: None
+
+    interval : float
+        Seconds between samples of the process tree's memory.
+        Default: 0.1
+
+    kind : str
+        The type of record, e.g., "stage" or "fit".
+        Default: "stage"
+
+    stdout, stderr :
+        Passed to subprocess.Popen (e.g., subprocess.PIPE).
+        Default: None
+
+    Returns
+    -------
+    A tuple of (returncode, record, output) where output is the command's stdout if stdout=subprocess.PIPE
+    (None otherwise).
+    """
+    start = time.time()
+    process = subprocess.Popen(command, shell=type(command)==str, cwd=cwd, env=env,
+                               stdout=stdout, stderr=stderr, universal_newlines=True)
+    output = None
+    with RssSampler(process.pid, interval=interval) as sampler:
+        if stdout==subprocess.PIPE:
+            output = process.stdout.read()
+        # wait4 (not process.wait()) so the rusage of the stage's whole process tree comes back as well
+        _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.time()-start
+
+    record = {"name":name,
+              "kind":kind,
+              "command":command if type(command)==str else " ".join(command),
+              "cwd":os.path.abspath("./" if cwd is None else cwd),
+              "returncode":process.returncode,
+              "start":start,
+              "wall":wall,
+              "user":usage.ru_utime,
+              "sys":usage.ru_stime,
+              "max_rss":usage.ru_maxrss*MAXRSS_UNIT,
+              "tree_rss_peak":sampler.peak,
+              "read_bytes":usage.ru_inblock*BLOCK_SIZE,
+              "write_bytes":usage.ru_oublock*BLOCK_SIZE}
+    if profileFile is not None:
+        appendProfile(profileFile, record)
+    return process.returncode, record, output
+
+
+def summary(profileFile):
+    """Print a table of the records in a profile file.
+
+    Parameters
+    ----------
+    profileFile : str
+        The profile file.
+
+    Returns
+    -------
+    None.
+    """
+    if not os.path.isfile(profileFile):
+        print(f"No stages have been profiled ({profileFile} does not exist).")
+        return
+
+    with open(profileFile, "r") as p:
+        records = json.load(p)
+
+    def _mb(x):
+        return "-" if x is None else f"{x/2**20:.1f}"
+
+    _l = max([len(r["name"]) for r in records]+[len("Total (stages)")])
+    print("Stage".ljust(_l)+"    Wall [s]    User [s]     Sys [s]    Peak RSS [MB]    Tree RSS [MB]    Read [MB]    Written [MB]")
+    for r in records:
+        print(f"{r['name'].ljust(_l)}    {r['wall']:>8.2f}    {r['user']:>8.2f}    {r['sys']:>8.2f}    {_mb(r['max_rss']):>13}"
+              f"    {_mb(r['tree_rss_peak']):>13}    {_mb(r['read_bytes']):>9}    {_mb(r['write_bytes']):>12}")
+    stages = [r for r in records if r["kind"]=="stage"]
+    print(f"{'Total (stages)'.ljust(_l)}    {sum([r['wall'] for r in stages]):>8.2f}    {sum([r['user'] for r in stages]):>8.2f}    {sum([r['sys'] for r in stages]):>8.2f}")
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Profile the stages of the HEASoft test.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    run = sub.add_parser("run", help="Run a command and add its profile to a file.")
+    run.add_argument("--name", required=True, help="Name of the stage.")
+    run.add_argument("--profile", required=True, help="The profile file.")
+    run.add_argument("--kind", default="stage", help="The type of record, e.g., stage or fit (default: stage).")
+    run.add_argument("command", nargs=argparse.REMAINDER, help="The command (after --).")
+    summ = sub.add_parser("summary", help="Print a table of a profile file.")
+    summ.add_argument("profile", help="The profile file.")
+    args = parser.parse_args()
+
+    if args.action=="run":
+        command = args.command[1:] if (len(args.command)>0) and (args.command[0]=="--") else args.command
+        try:
+            returncode, _, _ = profileCommand(args.name.strip(), command, profileFile=args.profile, kind=args.kind)
+        except FileNotFoundError as e:
+            # same as the shell when the command isn't there
+            print(e, file=sys.stderr)
+            returncode = 127
+        sys.exit(returncode)
+    else:
+        summary(args.profile)
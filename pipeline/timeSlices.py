@@ -0,0 +1,384 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+from dag import Pipeline, Stage, Copy
+from stageCache import StageCache
+from nustarPipeline import privatePfiles
+
+""" Time-resolved spectroscopy: split the GTI into slices and run nuproducts and the XSPEC fits for every slice at once.
+
+    The GTI used for the whole observation (e.g., analysis_selections/good_time_interval/time_gti.fits) is split into
+    slices, either
+        * a number of slices or a duration (s) for each, counting only the good time, or
+        * a number of counts for each slice, from the grade 0 events (FPMA and FPMB) in 3-nuscreen-test that are in
+          the GTI (the whole field of view, not just the region, so it is a rough target).
+    If the time or counts left over for the last slice are less than half a slice they are added to the one before.
+    Each slice's GTI is written in the same format as the original (its header with the rows and TSTART/TSTOP/ONTIME
+    changed) to 4-nuproducts-timeAndSpaceSelection-test/slices/<slice>/.
+
+    A run directory that has been through nuscreen (e.g., benchmark after test_heasoft_install.sh) is needed. For every
+    slice and FPM a nuproducts stage makes the spectrum in the slice's directory, the spectra are copied to
+    5-xspec-test/slices/<slice>/ and create_xcm.py and runXspec.py are run there, the same fits as the full observation.
+    All of the stages go in one Pipeline (see dag.py) so they run in a pool of --workers at a time, each fit starting as
+    soon as its spectra are ready. The fitted parameters of every slice are then collected into one numpy structured
+    array, a row for each slice in time order, by 6-xspec-test-result/fitTable.py and saved to
+    6-xspec-test-result/time_slices.npy.
+
+    Run as, e.g.,
+        python3 timeSlices.py ../benchmark ../run_benchmark_time_slices.log --gti <gti file> --rega <reg file> --regb <reg file> --slices 4
+        python3 timeSlices.py ../benchmark ../run_benchmark_time_slices.log --gti <gti file> --rega <reg file> --regb <reg file> --counts 2000
+"""
+
+FITS = ["fpma", "fpmb", "fpmab"]
+SLICE_DIR = "slices"
+TABLE_FILE = "time_slices.npy"
+
+
+def readGti(gtiFile):
+    """The START and STOP times (s) of a GTI file's first table (sorted by START).
+
+    Parameters
+    ----------
+    gtiFile : str
+        The GTI file.
+
+    Returns
+    -------
+    A tuple of the start and stop arrays.
+    """
+    # astropy is only needed to read and write the GTIs
+    from astropy.io import fits
+
+    with fits.open(gtiFile) as hdul:
+        data = [h for h in hdul if isinstance(h, fits.BinTableHDU)][0].data
+        start, stop = np.array(data["START"], dtype=np.float64), np.array(data["STOP"], dtype=np.float64)
+    order = np.argsort(start)
+    return start[order], stop[order]
+
+
+def clipGti(start, stop, low, high):
+    """The part of the GTI between the times low and high, as (start, stop) arrays."""
+    start, stop = np.maximum(start, low), np.minimum(stop, high)
+    keep = stop>start
+    return start[keep], stop[keep]
+
+
+def _mergeLast(boundaries, amounts, size):
+    """Take out the last boundary if less than half a slice (amounts[-1]<size/2) comes after it."""
+    if (len(boundaries)>2) and (amounts[-1]<size/2):
+        return np.delete(boundaries, -2)
+    return boundaries
+
+
+def durationBoundaries(start, stop, nSlices=None, duration=None):
+    """The times splitting a GTI into slices with the same good time.
+
+    Parameters
+    ----------
+    start, stop : arrays
+        The GTI (see readGti()).
+
+    nSlices : int or None
+        The number of slices.
+        Default: None
+
+    duration : float or None
+        The good time (s) in each slice (used if nSlices is None).
+        Default: None
+
+    Returns
+    -------
+    An array of the slice boundaries, from the start to the end of the GTI.
+    """
+    assert (nSlices is None)!=(duration is None), "Give either the number of slices or their duration."
+    exposure = np.concatenate([[0], np.cumsum(stop-start)])
+    duration = exposure[-1]/nSlices if duration is None else float(duration)
+    assert duration>0, "The slices must be longer than 0 s."
+
+    # positions in good time, turned into times by finding which interval each is in
+    positions = np.arange(1, int(np.ceil(exposure[-1]/duration)))*duration
+    interval = np.clip(np.searchsorted(exposure, positions, side="right")-1, 0, start.size-1)
+    boundaries = np.concatenate([[start[0]], start[interval]+(positions-exposure[interval]), [stop[-1]]])
+    return _mergeLast(boundaries, [exposure[-1]-(positions[-1] if positions.size>0 else 0)], duration)
+
+
+def countBoundaries(start, stop, eventFiles, counts):
+    """The times splitting a GTI into slices with about the same number of events.
+
+    Parameters
+    ----------
+    start, stop : arrays
+        The GTI (see readGti()).
+
+    eventFiles : list of str
+        The event files to count (the EVENTS TIME column), events outside the GTI aren't counted.
+
+    counts : int
+        The number of events in each slice for each event file, e.g., 1000 with the FPMA and FPMB files gives about
+        2000 events in each slice.
+
+    Returns
+    -------
+    An array of the slice boundaries, from the start to the end of the GTI.
+    """
+    from astropy.io import fits
+
+    times = []
+    for evt in eventFiles:
+        with fits.open(evt, memmap=True) as hdul:
+            times.append(np.array(hdul["EVENTS"].data["TIME"], dtype=np.float64))
+    times = np.sort(np.concatenate(times))
+    interval = np.searchsorted(start, times, side="right")-1
+    times = times[(interval>=0) & (times<stop[np.clip(interval, 0, stop.size-1)])]
+
+    perSlice = counts*len(eventFiles)
+    assert perSlice>0, "Each slice needs at least 1 count."
+    # split half way between the last event of one slice and the first of the next
+    split = np.arange(1, int(np.ceil(times.size/perSlice)))*perSlice
+    boundaries = np.concatenate([[start[0]], (times[split-1]+times[split])/2, [stop[-1]]])
+    return _mergeLast(boundaries, [times.size-(split[-1] if split.size>0 else 0)], perSlice)
+
+
+def splitGti(start, stop, boundaries):
+    """Split a GTI at the given times.
+
+    Parameters
+    ----------
+    start, stop : arrays
+        The GTI (see readGti()).
+
+    boundaries : array
+        The slice boundaries (see durationBoundaries() and countBoundaries()).
+
+    Returns
+    -------
+    A list of the (start, stop) arrays of each slice with any good time, in time order.
+    """
+    slices = [clipGti(start, stop, low, high) for low, high in zip(boundaries[:-1], boundaries[1:])]
+    return [s for s in slices if s[0].size>0]
+
+
+def writeGti(template, start, stop, gtiFile):
+    """Write a GTI in the same format as another.
+
+    Parameters
+    ----------
+    template : str
+        The GTI file to copy the headers (and any other HDUs) from.
+
+    start, stop : arrays
+        The intervals to write.
+
+    gtiFile : str
+        The file to write (overwritten if it exists).
+    """
+    from astropy.io import fits
+
+    with fits.open(template) as hdul:
+        index = [n for n, h in enumerate(hdul) if isinstance(h, fits.BinTableHDU)][0]
+        table = hdul[index]
+        gti = fits.BinTableHDU.from_columns(table.columns, header=table.header, nrows=start.size)
+        gti.data["START"], gti.data["STOP"] = start, stop
+        for keyword, value in [("TSTART", start[0]), ("TSTOP", stop[-1]), ("ONTIME", np.sum(stop-start))]:
+            if keyword in gti.header:
+                gti.header[keyword] = value
+        hdus = [h.copy() for h in hdul]
+        hdus[index] = gti
+        fits.HDUList(hdus).writeto(gtiFile, overwrite=True)
+
+
+def sliceName(n):
+    """The name of slice n, e.g., slice003."""
+    return f"slice{n:03d}"
+
+
+def timeSlicePipeline(runDir, termOutfile, obsid, gtiFile, regionFiles, pfilesDir, nSlices=None, duration=None, counts=None,
+                      fits=FITS, max_workers=None, cacheDir=None, profileFile=None):
+    """Split the GTI and build the pipeline fitting every slice.
+
+    Parameters
+    ----------
+    runDir : str
+        The run directory, with 3-nuscreen-test made (see nustarPipeline()).
+
+    termOutfile : str
+        The log file.
+
+    obsid : str
+        The NuSTAR observation ID.
+
+    gtiFile : str
+        The GTI file to split.
+
+    regionFiles : dict
+        The region file for each FPM, {"A":<file>, "B":<file>}.
+
+    pfilesDir : str
+        Directory to keep each HEASoft stage's parameter files in (see privatePfiles()).
+
+    nSlices, duration, counts : int, float, int or None
+        How to split the GTI, only one is given: the number of slices, the good time (s) of each, or the number of
+        events of each FPM in each (see durationBoundaries() and countBoundaries()).
+        Default: None
+
+    fits : list of str
+        The fits to do for each slice, any of "fpma", "fpmb" and "fpmab".
+        Default: FITS
+
+    max_workers : int or None
+        The most stages to run at the same time (see Pipeline).
+        Default: None
+
+    cacheDir : str or None
+        The stage cache directory for the nuproducts stages, None to not use a cache.
+        Default: None
+
+    profileFile : str or None
+        The file to record the resources used by each stage in (see stageProfile.py).
+        Default: None
+
+    Returns
+    -------
+    A tuple of the Pipeline (ready to run) and a list of (slice name, start, stop) for each slice.
+    """
+    assert [nSlices, duration, counts].count(None)==2, "Split the GTI by one of the number of slices, duration or counts."
+    screenDir = os.path.join(runDir, "3-nuscreen-test")
+    productDir = os.path.join(runDir, "4-nuproducts-timeAndSpaceSelection-test", SLICE_DIR)
+    xspecDir = os.path.join(runDir, "5-xspec-test")
+    stem = f"nu{obsid}"
+    fpms = sorted({m for fit in fits for m in {"fpma":["A"], "fpmb":["B"], "fpmab":["A", "B"]}[fit]})
+    common = [f"{stem}_att.fits", f"{stem}_mast.fits"]
+
+    start, stop = readGti(gtiFile)
+    if counts is None:
+        boundaries = durationBoundaries(start, stop, nSlices=nSlices, duration=duration)
+    else:
+        boundaries = countBoundaries(start, stop, [os.path.join(screenDir, f"{stem}{m}06_cl_grade0.evt") for m in fpms], counts)
+
+    cache = None if cacheDir is None else StageCache(cacheDir, runDir)
+    pipeline = Pipeline(termOutfile, max_workers=max_workers, cache=cache, profileFile=profileFile)
+    slices = []
+    for n, (sliceStart, sliceStop) in enumerate(splitGti(start, stop, boundaries)):
+        name = sliceName(n)
+        sliceProducts, sliceXspec = os.path.join(productDir, name), os.path.join(xspecDir, SLICE_DIR, name)
+        os.makedirs(sliceProducts, exist_ok=True)
+        os.makedirs(sliceXspec, exist_ok=True)
+        sliceGti = os.path.join(sliceProducts, f"{name}_gti.fits")
+        writeGti(gtiFile, sliceStart, sliceStop, sliceGti)
+        slices.append((name, sliceStart, sliceStop))
+
+        for m in fpms:
+            # the same nuproducts as the full observation but with the slice's GTI and output directory
+            spectrum = [f"{stem}{m}06_cl_grade0_sr.{ext}" for ext in ["pha", "arf", "rmf"]]
+            pipeline.add(Stage(f"nuproducts{m}_{name}",
+                               f"nuproducts indir=./ instrument=FPM{m} steminputs={stem} outdir={sliceProducts}/ extended=no runmkarf=yes runmkrmf=yes infile={stem}{m}06_cl_grade0.evt bkgextract=no srcregionfile={regionFiles[m]} attfile=./{stem}_att.fits hkfile=./{stem}{m}_fpm.hk usrgtifile={sliceGti}",
+                               inputs=[f"{stem}{m}06_cl_grade0.evt", f"{stem}{m}_fpm.hk", f"{stem}{m}_det1.fits", f"{stem}{m}_oa.fits"]+common+[sliceGti, regionFiles[m]],
+                               outputs=[os.path.join(sliceProducts, f) for f in spectrum],
+                               cwd=screenDir, label=f"Filter to time and region (FPM{m}, {name})".ljust(45), test=f"3{m.lower()}.{n}",
+                               env=privatePfiles(os.path.join(pfilesDir, f"nuproducts{m}_{name}")),
+                               cache=True, products=[os.path.join(sliceProducts, f"{stem}{m}06_cl_grade0*")]))
+
+            pipeline.add(Stage(f"copySpectrum{m}_{name}", [Copy(f"./{f}", sliceXspec+"/") for f in spectrum],
+                               inputs=spectrum, outputs=[os.path.join(sliceXspec, f) for f in spectrum], cwd=sliceProducts))
+
+        # the .xcm files (and the abundances they load) in the slice's directory, then the fits as for the full observation
+        pipeline.add(Stage(f"createXcm_{name}", [Copy(os.path.join(xspecDir, "feld92a_coronal0.txt"), sliceXspec+"/"), f"python3 {xspecDir}/create_xcm.py {obsid}"],
+                           outputs=[f"apec1fit_{fit}_cstat.xcm" for fit in FITS]+["feld92a_coronal0.txt"], cwd=sliceXspec))
+        for fit in fits:
+            modules = {"fpma":["A"], "fpmb":["B"], "fpmab":["A", "B"]}[fit]
+            pipeline.add(Stage(f"xspec_{fit}_{name}", f"python3 {xspecDir}/runXspec.py apec1fit_{fit}_cstat.xcm",
+                               inputs=[f"apec1fit_{fit}_cstat.xcm", "feld92a_coronal0.txt"]+[f"{stem}{m}06_cl_grade0_sr.{ext}" for m in modules for ext in ["pha", "arf", "rmf"]],
+                               outputs=[f"mod_apec1fit_{fit}_cstat.{ext}" for ext in ["txt", "fits"]], cwd=sliceXspec,
+                               label=f"Run XSPEC code ({fit.upper()}, {name})".ljust(45), test=f"4{fit[3:]}.{n}",
+                               info=f"See log files in {sliceXspec} directory."))
+
+    return pipeline, slices
+
+
+def sliceTable(runDir, slices, fits=FITS, tableFile=TABLE_FILE):
+    """Collect the fitted parameters of every slice into one table.
+
+    The parameters are read and the table is built by the run directory's 6-xspec-test-result/fitTable.py, the same
+    reader and table as the fitting grid (5-xspec-test/xcmGrid.py), with the slice's times added.
+
+    Parameters
+    ----------
+    runDir : str
+        The run directory.
+
+    slices : list
+        From timeSlicePipeline().
+
+    fits : list of str
+        The fits done for each slice.
+        Default: FITS
+
+    tableFile : str
+        The .npy file (in 6-xspec-test-result) to save the table to.
+        Default: TABLE_FILE
+
+    Returns
+    -------
+    A numpy structured array with one row for each slice in time order and the fields "slice", "tstart", "tstop" and
+    "exposure" (the slice's good time, s), then for each fit whether it "<fit>_passed" and each parameter found in any
+    slice's fit with its bounds (e.g., "fpma_kT1", "fpma_kT1_lower", "fpma_kT1_upper", "fpma_STATISTIC"). Parameters a
+    fit doesn't have (or failed fits) are NaN.
+    """
+    xspecDir, resultDir = os.path.join(runDir, "5-xspec-test"), os.path.join(runDir, "6-xspec-test-result")
+    rows = []
+    for name, start, stop in slices:
+        fitsFiles = {fit:os.path.join(xspecDir, SLICE_DIR, name, f"mod_apec1fit_{fit}_cstat.fits") for fit in fits}
+        rows.append({"slice":name, "tstart":float(start[0]), "tstop":float(stop[-1]), "exposure":float(np.sum(stop-start)),
+                     "fits":{f"{fit}_":(f if os.path.isfile(f) else None) for fit, f in fitsFiles.items()}})
+    spec = {"fields":[("slice", "U16"), ("tstart", "f8"), ("tstop", "f8"), ("exposure", "f8")], "rows":rows, "sort":"tstart"}
+
+    table = os.path.join(resultDir, tableFile)
+    subprocess.run([sys.executable, os.path.join(resultDir, "fitTable.py"), "-", table], input=json.dumps(spec),
+                   universal_newlines=True, check=True)
+    return np.load(table)
+
+
+def printTable(table, fits=FITS):
+    """Print the time, good time and each fit's temperatures and statistic for every slice."""
+    columns = [c for c in table.dtype.names for fit in fits if c.startswith(f"{fit}_") and (c[len(fit)+1:].startswith("kT") or c.endswith("STATISTIC")) and not c.endswith(("_lower", "_upper"))]
+    print("Slice       TSTART (s)        Good time (s)    "+"    ".join([c.rjust(14) for c in columns]))
+    for row in table:
+        print(f"{row['slice']:<10}  {row['tstart']:<16.3f}  {row['exposure']:>13.1f}    "+"    ".join([f"{row[c]:>14.5g}" for c in columns]))
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Split the GTI into slices and fit a spectrum of each slice.")
+    parser.add_argument("runDir", help="The run directory (with 3-nuscreen-test made).")
+    parser.add_argument("termOutfile", help="The log file to add to.")
+    parser.add_argument("--obsid", default="80414202001", help="NuSTAR observation ID.")
+    parser.add_argument("--gti", required=True, help="GTI file to split.")
+    parser.add_argument("--rega", required=True, help="FPMA region file.")
+    parser.add_argument("--regb", required=True, help="FPMB region file.")
+    split = parser.add_mutually_exclusive_group(required=True)
+    split.add_argument("--slices", type=int, default=None, help="Split the GTI into this many slices with the same good time.")
+    split.add_argument("--duration", type=float, default=None, help="Split the GTI into slices with this much good time (s).")
+    split.add_argument("--counts", type=int, default=None, help="Split the GTI into slices with about this many grade 0 events of each FPM.")
+    parser.add_argument("--fits", nargs="+", default=FITS, choices=FITS, help="The fits to do for each slice (default: all).")
+    parser.add_argument("--workers", type=int, default=None, help="Most stages to run at the same time.")
+    parser.add_argument("--cache", default=None, help="Stage cache directory to reuse nuproducts products from.")
+    parser.add_argument("--profile", default=os.environ.get("STAGE_PROFILE_FILE"), help="File to record each stage's resource use in (default: $STAGE_PROFILE_FILE).")
+    args = parser.parse_args()
+
+    runDir = os.path.abspath(args.runDir)
+    with tempfile.TemporaryDirectory(prefix="pfiles_") as pfilesDir:
+        pipeline, slices = timeSlicePipeline(runDir, args.termOutfile, args.obsid, os.path.abspath(args.gti),
+                                             {"A":os.path.abspath(args.rega), "B":os.path.abspath(args.regb)}, pfilesDir,
+                                             nSlices=args.slices, duration=args.duration, counts=args.counts, fits=args.fits,
+                                             max_workers=args.workers, cacheDir=args.cache, profileFile=args.profile)
+        print(f"Split {args.gti} into {len(slices)} slice(s).")
+        passed = pipeline.run()
+
+    table = sliceTable(runDir, slices, fits=args.fits)
+    printTable(table, fits=args.fits)
+    print(f"Results in {os.path.join(runDir, '6-xspec-test-result', TABLE_FILE)}.")
+    sys.exit(0 if passed else 1)
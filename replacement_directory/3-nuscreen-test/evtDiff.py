@@ -0,0 +1,261 @@
+'''
+Compare the screened event files (nu*A06_cl_grade0.evt, nu*B06_cl_grade0.evt) of two runs, event by event.
+
+Both EVENTS tables are memory-mapped and read a fixed number of rows at a time, so the memory used doesn't depend on the
+size of the files. The events are in time order so the two files are stepped through together: each step takes the
+events of both files before the earliest of the two chunks' last TIMEs (the rest wait for the next chunk) and pairs them
+up within each TIME. Events with the same TIME and compared columns (PI, GRADE, STATUS, DET1X, DET1Y) are paired first,
+then those left with the same TIME and DET1X/DET1Y, then any left with the same TIME in order, so only events without an
+exact match are counted as different. Events only in the new file are "added", those only in the benchmark file are
+"removed" and events only paired after the first step are "changed". All of these are counted (with which columns
+changed) and histogrammed by PI.
+
+Run as, e.g.,
+    python3 evtDiff.py ../../benchmark/3-nuscreen-test/ ./ --report evt_diff_report.json
+    python3 evtDiff.py ../../benchmark/3-nuscreen-test/nu80414202001A06_cl_grade0.evt ./nu80414202001A06_cl_grade0.evt
+'''
+
+import os
+import sys
+import glob
+import json
+import argparse
+import numpy as np
+
+CHUNK_ROWS = 1<<20
+COLUMNS = ["PI", "GRADE", "STATUS", "DET1X", "DET1Y"]
+N_PI = 4096
+# the columns (as well as TIME) events are paired on after they couldn't be paired on all the compared columns
+POSITION = ["DET1X", "DET1Y"]
+
+
+class _EventReader:
+    ''' Read TIME and the compared columns of an EVENTS table a chunk of rows at a time, keeping the events not used yet.
+    '''
+    def __init__(self, evt, columns, chunk_rows):
+        # astropy is only needed to read the file
+        from astropy.io import fits
+
+        self._hdul = fits.open(evt, memmap=True)
+        self._table = self._hdul["EVENTS"].data
+        self.rows = len(self._table)
+        self.columns = [c for c in columns if c in self._table.columns.names]
+        self.chunk_rows = chunk_rows
+        self._next = 0
+        self.buffer = {c:np.empty((0,)) for c in ["TIME"]+self.columns}
+
+    @property
+    def finished(self):
+        ''' Every row has been read into the buffer.'''
+        return self._next>=self.rows
+
+    def read(self):
+        ''' Add the next chunk of rows to the buffer.'''
+        chunk = self._table[self._next:self._next+self.chunk_rows]
+        for c in ["TIME"]+self.columns:
+            # copied out of the memory-map so only this chunk's pages are needed
+            values = np.array(chunk[c])
+            self.buffer[c] = values if self.buffer[c].size==0 else np.concatenate([self.buffer[c], values])
+        if np.any(np.diff(self.buffer["TIME"])<0):
+            raise ValueError(f"The events in {self._hdul.filename()} are not in time order, sort them by TIME first.")
+        self._next += self.chunk_rows
+
+    def take(self, before):
+        ''' Remove and return the buffered events with TIME before "before".'''
+        n = np.searchsorted(self.buffer["TIME"], before, side="left")
+        taken = {c:v[:n] for c,v in self.buffer.items()}
+        self.buffer = {c:v[n:] for c,v in self.buffer.items()}
+        return taken
+
+    def close(self):
+        del self._table
+        self._hdul.close()
+
+
+def _keys(events, index, columns, dtypes):
+    ''' A key for each of the events at index from TIME, the columns and a rank counting the events before with the
+    same TIME and columns (so every key is different).'''
+    values = [events["TIME"][index].astype(">f8")]+[events[c][index].astype(dtypes[c]) for c in columns]
+    raw = np.concatenate([np.ascontiguousarray(v).reshape(index.size, int(np.prod(v.shape[1:]))).view(np.uint8) for v in values], axis=1)
+    row = np.ascontiguousarray(raw).view(np.dtype((np.void, raw.shape[1]))).ravel()
+
+    order = np.argsort(row, kind="stable")
+    start = np.ones(index.size, dtype=bool)
+    start[1:] = row[order][1:]!=row[order][:-1]
+    rank = np.empty(index.size, dtype=">i8")
+    rank[order] = np.arange(index.size)-np.maximum.accumulate(np.where(start, np.arange(index.size), 0))
+
+    keys = np.concatenate([raw, rank.reshape(-1, 1).view(np.uint8)], axis=1)
+    return np.ascontiguousarray(keys).view(np.dtype((np.void, keys.shape[1]))).ravel()
+
+
+def _pair(benchmark, new, steps, dtypes):
+    ''' Pair up the events of two files (with the same TIMEs) on TIME and each step's columns in turn.
+
+    Parameters
+    ----------
+    benchmark, new : dict
+            The TIME and compared columns of the events of each file.
+
+    steps : list of list of str
+            The columns to pair on (as well as TIME) for each step, only events not paired yet are used in the next step.
+
+    dtypes : dict
+            The dtype to compare each column as (the same for both files).
+
+    Returns
+    -------
+    A list with the (benchmark index, new index) arrays of the events paired in each step.
+    '''
+    b_left, n_left = np.arange(benchmark["TIME"].size), np.arange(new["TIME"].size)
+    pairs = []
+    for columns in steps:
+        _, b_index, n_index = np.intersect1d(_keys(benchmark, b_left, columns, dtypes), _keys(new, n_left, columns, dtypes),
+                                             assume_unique=True, return_indices=True)
+        pairs.append((b_left[b_index], n_left[n_index]))
+        b_left, n_left = np.delete(b_left, b_index), np.delete(n_left, n_index)
+    return pairs
+
+
+def _changedColumns(benchmark, new, columns):
+    ''' For each column, which paired events have a different value (any element for bit/array columns).'''
+    return {c:np.any((benchmark[c]!=new[c]).reshape(benchmark[c].shape[0], int(np.prod(benchmark[c].shape[1:]))), axis=1) for c in columns}
+
+
+def evtDiff(benchmark_evt, new_evt, chunk_rows=CHUNK_ROWS, columns=COLUMNS):
+    ''' Compare two event files event by event with bounded memory.
+
+    Parameters
+    ----------
+    benchmark_evt, new_evt : str
+            The benchmark and new event files (EVENTS extension, in time order).
+
+    chunk_rows : int
+            The number of rows to read from each file at a time.
+            Default: CHUNK_ROWS
+
+    columns : list of str
+            The columns to compare between paired events (those missing from either file are skipped).
+            Default: COLUMNS
+
+    Returns
+    -------
+    A dictionary with the number of events in each file ("benchmark_events", "new_events"), the number "matched",
+    "added", "removed" and "changed", the columns compared, the number of changed events with each column different
+    ("changed_columns"), and histograms by PI (N_PI bins) of the "added" (new PI), "removed" and "changed" (benchmark PI)
+    events in "pi_histograms".
+    '''
+    benchmark, new = _EventReader(benchmark_evt, columns, chunk_rows), _EventReader(new_evt, columns, chunk_rows)
+    columns = [c for c in benchmark.columns if c in new.columns]
+    steps = [columns, [c for c in POSITION if c in columns], []]
+    counts = {"matched":0, "added":0, "removed":0, "changed":0}
+    changed_columns = {c:0 for c in columns}
+    histograms = {k:np.zeros(N_PI, dtype=np.int64) for k in ["added", "removed", "changed"]}
+
+    def _histogram(pi):
+        return np.bincount(np.clip(pi.astype(np.int64), 0, N_PI-1), minlength=N_PI)
+
+    try:
+        while not (benchmark.finished and new.finished and benchmark.buffer["TIME"].size==0 and new.buffer["TIME"].size==0):
+            # only the file that is behind (or has nothing buffered) is read, so neither buffer grows past about a chunk
+            last = {id(r):(r.buffer["TIME"][-1] if r.buffer["TIME"].size>0 else -np.inf) for r in [benchmark, new]}
+            behind = min([last[id(r)] for r in [benchmark, new] if not r.finished], default=np.inf)
+            for reader in [benchmark, new]:
+                if (not reader.finished) and (last[id(reader)]<=behind):
+                    reader.read()
+            # every event before the earliest last TIME of the files still being read is in the buffers of both
+            unfinished = [r.buffer["TIME"][-1] for r in [benchmark, new] if (not r.finished) and r.buffer["TIME"].size>0]
+            before = min(unfinished) if len(unfinished)>0 else np.inf
+            b, n = benchmark.take(before), new.take(before)
+
+            # events paired in the first step are the same, those paired after have something changed (the values are
+            # compared as the same type and byte order from both files)
+            dtypes = {c:np.result_type(b[c].dtype, n[c].dtype).newbyteorder(">") for c in columns}
+            pairs = _pair(b, n, steps, dtypes)
+            b_index, n_index = [np.concatenate([p[i] for p in pairs]) for i in [0, 1]]
+            b_changed, n_changed = [np.concatenate([p[i] for p in pairs[1:]]) for i in [0, 1]]
+            removed, added = np.ones(b["TIME"].size, dtype=bool), np.ones(n["TIME"].size, dtype=bool)
+            removed[b_index], added[n_index] = False, False
+
+            different = _changedColumns({c:b[c][b_changed] for c in columns}, {c:n[c][n_changed] for c in columns}, columns)
+
+            counts["matched"] += b_index.size
+            counts["removed"] += int(removed.sum())
+            counts["added"] += int(added.sum())
+            counts["changed"] += b_changed.size
+            for c in columns:
+                changed_columns[c] += int(different[c].sum())
+            if "PI" in columns:
+                histograms["removed"] += _histogram(b["PI"][removed])
+                histograms["added"] += _histogram(n["PI"][added])
+                histograms["changed"] += _histogram(b["PI"][b_changed])
+    finally:
+        benchmark.close()
+        new.close()
+
+    return dict(benchmark_events=benchmark.rows, new_events=new.rows, columns=columns, **counts,
+                changed_columns=changed_columns, pi_histograms=histograms)
+
+
+def eventPairs(benchmarkDir, newDir, pattern="nu*06_cl_grade0.evt"):
+    ''' Pair up the event files with the same name in two directories.
+
+    Parameters
+    ----------
+    benchmarkDir, newDir : str
+            The 3-nuscreen-test directories of the benchmark and new runs.
+
+    pattern : str
+            Which event files to compare.
+            Default: "nu*06_cl_grade0.evt"
+
+    Returns
+    -------
+    A list of (benchmark file, new file) tuples, the new file is None if it isn't in newDir.
+    '''
+    benchmark_files = sorted(glob.glob(os.path.join(benchmarkDir, pattern)))
+    return [(b, os.path.join(newDir, os.path.basename(b)) if os.path.isfile(os.path.join(newDir, os.path.basename(b))) else None) for b in benchmark_files]
+
+
+def printDiff(name, diff, pi_bin=100):
+    ''' Print the result of evtDiff(), with the PI histograms in bins of pi_bin channels (0.04 keV each).'''
+    same = (diff["added"]==0) and (diff["removed"]==0) and (diff["changed"]==0)
+    print(f"{name}: {diff['benchmark_events']} benchmark and {diff['new_events']} new events, {diff['matched']} paired, "
+          f"{diff['added']} added, {diff['removed']} removed, {diff['changed']} changed - {'Passed' if same else 'Failed'}")
+    for c, n in diff["changed_columns"].items():
+        if n>0:
+            print(f"    {c} changed in {n} events")
+    for kind, histogram in diff["pi_histograms"].items():
+        binned = np.add.reduceat(histogram, np.arange(0, N_PI, pi_bin))
+        for b in np.flatnonzero(binned):
+            print(f"    {kind:<8} PI {b*pi_bin:>4}-{min((b+1)*pi_bin, N_PI)-1:<4} ({1.6+0.04*b*pi_bin:5.1f}-{1.6+0.04*min((b+1)*pi_bin, N_PI):5.1f} keV): {binned[b]}")
+    return same
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Compare the screened event files of a benchmark and a new run.")
+    parser.add_argument("benchmark", help="Benchmark event file or 3-nuscreen-test directory.")
+    parser.add_argument("new", help="New event file or 3-nuscreen-test directory.")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help=f"Rows to read at a time from each file (default: {CHUNK_ROWS}).")
+    parser.add_argument("--pi-bin", type=int, default=100, help="PI channels in each printed histogram bin (default: 100).")
+    parser.add_argument("--report", default=None, help="Write a .json report (with the full PI histograms) to this file.")
+    args = parser.parse_args()
+
+    pairs = eventPairs(args.benchmark, args.new) if os.path.isdir(args.benchmark) else [(args.benchmark, args.new)]
+    assert len(pairs)>0, f"No event files to compare in {args.benchmark}."
+
+    passed, report = True, {}
+    for b, n in pairs:
+        name = os.path.basename(b)
+        if n is None:
+            print(f"{name}: not in {args.new} - Failed")
+            passed, report[name] = False, None
+            continue
+        diff = evtDiff(b, n, chunk_rows=args.chunk_rows)
+        passed &= printDiff(name, diff, pi_bin=args.pi_bin)
+        report[name] = dict(diff, pi_histograms={k:v.tolist() for k,v in diff["pi_histograms"].items()})
+
+    if args.report is not None:
+        with open(args.report, "w") as rep:
+            json.dump({"passed":bool(passed), "files":report}, rep, indent=1)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,59 @@
+'''
+Check evtDiff.py pairs events with the same TIME by what is in them, run with
+    python3 -m pytest test_evtDiff.py
+'''
+
+import numpy as np
+import pytest
+
+from evtDiff import evtDiff
+
+fits = pytest.importorskip("astropy.io.fits")
+
+
+def _writeEvents(evt, time, pi, det1x, det1y):
+    ''' Write an EVENTS table with the given columns (GRADE and STATUS the same for every event).'''
+    columns = [fits.Column(name="TIME", format="D", array=time),
+               fits.Column(name="PI", format="J", array=pi),
+               fits.Column(name="GRADE", format="I", array=np.zeros(time.size)),
+               fits.Column(name="STATUS", format="16X", array=np.zeros((time.size, 16), dtype=bool)),
+               fits.Column(name="DET1X", format="I", array=det1x),
+               fits.Column(name="DET1Y", format="I", array=det1y)]
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns(columns, name="EVENTS")]).writeto(evt)
+
+
+@pytest.mark.parametrize("chunk_rows", [7, 1000])
+def test_duplicate_times(tmp_path, chunk_rows):
+    rng = np.random.default_rng(1)
+    # 20 TIMEs with 10 events each, all at different positions within a TIME
+    time = np.repeat(np.arange(20, dtype=float), 10)
+    pi = rng.integers(0, 4096, time.size)
+    det1x, det1y = np.tile(np.arange(10), 20), np.tile(np.arange(10)+100, 20)
+    _writeEvents(tmp_path/"benchmark.evt", time, pi, det1x, det1y)
+
+    # remove 10 events from the start of TIME groups and change the PI of 5 events later in the same groups
+    removed = np.arange(0, 200, 20)
+    changed = np.arange(5, 100, 20)
+    new_pi = pi.copy()
+    new_pi[changed] = (pi[changed]+1)%4096
+    keep = np.setdiff1d(np.arange(time.size), removed)
+    _writeEvents(tmp_path/"new.evt", time[keep], new_pi[keep], det1x[keep], det1y[keep])
+
+    diff = evtDiff(str(tmp_path/"benchmark.evt"), str(tmp_path/"new.evt"), chunk_rows=chunk_rows)
+    assert (diff["removed"], diff["added"], diff["changed"]) == (10, 0, 5)
+    assert diff["matched"] == time.size-10
+    assert diff["changed_columns"] == {"PI":5, "GRADE":0, "STATUS":0, "DET1X":0, "DET1Y":0}
+    assert np.array_equal(np.flatnonzero(diff["pi_histograms"]["removed"]), np.unique(pi[removed]))
+    assert np.array_equal(np.flatnonzero(diff["pi_histograms"]["changed"]), np.unique(pi[changed]))
+
+
+def test_same_time_reordered(tmp_path):
+    # the same events written in a different order within each TIME are the same
+    time = np.repeat(np.arange(5, dtype=float), 4)
+    pi, det1x, det1y = np.arange(20), np.arange(20)%4, np.zeros(20)
+    _writeEvents(tmp_path/"benchmark.evt", time, pi, det1x, det1y)
+    order = np.argsort(-np.arange(20)%4+4*np.repeat(np.arange(5), 4), kind="stable")
+    _writeEvents(tmp_path/"new.evt", time[order], pi[order], det1x[order], det1y[order])
+
+    diff = evtDiff(str(tmp_path/"benchmark.evt"), str(tmp_path/"new.evt"))
+    assert (diff["removed"], diff["added"], diff["changed"], diff["matched"]) == (0, 0, 0, 20)
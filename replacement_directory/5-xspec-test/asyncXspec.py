@@ -0,0 +1,211 @@
+import asyncio
+import time
+
+from subprocessXspec import prepareXSPECrun, checkXSPECline, LogSink, fitResultsSummary
+
+""" An asyncio version of runXSPEC()/XSPECfit() from subprocessXspec.py.
+
+    XSPEC's stdout and stderr are read at the same time without blocking and every command (and the whole fit) has a
+    timeout so an XSPEC session that never prints the line we are waiting for is killed and reported instead of hanging
+    forever. One event loop can then look after many fits at once.
+
+    Comments:*Same requirements as subprocessXspec.py, i.e., "writefits" and "error" must be used in the XSPEC batch script.
+             *Fits, text, and log files created are the same as with runXSPEC().
+"""
+
+class XSPECTimeoutError(Exception):
+    """Raised when an XSPEC command or the whole fit takes longer than it is allowed to."""
+    pass
+
+
+async def _drainStderr(stream, lines):
+    """Keep reading XSPEC's stderr so the pipe never fills up and blocks XSPEC.
+
+    Parameters
+    ----------
+    stream : asyncio.StreamReader
+        The stderr of the XSPEC process.
+
+    lines : list
+        List that each decoded line of stderr is appended to.
+
+    Returns
+    -------
+    None.
+    """
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        lines.append(line.decode(errors="replace"))
+
+
+async def _killXSPEC(xspec):
+    """Kill an XSPEC process (if it is still running) and wait for it to go.
+
+    Parameters
+    ----------
+    xspec : asyncio.subprocess.Process
+        The XSPEC process.
+
+    Returns
+    -------
+    None.
+    """
+    if xspec.returncode is None:
+        try:
+            xspec.kill()
+        except ProcessLookupError:
+            pass
+    await xspec.wait()
+
+
+async def runXSPECasync(xspecBatchFile, logFile=False, overwrite=False, directory=None, commandTimeout=600, fitTimeout=3600, compressLog=False):
+    """Runs an XSPEC .xcm batch file and then, in the same XSPEC program, run other manual commands to complete
+    the XSPEC fitting process (like runXSPEC()) but without blocking and with timeouts.
+
+    Parameters
+    ----------
+    xspecBatchFile, logFile, overwrite, directory, compressLog :
+        See runXSPEC() in subprocessXspec.py.
+
+    commandTimeout : float or None
+        The maximum time (in seconds) any single command (including the whole batch script) can take
+        to finish. None for no limit.
+        Default: 600
+
+    fitTimeout : float or None
+        The maximum time (in seconds) the whole fit (all the commands) can take. None for no limit.
+        Default: 3600
+
+    Returns
+    -------
+    A dictionary of the result of the fit with keys "xspecBatchFile", "directory", "status" ("Passed",
+    "Timeout", or "Failed"), "message", "time" (the wall time in seconds), and "stderr" (list of lines).
+
+    Example
+    -------
+    # run a spectral fitting, giving up if any command takes longer than 5 minutes
+    result = asyncio.run(runXSPECasync("apec1fit_fpma_cstat.xcm", logFile=True, overwrite=True, commandTimeout=300))
+    """
+    start = time.time()
+    result = {"xspecBatchFile":xspecBatchFile, "directory":directory, "status":"Passed", "message":"", "time":0, "stderr":[]}
+
+    # check the output files are clear to be written and get the commands to send to XSPEC
+    cmds, logFile = prepareXSPECrun(xspecBatchFile, logFile=logFile, overwrite=overwrite, directory=directory, compressLog=compressLog)
+    log = LogSink(logFile, compress=compressLog)
+    xspec, stderrReader = None, None
+    fitDeadline = None if fitTimeout is None else time.monotonic()+fitTimeout
+
+    try:
+        # started in here so the log is still closed (and the fit reported as failed) if XSPEC can't be started
+        xspec = await asyncio.create_subprocess_exec("xspec",
+                                                     cwd=directory,
+                                                     stdin =asyncio.subprocess.PIPE,
+                                                     stdout=asyncio.subprocess.PIPE,
+                                                     stderr=asyncio.subprocess.PIPE)
+        stderrReader = asyncio.ensure_future(_drainStderr(xspec.stderr, result["stderr"]))
+
+        for number, command in enumerate(cmds):
+            xspec.stdin.write((command+"\n").encode())
+            await xspec.stdin.drain()
+
+            # whichever runs out first, the time for this command or what is left of the time for the whole fit
+            commandDeadline = None if commandTimeout is None else time.monotonic()+commandTimeout
+            deadlines = [d for d in [commandDeadline, fitDeadline] if d is not None]
+
+            state = {"errors_ran":False, "outputLines":0}
+            while True:
+                remaining = None if len(deadlines)==0 else min(deadlines)-time.monotonic()
+                try:
+                    if (remaining is not None) and (remaining<=0):
+                        raise asyncio.TimeoutError
+                    line = await asyncio.wait_for(xspec.stdout.readline(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    raise XSPECTimeoutError(f"XSPEC command \'{command}\' did not finish in time (command timeout: {commandTimeout} s, fit timeout: {fitTimeout} s).")
+
+                line = line.decode(errors="replace")
+                if len(line)==0:
+                    # end of stdout, XSPEC has gone
+                    raise RuntimeError(f"XSPEC stopped (return code {await xspec.wait()}) before command \'{command}\' finished.")
+
+                log.write(line)
+
+                reply, marker = checkXSPECline(cmds, number, line, state)
+                if reply is not None:
+                    xspec.stdin.write(reply.encode())
+                    await xspec.stdin.drain()
+                if marker is not None:
+                    log.write(marker)
+                    log.flush()
+                    break
+        log.write(f"\n***FINISHED COMMANDS {cmds}.***")
+        await xspec.wait()
+
+    except XSPECTimeoutError as e:
+        result.update(status="Timeout", message=str(e))
+    except (RuntimeError, BrokenPipeError, ConnectionResetError) as e:
+        result.update(status="Failed", message=str(e))
+    except OSError as e:
+        # XSPEC couldn't be started, e.g., it isn't on the PATH or the directory isn't there
+        result.update(status="Failed", message=f"XSPEC could not be started: {e}")
+    finally:
+        if xspec is not None:
+            await _killXSPEC(xspec)
+            await stderrReader
+
+        if result["status"]!="Passed":
+            log.write(f"\n***{result['status'].upper()}: {result['message']}***\n")
+        if len(result["stderr"])>0:
+            log.write("\n***XSPEC STDERR:***\n"+"".join(result["stderr"]))
+        log.close()
+
+    result["time"] = time.time()-start
+    return result
+
+
+async def XSPECfitAsync(directory, xspecBatchFile, logFile=False, overwrite=False, max_concurrent=None, commandTimeout=600, fitTimeout=3600, compressLog=False):
+    """Runs many XSPEC .xcm batch files (like XSPECfit()) from one event loop, at most max_concurrent at a time.
+
+    Parameters
+    ----------
+    directory, xspecBatchFile, logFile, overwrite, compressLog :
+        See XSPECfit() in subprocessXspec.py.
+
+    max_concurrent : int or None
+        The maximum number of XSPEC sessions running at the same time. None for all of them at once.
+        Default: None
+
+    commandTimeout, fitTimeout :
+        See runXSPECasync().
+
+    Returns
+    -------
+    A list of the result dictionaries from runXSPECasync(), in the same order as xspecBatchFile.
+
+    Example
+    -------
+    # run three fits, two at a time
+    results = asyncio.run(XSPECfitAsync(["./", "./", "./"], ["f1.xcm", "f2.xcm", "f3.xcm"], logFile=True, overwrite=True, max_concurrent=2))
+    """
+    # make them loops and so loop-able
+    directory = directory if type(directory)==list else[directory]
+    xspecBatchFile = xspecBatchFile if type(xspecBatchFile)==list else[xspecBatchFile]
+    assert len(directory)==len(xspecBatchFile), "The \'directory\' and \'xspecBatchFile\' inputs must have the same number of entries."
+
+    slots = asyncio.Semaphore(len(xspecBatchFile) if max_concurrent is None else max_concurrent)
+
+    async def _fit(d, xcm):
+        async with slots:
+            return await runXSPECasync(xcm, logFile=logFile, overwrite=overwrite, directory=d, commandTimeout=commandTimeout, fitTimeout=fitTimeout, compressLog=compressLog)
+
+    return await asyncio.gather(*[_fit(d, xcm) for d,xcm in zip(directory, xspecBatchFile)])
+
+
+if __name__=="__main__":
+    test=False
+    if test:
+        results = asyncio.run(XSPECfitAsync(["./", "./", "./"],
+                                            ["apec1fit_fpma_cstat.xcm", "apec1fit_fpmb_cstat.xcm", "apec1fit_fpmab_cstat.xcm"],
+                                            logFile=True, overwrite=True))
+        fitResultsSummary(results)
@@ -1,3 +1,5 @@
+import sys
+
 from subprocessXspec import XSPECfit
 
 
@@ -15,6 +17,12 @@ if __name__=="__main__":
                        "apec1fit_fpmab_cstat.xcm"
                         ]
 
+    # only run the .xcm files given, if any (e.g., "python3 runXspec.py apec1fit_fpma_cstat.xcm")
+    if len(sys.argv)>1:
+        xspecBatchFiles = sys.argv[1:]
+        directories = ["./"]*len(xspecBatchFiles)
+
     # run the .xcm files in the appropriate directory while creating a log file of each run and removing any .log, .fits, .txt files that may 
-    # already be there with the same name as the output files of this code
-    XSPECfit(directory=directories, xspecBatchFile=xspecBatchFiles, logFile=True, overwrite=True)
+    # already be there with the same name as the output files of this code, each fit is independent so run them all at once
+    # the fit iterations, statistics and errors of each fit are also written to a .events.jsonl file (see xspecEvents.py)
+    XSPECfit(directory=directories, xspecBatchFile=xspecBatchFiles, logFile=True, overwrite=True, max_workers=len(xspecBatchFiles), eventFile=True)
@@ -1,6 +1,12 @@
 import subprocess
 import os
+import sys
 import time
+import gzip
+from concurrent.futures import ProcessPoolExecutor
+
+from xcmManifest import xcmManifest
+from xspecEvents import XSPECEvents
 
 """ These functions/script is created to run an XSPEC session and pass certain XSPEC commands down the pipeline at certain times according to 
     the termal output during the XSPEC spectral fitting. I.e. trying to avoid having to manually input the final commands for the fitting.
@@ -11,6 +17,10 @@ import time
              *The "error" command also needs to be present in the XSPEC batch script too (this should be there anyway).
 """
 
+# the stage profiler in the main directory (this directory is copied to a run directory there) that fits are run under when profiled
+STAGE_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "pipeline", "stageProfile.py")
+
+
 def add2log(logFile, text):
     """A function to continuously add text to a log file.
 
@@ -31,6 +41,8 @@ def add2log(logFile, text):
     # to create a .log file with a first line and then add another line
     add2log("logFile.log", "Some text.")
     add2log("logFile.log", "Maybe some more text.")
+
+    # if writing lots of lines then LogSink is better since it only opens the file once
     """
     # if the file string is an emtpy string just return it
     if len(logFile)==0:
@@ -45,6 +57,87 @@ def add2log(logFile, text):
         lf.write(text)
 
 
+class LogSink:
+    """Collects the text going into a log file and writes it with one open file handle.
+
+    This replaces calling add2log() for every line XSPEC prints (which opens and closes the log file each 
+    time). The text is buffered and written when flush() is called (e.g., at the end of each XSPEC command), 
+    when the buffer gets bigger than bufferSize, and when the sink is closed. Use it as a context manager 
+    so the log is always complete, even if XSPEC crashes or an error is raised while reading its output.
+
+    Parameters
+    ----------
+    logFile : str
+        The log file to be created or appended to. If it is an empty string then nothing is written 
+        (like add2log()).
+
+    compress : bool
+        Write the log with gzip compression. The file name is used as given so should end with ".gz".
+        Default: False
+
+    bufferSize : int
+        Number of characters to hold before they are written to the file regardless of flush() being called.
+        Default: 65536
+
+    Example
+    -------
+    # write two lines to a log file but only open it once
+    with LogSink("logFile.log") as log:
+        log.write("Some text.")
+        log.write("Maybe some more text.")
+        log.flush()
+    """
+    def __init__(self, logFile, compress=False, bufferSize=65536):
+        self.logFile = logFile
+        self.bufferSize = bufferSize
+        self._buffer = []
+        self._buffered = 0
+
+        # if the file string is an emtpy string just don't write anything
+        if len(logFile)==0:
+            self._file = None
+        elif compress:
+            self._file = gzip.open(logFile, "at")
+        else:
+            self._file = open(logFile, "a")
+
+    def write(self, text):
+        """Add text to the log."""
+        if self._file is None:
+            return
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered>=self.bufferSize:
+            self._write()
+
+    def _write(self):
+        """Write out the buffer to the file handle."""
+        self._file.write("".join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+
+    def flush(self):
+        """Write everything that has been buffered to the log file."""
+        if self._file is None:
+            return
+        self._write()
+        self._file.flush()
+
+    def close(self):
+        """Flush the buffer and close the log file."""
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def loc8fitsAndTxtName(xspecFile):
     """A function to find the name of the fits file you have defined in you XSPEC .xcm file.
 
@@ -62,11 +155,8 @@ def loc8fitsAndTxtName(xspecFile):
     # to get fits path+file name from the .xcm file
     fitsFile = loc8fitsAndTxtName("apec1fit_fpm1_cstat.xcm")
     """
-    with open(xspecFile, "r") as lf:
-        for line in lf.readlines():
-            if line.startswith("writefits"):
-                # get the path and file name for the "writefits" line
-                return line.split()[-1]
+    # the .xcm file is only read once for all of these loc* functions, see xcmManifest.py
+    return xcmManifest(xspecFile).writefits
 
 
 def locMcmcName(xspecFile):
@@ -87,12 +177,7 @@ def locMcmcName(xspecFile):
     # to get mcmc fits path+file name from the .xcm file
     fitsFile = loc8fitsAndTxtName("apec1fit_fpm1_cstat.xcm")
     """
-    with open(xspecFile, "r") as lf:
-        for line in lf.readlines():
-            if line.startswith("chain run"):
-                # get the path and mcmc file name for the "chain run" line
-                return line.split()[-1]
-    return ""
+    return xcmManifest(xspecFile).chain
 
 
 def locGainName(xspecFile):
@@ -114,12 +199,7 @@ def locGainName(xspecFile):
     # to get gain fits path+file name from the .xcm file
     fitsFile = loc8fitsAndTxtName("apec1fit_fpm1_cstat.xcm")
     """
-    with open(xspecFile, "r") as lf:
-        for line in lf.readlines():
-            if line.startswith("set finalFILE"):
-                # get the path and mcmc file name for the "chain run" line
-                return line.split()[-1]
-    return ""
+    return xcmManifest(xspecFile).finalFile
 
 
 def maybeRemoveFile(file, remove=False):
@@ -152,7 +232,139 @@ def maybeRemoveFile(file, remove=False):
     assert keep_going, f"File {file} already exists and \'remove\' in CheckFitsAndTxtName() [or \'overwrite\' in runXSPEC()] is set to False. \nPlease remove to continue."
 
 
-def runXSPEC(xspecBatchFile, logFile=False, overwrite=False):
+def inDirectory(directory, file):
+    """Get the path of a file relative to the directory XSPEC is being run in.
+
+    Parameters
+    ----------
+    directory : str or None
+        The directory XSPEC is run in. If None then the file is just returned.
+
+    file : str
+        The file name (relative to directory). Empty strings are returned as they are since 
+        they mean "no file" to the functions in here (e.g., add2log(), maybeRemoveFile()).
+            
+    Returns
+    -------
+    The path to the file.
+
+    Example
+    -------
+    # get the path to the log file in the "./fpma" directory
+    logPath = inDirectory("./fpma", "mod_apec1fit_fpma_cstat.log")
+    """
+    if (directory is None) or (len(file)==0) or os.path.isabs(file):
+        return file
+    return os.path.join(directory, file)
+
+
+def prepareXSPECrun(xspecBatchFile, logFile=False, overwrite=False, directory=None, compressLog=False):
+    """Gets everything ready for XSPEC to run an .xcm batch file, i.e., makes sure the output files 
+    can be written and works out the XSPEC commands to send.
+
+    Parameters
+    ----------
+    xspecBatchFile, logFile, overwrite, directory, compressLog : 
+        See runXSPEC().
+            
+    Returns
+    -------
+    The list of XSPEC commands to run (without newlines) and the log file path ("" if logFile is False).
+
+    Example
+    -------
+    # get the commands to send to XSPEC and the log file to write to
+    cmds, logFile = prepareXSPECrun("apec1fit_fpma_cstat.xcm", logFile=True, overwrite=True)
+    """
+    # read everything needed from the batch xspec file in one go (following any "@file" in it)
+    manifest = xcmManifest(inDirectory(directory, xspecBatchFile), directory=directory)
+
+    # "writefits" must be used in the batch xspec file
+    fitsFile = manifest.writefits
+    assert fitsFile is not None, f"No \'writefits\' command found in {xspecBatchFile}."
+
+    # check if a fits, text, and log file with the same name is there, if so remove them to continue or stop?
+    # mcmc might have been run and gain might have been allowed to vary and saved, these files are also checked
+    for outputFile in manifest.outputs():
+        maybeRemoveFile(inDirectory(directory, outputFile), remove=overwrite)
+    txtFile = manifest.txtFile
+    logFile = inDirectory(directory, fitsFile[:-5]+(".log.gz" if compressLog else ".log")) if logFile else ""
+    maybeRemoveFile(logFile, remove=overwrite)
+    
+    # XSPEC commands to execute once opened a pipeline
+    cmds = ["@"+xspecBatchFile, 
+            "iplot ldata ufspec rat", 
+            "wdata "+txtFile, 
+            "exit", 
+            "exit"]
+    return cmds, logFile
+
+
+def checkXSPECline(cmds, number, line, state):
+    """Checks a line of XSPEC output to see if the command being run has finished or if XSPEC needs 
+    a reply. This is used by all the ways XSPEC is driven in here so they behave the same.
+
+    Parameters
+    ----------
+    cmds : list of str
+        The XSPEC commands being run (from prepareXSPECrun()).
+
+    number : int
+        The index of the command in cmds that is being run.
+
+    line : str
+        The line of output from XSPEC (with its newline).
+
+    state : dict
+        Keeps track of the command's output between lines. Should start as 
+        {"errors_ran":False, "outputLines":0} for each new command.
+            
+    Returns
+    -------
+    A tuple of (reply, marker). The reply is the text to send to XSPEC's stdin (None if nothing 
+    is needed) and the marker is the line to add to the log once the command is complete (None 
+    if the command is still running).
+
+    Example
+    -------
+    state = {"errors_ran":False, "outputLines":0}
+    reply, marker = checkXSPECline(cmds, 0, " Current data and model not fit yet.\n", state)
+    """
+    command = cmds[number]
+
+    if number==0:
+        # the "errors" xspec command is run in the batch script and is usually the last, also once the batch script is done 
+        # the text " Current data and model not fit yet.\n" will appear. Once both of these have appeared then it should be 
+        # OK to move on.
+        if line.startswith("!XSPEC12>error"):
+            state["errors_ran"] = True 
+        if line==" Current data and model not fit yet.\n" and state["errors_ran"]==True:
+            return None, f"\n***BATCH SCRIPT {command} COMPLETE. NOW FOR MANUAL COMMANDS.***\n"
+        elif line.startswith("!XSPEC12>tclreadline::readline read {Continue error search in this direction? }\n"):
+            # sometimes this prompt occurs because of poor model-to-data fit, not enough data in range, etc. to get 
+            # a good fit quickly. Choose to let it keep trying by answering "y" each time as default for now.
+            return "y\n", None
+        elif line.startswith("!XSPEC12>tclreadline::readline read {Number of trials exceeded: continue fitting? }\n"):
+            # sometimes this prompt occurs because of really poor model-to-data fit, not enough data in range, etc. to get 
+            # a good fit quickly. Choose to stop trying by answering "n" each time as default for now as it can run 
+            # on for ages otherwise.
+            return "n\n", None
+
+    # the other commands at the moment give out a predictable number of lines without any prompting. In order for them 
+    # all to get logged in the .log file (and for the program to not hang) then we keep track of the lines to know when 
+    # to move onto the next manual command.
+    elif command=="iplot ldata ufspec rat":
+        state["outputLines"] += 1
+        if state["outputLines"]==2:
+            return None, f"\n***MANUAL COMMAND {command} COMPLETE.***\n"
+
+    elif (number==2) or (command=="exit"):
+        return None, f"\n***MANUAL COMMAND {command} COMPLETE.***\n"
+
+    return None, None
+
+
+def runXSPEC(xspecBatchFile, logFile=False, overwrite=False, directory=None, compressLog=False, eventFile=False, onEvent=None, profileFile=None):
     """Runs an XSPEC .xcm batch file and then, in the same XSPEC program, run other manual commands to complete 
     the XSPEC fitting process. This is because some of the final commands needed to complete the fitting process 
     in XSPEC needs to be run manually.
@@ -175,6 +387,30 @@ def runXSPEC(xspecBatchFile, logFile=False, overwrite=False):
         present then an error will occur and the program will hault.
         Default: False
 
+    directory : str or None
+        The directory to run XSPEC in (xspecBatchFile and all output files are relative to it). The 
+        interpreter's working directory is not changed so many of these can run at the same time.
+        Default: None (the current working directory)
+
+    compressLog : bool
+        Write the log file with gzip compression (it will end with ".log.gz" instead of ".log").
+        Default: False
+
+    eventFile : bool
+        Set to True to write the fit iterations, statistics, parameters and error results XSPEC prints as JSON 
+        lines (see xspecEvents.py) to a file with the same name as the .fits file ending with ".events.jsonl".
+        Default: False
+
+    onEvent : callable or None
+        Called with each event (see xspecEvents.py) as XSPEC prints it, e.g., to watch a fit converge. If it 
+        returns True then XSPEC is stopped and a RuntimeError is raised.
+        Default: None
+
+    profileFile : str or None
+        Run XSPEC under pipeline/stageProfile.py (in the main directory) to add a record of its wall time, CPU 
+        time, peak memory and bytes read/written to this stage profile file. None to not profile it.
+        Default: None
+
     Returns
     -------
     None
@@ -189,34 +425,19 @@ def runXSPEC(xspecBatchFile, logFile=False, overwrite=False):
     # if "apec1fit_fpm1_cstat.xcm" has "writefits folder/specFit.fits" then by the end you should have 3 files:
                 # 1. folder/specFit.fits, 2. folder/specFit.txt, 3. folder/specFit.log
     """
-    # "writefits" must be used in the batch xspec file, this line finds the file name used in "writefits"
-    fitsFile = loc8fitsAndTxtName(xspecBatchFile)
-
-    # check if a fits, text, and log file with the same name is there, if so remove them to continue or stop?
-    maybeRemoveFile(fitsFile, remove=overwrite)
-    txtFile = fitsFile[:-5]+".txt"
-    maybeRemoveFile(txtFile, remove=overwrite)
-    logFile = fitsFile[:-5]+".log" if logFile else ""
-    maybeRemoveFile(logFile, remove=overwrite)
-
-    # mcmc might have been run, check for this file name convention
-    mcmcFile = locMcmcName(xspecBatchFile) # returns "" if this isn't there
-    maybeRemoveFile(mcmcFile, remove=overwrite)
-    # gain might have been allowed to vary and saved, check for this file name convention
-    gainFile = locGainName(xspecBatchFile) # returns "" if this isn't there
-    maybeRemoveFile(gainFile, remove=overwrite)
-    
-    # XSPEC commands to execute once opened a pipeline
-    cmds = ["@"+xspecBatchFile, 
-            "iplot ldata ufspec rat", 
-            "wdata "+txtFile, 
-            "exit", 
-            "exit"]
+    # check the output files are clear to be written and get the commands to send to XSPEC
+    cmds, logFile = prepareXSPECrun(xspecBatchFile, logFile=logFile, overwrite=overwrite, directory=directory, compressLog=compressLog)
+    eventFile = inDirectory(directory, xcmManifest(inDirectory(directory, xspecBatchFile), directory=directory).writefits[:-5]+".events.jsonl") if eventFile else ""
+    maybeRemoveFile(eventFile, remove=overwrite)
     # need a newline at the end of each command
     commands = [c+"\n" for c in cmds]
 
-    # open pipeline to terminal
-    with subprocess.Popen(["xspec"],
+    # open the log file once for the whole fit, it is flushed after each command and closed (so complete) whatever happens
+    with LogSink(logFile, compress=compressLog) as log, \
+         XSPECEvents(callback=onEvent, jsonlFile=eventFile) as events, \
+         subprocess.Popen(["xspec"] if profileFile is None else [sys.executable, STAGE_PROFILE, "run", "--name", inDirectory(directory, xspecBatchFile),
+                                                                 "--kind", "fit", "--profile", os.path.abspath(profileFile), "--", "xspec"],
+                          cwd=directory,
                           stdin =subprocess.PIPE,
                           stdout=subprocess.PIPE,
                           stderr=subprocess.PIPE,
@@ -232,62 +453,41 @@ def runXSPEC(xspecBatchFile, logFile=False, overwrite=False):
             # since the commands are run inside another command (i.e. in xspec) subprocess doesn't recognise when they finish
             # therfore the program will hang if the command finishes and the "xspec.stdout.readline()" line is reached. Therfore
             # checks need to be in place so that once one command is finished we just move onto the next one (i.e. get out of 
-            # the while loop before the code gets to the "xspec.stdout.readline()" line and hangs).
-
-            # the "errors" xspec command is run in the batch script and is usually the last, also once the batch script is done 
-            # the text " Current data and model not fit yet.\n" will appear. Once both of these have appeared then it should be 
-            # OK to move on.
-            errors_ran = False
-
-            # the other commands at the moment give out a predictable number of lines without any prompting. In order for them 
-            # all to get logged in the .log file (and for the program to not hang) then we keep track of the lines to know when 
-            # to move onto the next manual command.
-            outputLines = 0
+            # the while loop before the code gets to the "xspec.stdout.readline()" line and hangs). See checkXSPECline().
+            state = {"errors_ran":False, "outputLines":0}
             while True:
 
                 line = xspec.stdout.readline()
 
-                add2log(logFile, line)
+                if len(line)==0:
+                    # end of stdout so XSPEC has gone (crashed?), record it and stop instead of waiting forever
+                    log.write(f"\n***XSPEC STOPPED (RETURN CODE {xspec.wait()}) BEFORE {cmds[number]} COMPLETED.***\n")
+                    raise RuntimeError(f"XSPEC stopped before command \'{cmds[number]}\' finished. Check the log file {logFile}.")
 
-                # print("Out: ", bytes(line.encode())) # for troubleshooting (byte strings show spaces and returns easier)
+                log.write(line)
 
+                # the iterations, statistics, parameters and errors in the line (if any) go to onEvent and the event file
+                events.feed(line)
+                if events.stopRequested:
+                    xspec.kill()
+                    log.write(f"\n***FIT STOPPED BY onEvent DURING {cmds[number]}.***\n")
+                    raise RuntimeError(f"The fit was stopped by onEvent during command '{cmds[number]}'. Check the log file {logFile}.")
 
-                if command==commands[0]:
-                    if line.startswith("!XSPEC12>error"):
-                        errors_ran = True 
-                    if line==" Current data and model not fit yet.\n" and errors_ran==True:
-                        add2log(logFile, f"\n***BATCH SCRIPT {cmds[number]} COMPLETE. NOW FOR MANUAL COMMANDS.***\n")
-                        break
-                    elif line.startswith("!XSPEC12>tclreadline::readline read {Continue error search in this direction? }\n"):
-                        # sometimes this prompt occurs because of poor model-to-data fit, not enough data in range, etc. to get 
-                        # a good fit quickly. Choose to let it keep trying by answering "y" each time as default for now.
-                        xspec.stdin.write("y\n")
-                    elif line.startswith("!XSPEC12>tclreadline::readline read {Number of trials exceeded: continue fitting? }\n"):
-                        # sometimes this prompt occurs because of really poor model-to-data fit, not enough data in range, etc. to get 
-                        # a good fit quickly. Choose to stop trying by answering "n" each time as default for now as it can run 
-                        # on for ages otherwise.
-                        xspec.stdin.write("n\n")
-
-                elif command=="iplot ldata ufspec rat\n":
-                    outputLines += 1
-                    if outputLines==2:
-                        add2log(logFile, f"\n***MANUAL COMMAND {cmds[number]} COMPLETE.***\n")
-                        outputLines = 0 # reset counter
-                        break
-
-                elif command==commands[2]:
-                    add2log(logFile, f"\n***MANUAL COMMAND {cmds[number]} COMPLETE.***\n")
-                    break
+                # print("Out: ", bytes(line.encode())) # for troubleshooting (byte strings show spaces and returns easier)
 
-                elif command=="exit\n":
-                    add2log(logFile, f"\n***MANUAL COMMAND {cmds[number]} COMPLETE.***\n")
+                reply, marker = checkXSPECline(cmds, number, line, state)
+                if reply is not None:
+                    xspec.stdin.write(reply)
+                if marker is not None:
+                    log.write(marker)
+                    log.flush()
                     break
-        add2log(logFile, f"\n***FINISHED COMMANDS {cmds}.***")
+        log.write(f"\n***FINISHED COMMANDS {cmds}.***")
 
     print("XSPEC batch script and manual commands run. Please check log file to ensure expected behaviour.")
 
 
-def XSPECfit(directory, xspecBatchFile, logFile=False, overwrite=False, printTime=False):
+def XSPECfit(directory, xspecBatchFile, logFile=False, overwrite=False, printTime=False, max_workers=None, compressLog=False, profileFile=None, eventFile=False):
     """Runs an XSPEC .xcm batch file(s) in the corresponding directory(s) and then, in the same XSPEC program, 
     run other manual commands to complete the XSPEC fitting process. This is because some of the final commands 
     needed to complete the fitting process in XSPEC needs to be run manually.
@@ -320,9 +520,29 @@ def XSPECfit(directory, xspecBatchFile, logFile=False, overwrite=False, printTim
         Do you want the time (in seconds) that it took the fit to be printed.
         Default: False
 
+    max_workers : int or None
+        The number of fits to run at the same time, each in its own worker process and XSPEC session 
+        (run in its own directory). If None or 1 then the fits are run one after another.
+        Default: None
+
+    compressLog : bool
+        Write the log files with gzip compression (they will end with ".log.gz" instead of ".log").
+        Default: False
+
+    profileFile : str or None
+        A JSON file to add a record of each fit's wall time, CPU time, peak memory and bytes read/written to. 
+        If None then the STAGE_PROFILE_FILE environment variable is used (set by test_heasoft_install.sh), if 
+        that isn't set then the fits aren't profiled.
+        Default: None
+
+    eventFile : bool
+        Write each fit's events (iterations, statistics, parameters, error results) as JSON lines, see runXSPEC().
+        Default: False
+
     Returns
     -------
-    None
+    A list of the wall times (in seconds) each fit took, in the same order as xspecBatchFile. A summary 
+    of these is also printed once all fits have finished.
 
     Example
     -------
@@ -341,24 +561,117 @@ def XSPECfit(directory, xspecBatchFile, logFile=False, overwrite=False, printTim
     ## run for multiple .xcm in the same directories
 
     XSPECfit(directory=["dir1", "dir1"], xspecBatchFile=["f1.xcm", "f2.xcm"], logFile=True, overwrite=True)
+
+    ## run the same fits but at the same time
+
+    XSPECfit(directory=["dir1", "dir1"], xspecBatchFile=["f1.xcm", "f2.xcm"], logFile=True, overwrite=True, max_workers=2)
     """
 
     # make them loops and so loop-able
     directory = directory if type(directory)==list else[directory]
     xspecBatchFile = xspecBatchFile if type(xspecBatchFile)==list else[xspecBatchFile]
-    startingDir = os.getcwd()
+    assert len(directory)==len(xspecBatchFile), "The \'directory\' and \'xspecBatchFile\' inputs must have the same number of entries."
+
+    profileFile = os.environ.get("STAGE_PROFILE_FILE") if profileFile is None else profileFile
+    start = time.time()
+
+    # each fit is run in its own directory (no os.chdir) so they can be run one after another or all at once
+    if (max_workers is None) or (max_workers==1):
+        fitTimes = [timedRunXSPEC(d, xcm, logFile, overwrite, printTime, compressLog, profileFile, eventFile) for d,xcm in zip(directory, xspecBatchFile)]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            fits = [pool.submit(timedRunXSPEC, d, xcm, logFile, overwrite, printTime, compressLog, profileFile, eventFile) for d,xcm in zip(directory, xspecBatchFile)]
+            fitTimes = [f.result() for f in fits]
+
+    fitSummary(directory, xspecBatchFile, fitTimes, time.time()-start)
+
+    return fitTimes
 
-    # change directory to each cxm file and run the fit then go back to the original directory to start again
-    for d,xcm in zip(directory, xspecBatchFile):
 
-        start = time.time()
+def timedRunXSPEC(directory, xspecBatchFile, logFile=False, overwrite=False, printTime=False, compressLog=False, profileFile=None, eventFile=False):
+    """Runs runXSPEC() in a given directory and times it. This is what each worker runs in XSPECfit().
 
-        os.chdir(d)
-        runXSPEC(xspecBatchFile=xcm, logFile=logFile, overwrite=overwrite)
-        os.chdir(startingDir)
+    Parameters
+    ----------
+    directory, xspecBatchFile, logFile, overwrite, printTime, compressLog, profileFile, eventFile : 
+        See XSPECfit().
+            
+    Returns
+    -------
+    The wall time (in seconds) the fit took.
+
+    Example
+    -------
+    # time the fit of "apec1fit_fpma_cstat.xcm" in the current directory
+    fitTime = timedRunXSPEC("./", "apec1fit_fpma_cstat.xcm", logFile=True, overwrite=True)
+    """
+    start = time.time()
+    try:
+        runXSPEC(xspecBatchFile=xspecBatchFile, logFile=logFile, overwrite=overwrite, directory=directory, compressLog=compressLog, eventFile=eventFile,
+                 profileFile=profileFile)
+    finally:
+        fitTime = time.time()-start
 
-        if printTime:
-            print("Fit took: ", time.time()-start, " seconds")
+    if printTime:
+        print("Fit took: ", fitTime, " seconds")
+    return fitTime
+
+
+def fitSummary(directory, xspecBatchFile, fitTimes, totalTime):
+    """Prints a summary of the wall time of each fit run by XSPECfit().
+
+    Parameters
+    ----------
+    directory : list of str
+        The directories the fits were run in.
+
+    xspecBatchFile : list of str
+        The .xcm files that were run.
+
+    fitTimes : list of float
+        The wall time (in seconds) of each fit.
+
+    totalTime : float
+        The wall time (in seconds) it took to run all the fits.
+            
+    Returns
+    -------
+    None.
+
+    Example
+    -------
+    fitSummary(["./", "./"], ["f1.xcm", "f2.xcm"], [60.1, 58.3], 61.0)
+    """
+    _l = max([len(os.path.join(d, xcm)) for d,xcm in zip(directory, xspecBatchFile)]+[len("Fit")])
+
+    print("Fit".ljust(_l)+"    Wall time [s]")
+    for d, xcm, t in zip(directory, xspecBatchFile, fitTimes):
+        print(f"{os.path.join(d, xcm).ljust(_l)}    {t:.2f}")
+    print(f"{'Total'.ljust(_l)}    {totalTime:.2f} (sum of fits: {sum(fitTimes):.2f})")
+
+
+def fitResultsSummary(results):
+    """Prints the outcome of each fit from XSPECfitAsync() (asyncXspec.py) or XspecSessionPool.run() 
+    (xspecSession.py).
+
+    Parameters
+    ----------
+    results : list of dict
+        Each with the keys "xspecBatchFile", "directory", "status", "message", and "time".
+
+    Returns
+    -------
+    True if all fits passed, False otherwise.
+    """
+    names = [inDirectory(r["directory"], r["xspecBatchFile"]) for r in results]
+    _l = max([len(n) for n in names]+[len("Fit")])
+
+    print("Fit".ljust(_l)+"    Status     Wall time [s]")
+    for n, r in zip(names, results):
+        print(f"{n.ljust(_l)}    {r['status'].ljust(7)}    {r['time']:.2f}")
+        if r["status"]!="Passed":
+            print(" "*4+r["message"])
+    return all([r["status"]=="Passed" for r in results])
 
 
 if __name__=="__main__":
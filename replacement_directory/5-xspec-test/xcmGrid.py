@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from subprocessXspec import timedRunXSPEC, fitResultsSummary
+
+""" Fit a grid of models and energy ranges to the same spectra to see how sensitive the results are to them.
+
+    The .xcm files are made from one template (the same steps as the files from create_xcm.py) for every combination of:
+        * model, any of the fitting modes seperate() (in 6-xspec-test-result/plots.py) knows, e.g., "1apec", "2apec",
+          "1apec1bknpower" (the lower photon index of bknpower is frozen),
+        * fit, "fpma", "fpmb" or "fpmab" (FPMA and FPMB together with a constant for FPMB),
+        * energy range, the (low, high) keV range to fit over.
+    They are named grid_<model>_<fit>_<low>-<high>_cstat.xcm (writefits mod_grid_..._cstat.fits) and are all fitted at
+    the same time, each in its own worker process and XSPEC session. Every fitted parameter, its error bounds and the
+    fit statistic are then collected into one numpy structured array (one row for each fit, NaN where a fit doesn't
+    have a parameter) by 6-xspec-test-result/fitTable.py and saved as a .npy file.
+
+    Run as, e.g.,
+        python3 xcmGrid.py 80414202001
+"""
+
+# the components of each fitting mode, in the order seperate() expects them
+MODEL_COMPONENTS = {"1apec":["apec"],
+                    "2apec":["apec", "apec"],
+                    "3apec":["apec", "apec", "apec"],
+                    "4apec":["apec", "apec", "apec", "apec"],
+                    "1apec1bknpower":["apec", "bknpower"],
+                    "2apec1bknpower":["apec", "bknpower", "apec"],
+                    "3apec1bknpower":["apec", "bknpower", "apec", "apec"],
+                    }
+
+# parameters of each component: (name, starting value or None for XSPEC's default, frozen, calculate errors)
+COMPONENT_PARAMETERS = {"apec":[("kT", None, False, True), ("Abundanc", None, True, False), ("Redshift", None, True, False), ("norm", None, False, True)],
+                        "bknpower":[("PhoIndx1", 2.0, True, False), ("BreakE", 6.0, False, True), ("PhoIndx2", 6.0, False, True), ("norm", None, False, True)],
+                        }
+
+# starting temperatures (keV) for each apec in a model so they don't all start (and end) in the same place, the first
+# starts where create_xcm.py's does (None, i.e., XSPEC's default of 1 keV from "model apec /*")
+APEC_START_KT = [None, 0.5, 2.0, 0.3]
+
+# builds the result table, from the run's 6-xspec-test-result directory
+FIT_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "6-xspec-test-result", "fitTable.py")
+
+# the default grid
+MODELS = ["1apec", "2apec", "1apec1bknpower"]
+FITS = ["fpma", "fpmb", "fpmab"]
+ENERGY_RANGES = [(2.5, 7.0), (2.5, 7.4), (2.5, 8.0), (3.0, 7.4)]
+
+XCM_TEMPLATE = """
+########################################################
+## Fit {description} with {model_expression}
+## with the new Feld 92A coronal abundances - this is actual solar coronal, unlike "abund feld" in xspec
+## Also using c-stat for fitting statistics - best choice when some low count bins
+##
+## Made by xcmGrid.py, fitting over {low:g} to {high:g} keV
+########################################################
+
+## Name of the pha file(s)
+data {data}
+
+## Use the c-stat for fitting
+statistic cstat
+
+setplot energy
+
+## Fit over {low:g} to {high:g}
+ignore *:0.-{low:g} {high:g}-**
+
+cpd /xw
+plot
+
+model {model_expression}
+/*
+
+## Starting values, frozen parameters (and the FPMB constant)
+{setup}
+
+renorm
+## Load in actual coronal abundances - "abund feld" is really photospheric!
+abund file feld92a_coronal0.txt
+fit 10000
+
+setplot xlog off
+plot ldata ratio
+
+## Show free parameters
+show free
+
+## Show fit values
+show fit
+
+## Errors at 1 sigma
+error 1.0 {errors}
+
+## Write out the fit results
+writefits {name}.fits
+
+
+notice *: 1.6-79.0
+
+"""
+
+
+def gridName(model, fit, energyRange):
+    """The name of a grid point, e.g., grid_1apec_fpma_2.5-7.4_cstat (the .xcm file is this with ".xcm", the fit
+    result is "mod_" with this and ".fits").
+    """
+    return f"grid_{model}_{fit}_{energyRange[0]:g}-{energyRange[1]:g}_cstat"
+
+
+def modelSetup(model, fit):
+    """Work out the XSPEC model expression and the commands to set up its parameters.
+
+    Parameters
+    ----------
+    model : str
+        The fitting mode (a key of MODEL_COMPONENTS).
+
+    fit : str
+        "fpma", "fpmb" or "fpmab".
+
+    Returns
+    -------
+    A tuple of the model expression (e.g., "const*(apec+bknpower)"), a list of the setup commands (newpar, freeze,
+    untie, thaw) and a list of the parameter numbers to calculate the errors of.
+    """
+    assert model in MODEL_COMPONENTS, f"Unknown model \'{model}\', can be one of {list(MODEL_COMPONENTS.keys())}."
+    components = MODEL_COMPONENTS[model]
+    expression = "+".join(components)
+
+    setup, errors = [], []
+    # a constant is the first parameter when fitting FPMA and FPMB together (fixed at 1 for FPMA)
+    number = 1
+    if fit=="fpmab":
+        expression = f"const*({expression})" if len(components)>1 else f"const*{expression}"
+        setup += ["newpar 1 1.0 -0.1"]
+        number = 2
+
+    apecs = 0
+    for component in components:
+        for name, start, frozen, error in COMPONENT_PARAMETERS[component]:
+            if (component=="apec") and (name=="kT"):
+                start = APEC_START_KT[apecs%len(APEC_START_KT)]
+                apecs += 1
+            if start is not None:
+                setup.append(f"newpar {number} {start:g}")
+            if frozen and (component!="apec"):
+                # apec's abundance and redshift are frozen by default
+                setup.append(f"freeze {number}")
+            if error:
+                errors.append(number)
+            number += 1
+
+    if fit=="fpmab":
+        # only the constant for FPMB varies, independent of FPMA
+        setup += [f"untie {number}", f"thaw {number}"]
+        errors.append(number)
+    return expression, setup, errors
+
+
+def gridXcm(obsid, model, fit, energyRange):
+    """The contents of the .xcm file for one grid point.
+
+    Parameters
+    ----------
+    obsid : str
+        The NuSTAR observation ID (for the spectrum file names).
+
+    model : str
+        The fitting mode (a key of MODEL_COMPONENTS).
+
+    fit : str
+        "fpma", "fpmb" or "fpmab".
+
+    energyRange : tuple
+        The (low, high) energy range (keV) to fit over.
+
+    Returns
+    -------
+    The .xcm file as a string.
+    """
+    expression, setup, errors = modelSetup(model, fit)
+    spectra = {"fpma":["A"], "fpmb":["B"], "fpmab":["A", "B"]}[fit]
+    data = " ".join([f"{n+1}:{n+1} nu{obsid}{m}06_cl_grade0_sr.pha" for n,m in enumerate(spectra)])
+    description = "one NuSTAR FPM" if len(spectra)==1 else "two NuSTAR FPMs"
+    if len(spectra)>1:
+        setup += ["setplot group 1-2", "setplot add"]
+    return XCM_TEMPLATE.format(description=description, model_expression=expression, data=data, setup="\n".join(setup),
+                               low=energyRange[0], high=energyRange[1], errors=" ".join([str(e) for e in errors]),
+                               name="mod_"+gridName(model, fit, energyRange))
+
+
+def writeGrid(obsid, directory="./", models=MODELS, fits=FITS, energyRanges=ENERGY_RANGES):
+    """Write the .xcm file for every combination of model, fit and energy range.
+
+    Parameters
+    ----------
+    obsid : str
+        The NuSTAR observation ID.
+
+    directory : str
+        Where to write the .xcm files (with the spectra and feld92a_coronal0.txt).
+        Default: "./"
+
+    models, fits, energyRanges : lists
+        The grid (see MODEL_COMPONENTS, FITS and ENERGY_RANGES).
+        Default: MODELS, FITS, ENERGY_RANGES
+
+    Returns
+    -------
+    A list of (model, fit, energyRange, .xcm file name) for each grid point.
+    """
+    grid = []
+    for model, fit, energyRange in itertools.product(models, fits, energyRanges):
+        assert energyRange[0]<energyRange[1], f"Energy range {energyRange} must be (low, high)."
+        xcm = gridName(model, fit, energyRange)+".xcm"
+        with open(os.path.join(directory, xcm), "w") as file:
+            file.write(gridXcm(obsid, model, fit, energyRange))
+        grid.append((model, fit, tuple(energyRange), xcm))
+    return grid
+
+
+def _gridFit(directory, xspecBatchFile, compressLog, profileFile):
+    """Run one grid fit (in a worker), a failed fit is reported instead of stopping the rest of the grid."""
+    start = time.time()
+    try:
+        timedRunXSPEC(directory, xspecBatchFile, logFile=True, overwrite=True, compressLog=compressLog, profileFile=profileFile)
+        status, message = "Passed", ""
+    except Exception as e:
+        status, message = "Failed", f"{type(e).__name__}: {e}"
+    return {"xspecBatchFile":xspecBatchFile, "directory":directory, "status":status, "message":message, "time":time.time()-start}
+
+
+def resultTable(grid, results, directory="./", tableFile="grid_results.npy"):
+    """Collect the results of the grid into one structured array.
+
+    The parameters are read and the table is built by fitTable.py in 6-xspec-test-result (next to this directory in every
+    run), the same reader the rest of the fit results go through.
+
+    Parameters
+    ----------
+    grid : list
+        From writeGrid().
+
+    results : list of dict
+        The outcome of each fit from runGrid(), in the same order as grid.
+
+    directory : str
+        Where the fits were run.
+        Default: "./"
+
+    tableFile : str or None
+        The .npy file (in directory) to save the table to, None to not keep it.
+        Default: "grid_results.npy"
+
+    Returns
+    -------
+    A numpy structured array with one row for each grid point and the fields "name", "model", "fit", "low", "high",
+    "time", "passed", then for each parameter found in any fit its value (e.g., "kT1") and bounds ("kT1_lower",
+    "kT1_upper"). Parameters a fit doesn't have are NaN.
+    """
+    rows = []
+    for (model, fit, energyRange, xcm), r in zip(grid, results):
+        fitsFile = os.path.abspath(os.path.join(directory, "mod_"+xcm[:-len(".xcm")]+".fits"))
+        rows.append({"name":xcm[:-len(".xcm")], "model":model, "fit":fit, "low":energyRange[0], "high":energyRange[1], "time":r["time"],
+                     "fits":{"":fitsFile if (r["status"]=="Passed") and os.path.isfile(fitsFile) else None}})
+    spec = {"fields":[("name", "U64"), ("model", "U16"), ("fit", "U8"), ("low", "f8"), ("high", "f8"), ("time", "f8")], "rows":rows, "sort":None}
+
+    with tempfile.TemporaryDirectory(prefix="grid_table_") as tmp:
+        table = os.path.abspath(os.path.join(directory, tableFile)) if tableFile is not None else os.path.join(tmp, "grid_results.npy")
+        subprocess.run([sys.executable, FIT_TABLE, "-", table], input=json.dumps(spec), universal_newlines=True, check=True)
+        return np.load(table)
+
+
+def runGrid(obsid, directory="./", models=MODELS, fits=FITS, energyRanges=ENERGY_RANGES, max_workers=None,
+            compressLog=False, profileFile=None, tableFile="grid_results.npy"):
+    """Write and fit the whole grid, all fits at the same time, and collect the results.
+
+    Parameters
+    ----------
+    obsid : str
+        The NuSTAR observation ID.
+
+    directory : str
+        Where the spectra are and the grid is written and fitted.
+        Default: "./"
+
+    models, fits, energyRanges : lists
+        The grid (see writeGrid()).
+        Default: MODELS, FITS, ENERGY_RANGES
+
+    max_workers : int or None
+        The number of fits to run at the same time (each in its own process and XSPEC session), None for the number
+        of CPUs.
+        Default: None
+
+    compressLog : bool
+        Write the log files with gzip compression (see XSPECfit()).
+        Default: False
+
+    profileFile : str or None
+        See XSPECfit(), None to use the STAGE_PROFILE_FILE environment variable (if it is set).
+        Default: None
+
+    tableFile : str or None
+        The .npy file (in directory) to save the result table to, None to not save it.
+        Default: "grid_results.npy"
+
+    Returns
+    -------
+    The result table (see resultTable()).
+
+    Example
+    -------
+    # fit one and two temperature models over two energy ranges to FPMA and FPMB together
+    table = runGrid("80414202001", models=["1apec", "2apec"], fits=["fpmab"], energyRanges=[(2.5,7.4), (3,7.4)])
+    table[["name", "kT2", "kT2_lower", "kT2_upper", "STATISTIC"]]
+    """
+    profileFile = os.environ.get("STAGE_PROFILE_FILE") if profileFile is None else profileFile
+    grid = writeGrid(obsid, directory=directory, models=models, fits=fits, energyRanges=energyRanges)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        fitting = [pool.submit(_gridFit, directory, xcm, compressLog, profileFile) for (_, _, _, xcm) in grid]
+        results = [f.result() for f in fitting]
+    fitResultsSummary(results)
+
+    return resultTable(grid, results, directory=directory, tableFile=tableFile)
+
+
+if __name__=="__main__":
+    # fit the default grid to the spectra in this directory
+    table = runGrid(sys.argv[1])
+    print(f"{np.sum(table['passed'])}/{len(table)} grid fits passed, results in grid_results.npy.")
@@ -0,0 +1,343 @@
+import os
+import re
+import sys
+import json
+import math
+import argparse
+
+""" Read everything we need to know about an XSPEC .xcm batch file in one go.
+
+    runXSPEC() needs to know which files an .xcm file will make (the "writefits" file, an mcmc "chain run" file, a gain
+    "set finalFILE" file) and downstream tools want to know things like the data files, fitting ranges and which parameters
+    had errors calculated. XcmManifest reads the .xcm file (and any .xcm files it runs with "@file") once and keeps all of it.
+    xcmManifest() gives back the same XcmManifest until any of the files it was read from change.
+
+    Run as, e.g.,
+        python3 xcmManifest.py apec1fit_fpma_cstat.xcm apec1fit_fpmb_cstat.xcm
+    to print the manifests (with the energy ranges each fit is over) as JSON, which is how the tools in
+    6-xspec-test-result read them.
+"""
+
+# "<group>:<spectrum>" or "<spectrum>" style identifiers used in the data command
+_SPECTRUM_ID = re.compile(r"^\d*:?\d+$")
+
+
+def _energy(value, default):
+    """Turn a range bound from ignore/notice (e.g., "0.", "7.4", "**") into a float, default for "**" (or nothing)."""
+    if value in ["", "**"]:
+        return default
+    return float(value)
+
+
+def _isChannel(value):
+    """Whether a range bound is a channel rather than an energy, XSPEC takes integers (no decimal point) as channels."""
+    return re.match(r"^[+-]?\d+$", value) is not None
+
+
+def _parseRanges(tokens):
+    """Parse the arguments of an ignore/notice command into a list of (spectra, low, high).
+
+    Parameters
+    ----------
+    tokens : list of str
+        The arguments, e.g., ["*:0.-2.5", "7.4-**"] from "ignore *:0.-2.5 7.4-**".
+
+    Returns
+    -------
+    A list of tuples (spectra, low, high) where spectra is the spectrum specifier (e.g., "*") which
+    carries on to the following ranges until another is given and low/high are the energies in keV ("**" is 0
+    for low and inf for high). Channel ranges (e.g., "1-10") and arguments that aren't ranges (e.g., "bad") are
+    skipped.
+    """
+    ranges = []
+    spectra = "*"
+    for t in tokens:
+        if ":" in t:
+            spectra, t = t.split(":", 1)
+        if "-" not in t:
+            continue
+        low, high = t.split("-", 1)
+        if _isChannel(low) or _isChannel(high):
+            # channels, not energies, these aren't included in the energy ranges
+            continue
+        try:
+            ranges.append((spectra, _energy(low, 0.), _energy(high, math.inf)))
+        except ValueError:
+            # not an energy range
+            continue
+    return ranges
+
+
+def _inSpectra(spectra, spectrum):
+    """Whether a spectrum specifier from ignore/notice (e.g., "*", "1", "1-2", "1,3") includes spectrum number n."""
+    if spectra in ["", "*"]:
+        return True
+    for part in spectra.split(","):
+        if "-" in part:
+            first, last = part.split("-", 1)
+            if first.isdigit() and last.isdigit() and int(first)<=spectrum<=int(last):
+                return True
+        elif part.isdigit() and int(part)==spectrum:
+            return True
+    return False
+
+
+def _ignore(intervals, low, high):
+    """Take the energies low to high out of a list of (low, high) intervals."""
+    kept = []
+    for a, b in intervals:
+        if (high<=a) or (low>=b):
+            kept.append((a, b))
+            continue
+        if a<low:
+            kept.append((a, low))
+        if high<b:
+            kept.append((high, b))
+    return kept
+
+
+def _notice(intervals, low, high):
+    """Add the energies low to high to a list of (low, high) intervals, merging any that overlap."""
+    merged = []
+    for a, b in sorted(intervals+[(low, high)]):
+        if (len(merged)>0) and (a<=merged[-1][1]):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+        else:
+            merged.append((a, b))
+    return merged
+
+
+def _parseError(tokens):
+    """Parse the arguments of an error command into the change in fit statistic and parameter numbers.
+
+    Parameters
+    ----------
+    tokens : list of str
+        The arguments, e.g., ["1.0", "1", "4"] from "error 1.0 1 4".
+
+    Returns
+    -------
+    A tuple of (delta, params) where delta is the change in fit statistic (None if the XSPEC default
+    is used) and params is a list of the parameter numbers.
+    """
+    delta, params = None, []
+    skip = 0
+    for t in tokens:
+        if skip>0:
+            skip -= 1
+            continue
+        if t.startswith("stop"):
+            skip = 2
+        elif t.startswith("max"):
+            skip = 1
+        elif t.startswith("non"):
+            continue
+        elif ("." in t) and (delta is None) and (len(params)==0):
+            delta = float(t)
+        elif re.match(r"^\d+-\d+$", t):
+            first, last = t.split("-")
+            params += list(range(int(first), int(last)+1))
+        elif t.isdigit():
+            params.append(int(t))
+    return delta, params
+
+
+class XcmManifest:
+    """Everything runXSPEC() and the other tools need from an XSPEC .xcm batch file, found in a single read of
+    the file (and of any other .xcm files it runs with "@file").
+
+    Parameters
+    ----------
+    xspecFile : str
+        The XSPEC .xcm file.
+
+    directory : str or None
+        The directory XSPEC is run in, which nested "@file" are relative to (as in runXSPEC()), None for the
+        current working directory.
+        Default: None
+
+    Attributes
+    ----------
+    writefits : str or None
+        The fits file from the first "writefits" command.
+
+    txtFile : str or None
+        The text file runXSPEC() will write with "wdata" (same name as writefits but .txt).
+
+    chain : str
+        The mcmc fits file from the first "chain run" command ("" if there isn't one).
+
+    finalFile : str
+        The gain fits file from the first "set finalFILE" command ("" if there isn't one).
+
+    dataFiles : list of str
+        The spectrum files loaded with "data".
+
+    ignoreRanges, noticeRanges : list of (str, float, float)
+        The (spectra, low, high) energy ranges from "ignore" and "notice", in order (channel ranges aren't included).
+
+    rangeCommands : list of (str, str, float, float)
+        Every "ignore" and "notice" range as (command, spectra, low, high) in the order they are run.
+
+    fitRangeCommands : int or None
+        How many of rangeCommands come before the first "fit" command (None if there isn't one).
+
+    errorDelta : float or None
+        The change in fit statistic used for the first "error" command (None for the XSPEC default).
+
+    errorParams : list of int
+        The parameter numbers from the "error" commands.
+
+    includes : list of str
+        Paths of the .xcm files run from this one with "@file".
+
+    sources : dict
+        The modification time of every file that was read, used to know when to read them again.
+
+    Example
+    -------
+    # find the fits file and fitting ranges of an .xcm file
+    manifest = XcmManifest("apec1fit_fpma_cstat.xcm")
+    manifest.writefits, manifest.ignoreRanges
+    """
+    def __init__(self, xspecFile, directory=None):
+        self.path = xspecFile
+        self.writefits = None
+        self.chain = ""
+        self.finalFile = ""
+        self.dataFiles = []
+        self.ignoreRanges = []
+        self.noticeRanges = []
+        self.rangeCommands = []
+        self.fitRangeCommands = None
+        self.errorDelta = None
+        self.errorParams = []
+        self.includes = []
+        self.sources = {}
+
+        # XSPEC looks for nested "@file" in its working directory
+        self._directory = "./" if directory is None else directory
+        self._read(xspecFile)
+
+    @property
+    def txtFile(self):
+        return None if self.writefits is None else self.writefits[:-5]+".txt"
+
+    def outputs(self):
+        """All the files that runXSPEC() will create from this .xcm file (not including the log file)."""
+        return [f for f in [self.writefits, self.txtFile, self.chain, self.finalFile] if f]
+
+    def _read(self, xspecFile):
+        """Go through an .xcm file line by line, following any "@file"."""
+        if xspecFile in self.sources:
+            # already read, don't get stuck in a loop
+            return
+        self.sources[xspecFile] = os.stat(xspecFile).st_mtime_ns
+
+        with open(xspecFile, "r") as lf:
+            for line in lf:
+                line = line.strip()
+                if (len(line)==0) or line.startswith("#"):
+                    continue
+
+                if line.startswith("@"):
+                    include = os.path.join(self._directory, line[1:].split()[0])
+                    include = include if include.endswith(".xcm") or os.path.isfile(include) else include+".xcm"
+                    if os.path.isfile(include):
+                        self.includes.append(include)
+                        self._read(include)
+                    continue
+
+                words = line.split()
+                command, args = words[0], words[1:]
+                if command=="writefits" and self.writefits is None and len(args)>0:
+                    self.writefits = args[-1]
+                elif command=="chain" and len(args)>1 and args[0]=="run" and self.chain=="":
+                    self.chain = args[-1]
+                elif command=="set" and len(args)>1 and args[0]=="finalFILE" and self.finalFile=="":
+                    self.finalFile = args[-1]
+                elif command=="data":
+                    self.dataFiles += [a for a in args if (not _SPECTRUM_ID.match(a)) and a!="none"]
+                elif command in ["ignore", "notice"]:
+                    ranges = _parseRanges(args)
+                    (self.ignoreRanges if command=="ignore" else self.noticeRanges).extend(ranges)
+                    self.rangeCommands += [(command, spectra, low, high) for spectra, low, high in ranges]
+                elif command=="fit" and self.fitRangeCommands is None:
+                    self.fitRangeCommands = len(self.rangeCommands)
+                elif command=="error":
+                    delta, params = _parseError(args)
+                    self.errorDelta = delta if self.errorDelta is None else self.errorDelta
+                    self.errorParams += [p for p in params if p not in self.errorParams]
+
+    def fittingRanges(self, spectrum=1):
+        """The energy ranges (keV) of a spectrum that are noticed when the first "fit" command runs.
+
+        Parameters
+        ----------
+        spectrum : int
+            The spectrum number (1 for the first file given to "data").
+            Default: 1
+
+        Returns
+        -------
+        A list of (low, high) ranges, from applying the "ignore" and "notice" commands before the fit (all of them if
+        there is no fit) in order to every energy, e.g., [(2.5, 7.4)] for "ignore *:0.-2.5 7.4-**".
+        """
+        intervals = [(0., math.inf)]
+        for command, spectra, low, high in self.rangeCommands[:self.fitRangeCommands]:
+            if _inSpectra(spectra, spectrum):
+                intervals = _ignore(intervals, low, high) if command=="ignore" else _notice(intervals, low, high)
+        return intervals
+
+    def isCurrent(self):
+        """Check none of the files this was read from have changed."""
+        try:
+            return all([os.stat(f).st_mtime_ns==t for f,t in self.sources.items()])
+        except OSError:
+            return False
+
+
+# manifests that have already been read, by absolute path of the file and of the directory XSPEC is run in
+_MANIFESTS = {}
+
+def xcmManifest(xspecFile, directory=None):
+    """Get the XcmManifest of an .xcm file, only reading the file again if it (or a file it includes) has changed.
+
+    Parameters
+    ----------
+    xspecFile : str
+        The XSPEC .xcm file.
+
+    directory : str or None
+        The directory XSPEC is run in, see XcmManifest.
+        Default: None
+
+    Returns
+    -------
+    The XcmManifest of the file.
+
+    Example
+    -------
+    # get the fits file name from the .xcm file
+    fitsFile = xcmManifest("apec1fit_fpma_cstat.xcm").writefits
+    """
+    key = (os.path.abspath(xspecFile), os.path.abspath("./" if directory is None else directory))
+    manifest = _MANIFESTS.get(key)
+    if (manifest is None) or (not manifest.isCurrent()):
+        manifest = XcmManifest(xspecFile, directory=directory)
+        _MANIFESTS[key] = manifest
+    return manifest
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Print what is in XSPEC .xcm files as JSON.")
+    parser.add_argument("xcm", nargs="+", help="The .xcm files.")
+    parser.add_argument("--directory", default=None, help="The directory XSPEC is run in, which nested @file are relative to. Default: the current directory")
+    args = parser.parse_args()
+
+    manifests = [xcmManifest(x, directory=args.directory) for x in args.xcm]
+    json.dump([{"xcm":m.path, "writefits":m.writefits, "dataFiles":m.dataFiles, "errorParams":m.errorParams,
+                "fittingRanges":[m.fittingRanges(spectrum=n+1) for n in range(max(len(m.dataFiles), 1))]} for m in manifests],
+              sys.stdout, indent=1)
+    print()
+    sys.exit(0)
@@ -0,0 +1,250 @@
+import re
+import sys
+import gzip
+import json
+import time
+import argparse
+
+""" Turn XSPEC's terminal output into typed events as it is read, e.g., while runXSPEC() is running a fit.
+
+    Each line XSPEC prints is given to XSPECEvents.feed() which gives back any events it finishes:
+        * "command"      : a command XSPEC ran ("!XSPEC12>fit 10000"),
+        * "fit_start"    : the start of the iterations table of a fit, with the parameters being fitted,
+        * "fit_iteration": one row of that table, the statistic, |beta|/N, Lvl and the value of each parameter,
+        * "fit_end"      : the end of the table, with the number of iterations and the last statistic and parameters,
+        * "parameter"    : a row of the parameter table from "show fit"/"show param" (or after a fit), with its value and
+                           sigma or whether it is frozen or linked,
+        * "statistic"    : the fit or test statistic ("Fit statistic : C-Statistic 109.34 using 123 bins."),
+        * "null_hypothesis": the null hypothesis probability and degrees of freedom,
+        * "error"        : a result of the "error" command, the parameter's lower and upper bounds.
+    Every event has its "type", the number of the output "line" it finished on, and the "elapsed" time (s) since the
+    parser was made. The events can go to a callback (which can ask for the fit to be stopped by returning True) and/or be
+    written as JSON lines, or be iterated over with xspecEvents() (e.g., from an existing log with logEvents()).
+
+    Run as, e.g.,
+        python3 xspecEvents.py mod_apec1fit_fpma_cstat.log --jsonl mod_apec1fit_fpma_cstat.events.jsonl
+"""
+
+PROMPT = "!XSPEC12>"
+_NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]?nan|[-+]?inf"
+ITERATION_HEADER = re.compile(r"^\s*(?P<statistic>\S+(?: \S+)?)\s+\|beta\|/N\s+Lvl\s+(?:Par #\s+)?(?P<parameters>.*?)\s*$")
+STATISTIC = re.compile(r"^\s*(?P<kind>Fit|Test) statistic\s*:\s*(?P<name>[A-Za-z][\w\- ]*?)\s*=?\s+(?P<value>"+_NUMBER+r")(?:\s+using\s+(?P<bins>\d+))?")
+NULL_HYPOTHESIS = re.compile(r"Null hypothesis probability of\s+(?P<probability>"+_NUMBER+r")\s+with\s+(?P<dof>\d+)\s+degrees of freedom")
+PARAMETER_HEADER = re.compile(r"^\s*par\s+comp\s*$")
+PARAMETER = re.compile(r"^\s*(?P<number>\d+)\s+(?P<component>\d+)\s+(?P<model>\S+)\s+(?P<name>\S+)\s+(?:(?P<unit>\S+)\s+)??"
+                       r"(?P<value>"+_NUMBER+r")\s*(?:\+/-\s+(?P<sigma>"+_NUMBER+r")|(?P<frozen>frozen)|=\s*(?P<link>.+?))?\s*$")
+ERROR_HEADER = re.compile(r"^\s*Parameter\s+Confidence Range")
+ERROR = re.compile(r"^\s*(?P<number>\d+)\s+(?P<lower>"+_NUMBER+r")\s+(?P<upper>"+_NUMBER+r")\s+\((?P<minus>"+_NUMBER+r"),\s*(?P<plus>"+_NUMBER+r")\)")
+
+
+def _number(text):
+    """A number from XSPEC's output as a float (NaN if it can't be read)."""
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class XSPECEvents:
+    """Parses XSPEC's output line by line into events.
+
+    Parameters
+    ----------
+    callback : callable or None
+        Called with each event (a dictionary) as soon as it is found. If it returns True then stopRequested is set
+        (runXSPEC() then stops the fit).
+        Default: None
+
+    jsonlFile : str
+        File to write every event to, one JSON object per line (opened once, gzipped if it ends with ".gz"). An
+        empty string writes nothing.
+        Default: ""
+
+    Example
+    -------
+    # print the statistic of every fit iteration as XSPEC prints them
+    def show(event):
+        if event["type"]=="fit_iteration":
+            print(event["iteration"], event["statistic"])
+
+    with XSPECEvents(callback=show, jsonlFile="fit.events.jsonl") as parser:
+        for line in xspecOutput:
+            parser.feed(line)
+    """
+    def __init__(self, callback=None, jsonlFile=""):
+        self.callback = callback
+        self.stopRequested = False
+        self._start = time.time()
+        self._lineNumber = 0
+        self._mode = None
+        self._fits = 0
+        self._fit = None
+        if len(jsonlFile)==0:
+            self._file = None
+        else:
+            self._file = gzip.open(jsonlFile, "wt") if jsonlFile.endswith(".gz") else open(jsonlFile, "w")
+
+    def _event(self, eventType, **values):
+        """Make an event, send it to the callback and the JSONL file."""
+        event = {"type":eventType, "line":self._lineNumber, "elapsed":time.time()-self._start, **values}
+        if (self.callback is not None) and (self.callback(event) is True):
+            self.stopRequested = True
+        if self._file is not None:
+            self._file.write(json.dumps(event)+"\n")
+            if eventType in ["fit_end", "statistic", "error"]:
+                self._file.flush()
+        return event
+
+    def _endFit(self):
+        """The fit_end event of the current iterations table."""
+        fit, self._fit, self._mode = self._fit, None, None
+        last = fit["last"]
+        return self._event("fit_end", fit=fit["fit"], statistic_name=fit["statistic_name"], iterations=fit["iterations"],
+                           statistic=None if last is None else last["statistic"],
+                           parameters={} if last is None else last["parameters"])
+
+    def feed(self, line):
+        """Read a line of XSPEC's output.
+
+        Parameters
+        ----------
+        line : str
+            The line (with or without its newline).
+
+        Returns
+        -------
+        A list of the events the line finished (usually none or one).
+        """
+        self._lineNumber += 1
+        line = line.rstrip("\n")
+        events = []
+
+        if self._mode=="iterations":
+            tokens = line.split()
+            if len(tokens)==3+len(self._fit["parameters"]) and all([re.fullmatch(_NUMBER, t) for t in tokens]):
+                self._fit["iterations"] += 1
+                values = [_number(t) for t in tokens]
+                self._fit["last"] = {"statistic":values[0], "parameters":dict(zip(self._fit["parameters"], values[3:]))}
+                return [self._event("fit_iteration", fit=self._fit["fit"], iteration=self._fit["iterations"],
+                                    statistic=values[0], beta=values[1], lvl=int(values[2]) if values[2]==values[2] else None, parameters=self._fit["last"]["parameters"])]
+            # anything else is the end of the table (this line is looked at again below)
+            events.append(self._endFit())
+
+        if line.startswith(PROMPT):
+            self._mode = None
+            events.append(self._event("command", command=line[len(PROMPT):].strip()))
+            return events
+
+        header = ITERATION_HEADER.match(line)
+        if header is not None:
+            self._fits += 1
+            parameters = header["parameters"].split()
+            self._mode = "iterations"
+            self._fit = {"fit":self._fits, "statistic_name":header["statistic"], "parameters":parameters, "iterations":0, "last":None}
+            events.append(self._event("fit_start", fit=self._fits, statistic_name=header["statistic"], parameters=parameters))
+            return events
+
+        if PARAMETER_HEADER.match(line):
+            self._mode = "parameters"
+            return events
+        if ERROR_HEADER.match(line):
+            self._mode = "error"
+            return events
+
+        if self._mode=="parameters":
+            if line.strip().startswith("____"):
+                self._mode = None
+                return events
+            match = PARAMETER.match(line)
+            if match is not None:
+                events.append(self._event("parameter", number=int(match["number"]), component=int(match["component"]),
+                                          model=match["model"], name=match["name"], unit=match["unit"] or "",
+                                          value=_number(match["value"]), sigma=_number(match["sigma"]) if match["sigma"] else None,
+                                          frozen=match["frozen"] is not None, link=match["link"]))
+            return events
+
+        if self._mode=="error":
+            match = ERROR.match(line)
+            if match is not None:
+                events.append(self._event("error", number=int(match["number"]), lower=_number(match["lower"]),
+                                          upper=_number(match["upper"]), minus=_number(match["minus"]), plus=_number(match["plus"])))
+            return events
+
+        match = STATISTIC.match(line)
+        if match is not None:
+            events.append(self._event("statistic", kind=match["kind"].lower(), name=match["name"].strip(), value=_number(match["value"]),
+                                      bins=int(match["bins"]) if match["bins"] else None))
+            return events
+        match = NULL_HYPOTHESIS.search(line)
+        if match is not None:
+            events.append(self._event("null_hypothesis", probability=_number(match["probability"]), dof=int(match["dof"])))
+        return events
+
+    def finish(self):
+        """End anything still open (e.g., the output stopped in the middle of a fit), returns any events that makes."""
+        return [self._endFit()] if self._mode=="iterations" else []
+
+    def close(self):
+        """Finish and close the JSONL file."""
+        self.finish()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def xspecEvents(lines, **kwargs):
+    """Iterate over the events in XSPEC's output.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        The lines of XSPEC's output (e.g., an open log file).
+
+    kwargs :
+        Passed to XSPECEvents (e.g., jsonlFile).
+
+    Returns
+    -------
+    A generator of the events (dictionaries).
+
+    Example
+    -------
+    iterations = [e["iterations"] for e in xspecEvents(open("mod_apec1fit_fpma_cstat.log")) if e["type"]=="fit_end"]
+    """
+    with XSPECEvents(**kwargs) as parser:
+        for line in lines:
+            yield from parser.feed(line)
+        yield from parser.finish()
+
+
+def logEvents(logFile, **kwargs):
+    """The events in an XSPEC log file written by runXSPEC() (".log" or ".log.gz"), see xspecEvents()."""
+    with (gzip.open(logFile, "rt") if logFile.endswith(".gz") else open(logFile, "r", errors="replace")) as log:
+        yield from xspecEvents(log, **kwargs)
+
+
+def eventSummary(events):
+    """Prints the fits (iterations and final statistic), statistics and error results from a list of events."""
+    for e in events:
+        if e["type"]=="fit_end":
+            print(f"Fit {e['fit']}: {e['iterations']} iterations, {e['statistic_name']} {e['statistic']} ({e['elapsed']:.2f} s)")
+        elif e["type"]=="statistic":
+            print(f"{e['kind'].capitalize()} statistic: {e['name']} {e['value']}"+("" if e["bins"] is None else f" using {e['bins']} bins"))
+        elif e["type"]=="error":
+            print(f"Parameter {e['number']}: {e['lower']} to {e['upper']} ({e['minus']:+}, {e['plus']:+})")
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Parse an XSPEC log into typed events.")
+    parser.add_argument("log", help="XSPEC log file (e.g., from runXSPEC(), .log or .log.gz).")
+    parser.add_argument("--jsonl", default="", help="Write the events to this JSON lines file.")
+    args = parser.parse_args()
+
+    eventSummary(list(logEvents(args.log, jsonlFile=args.jsonl)))
+    sys.exit(0)
@@ -0,0 +1,318 @@
+import subprocess
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from subprocessXspec import prepareXSPECrun, checkXSPECline, LogSink, fitResultsSummary
+
+""" Keep XSPEC sessions open and reuse them for many fits instead of starting a new XSPEC for every .xcm file.
+
+    Starting XSPEC (the Tcl environment, model libraries, etc.) is a noticeable part of each fit. An XspecSession keeps one
+    XSPEC running, runs an .xcm file the same way runXSPEC() does (but without the final "exit"), and then resets XSPEC so
+    the next fit starts from a clean state. An XspecSessionPool hands fits out to N of these sessions and replaces a session
+    after it has run a given number of fits or if anything went wrong with it.
+
+    Comments:*Same requirements as subprocessXspec.py, i.e., "writefits" and "error" must be used in the XSPEC batch script.
+             *Fits, text, and log files created are the same as with runXSPEC().
+"""
+
+# commands to put XSPEC back to a clean state between fits (XSPEC's defaults). What these don't reset carries over to the
+# next fit: "setplot" settings other than "add" (e.g., "energy", "xlog", "rebin"; plot groups go with "data none"), "xset"
+# variables, the "query" setting, "error stopat" and chain length/burn/walkers. Use maxJobs=1 (a new XSPEC for every fit)
+# if the .xcm files change any of these differently.
+RESET_COMMANDS = ["data none",
+                  "model none",
+                  "statistic chi",
+                  "abund angr",
+                  "xsect vern",
+                  "cosmo 70 0 0.73",
+                  "method leven 10 0.01",
+                  "weight standard",
+                  "systematic 0",
+                  "energies reset",
+                  "chain clear",
+                  "setplot noadd",
+                  "cpd none"]
+
+
+class XspecSession:
+    """One XSPEC process that is kept open to run many .xcm files, one after the other.
+
+    Parameters
+    ----------
+    resetCommands : list of str
+        The XSPEC commands to run after each fit to clear everything that was set up.
+        Default: RESET_COMMANDS
+
+    commandTimeout : float or None
+        The maximum time (in seconds) any single command can take, None for no limit. If this is reached
+        then a TimeoutError is raised and the session should not be used again.
+        Default: None
+
+    Example
+    -------
+    # run two fits with the same XSPEC session
+    session = XspecSession()
+    session.run("apec1fit_fpma_cstat.xcm", logFile=True, overwrite=True)
+    session.run("apec1fit_fpmb_cstat.xcm", logFile=True, overwrite=True)
+    session.close()
+    """
+    def __init__(self, resetCommands=RESET_COMMANDS, commandTimeout=None):
+        self.resetCommands = resetCommands
+        self.commandTimeout = commandTimeout
+        self.jobs = 0
+        self._syncs = 0
+
+        self.xspec = subprocess.Popen(["xspec"],
+                                      stdin =subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE,
+                                      universal_newlines=True,
+                                      bufsize=0)
+
+        # read stdout and stderr in the background so we can wait on them with a timeout and the pipes never fill up
+        self._lines = queue.Queue()
+        self.stderr = []
+        self._readers = [threading.Thread(target=self._read, args=(self.xspec.stdout, self._lines.put), daemon=True),
+                         threading.Thread(target=self._read, args=(self.xspec.stderr, self.stderr.append), daemon=True)]
+        for r in self._readers:
+            r.start()
+
+        # make sure XSPEC is up and ready to go before any fits are given to it
+        self._sync()
+
+    @staticmethod
+    def _read(stream, store):
+        """Pass every line from a stream to store, then None once the stream ends."""
+        for line in iter(stream.readline, ""):
+            store(line)
+        store(None)
+
+    def _readline(self):
+        """Get the next line of XSPEC's stdout, waiting at most commandTimeout."""
+        try:
+            line = self._lines.get(timeout=self.commandTimeout)
+        except queue.Empty:
+            raise TimeoutError(f"XSPEC did not respond within {self.commandTimeout} s.")
+        if line is None:
+            raise RuntimeError(f"XSPEC session stopped (return code {self.xspec.wait()}).")
+        return line
+
+    def _send(self, command):
+        """Send a command (without the newline) to XSPEC."""
+        self.xspec.stdin.write(command+"\n")
+
+    def _sync(self):
+        """Wait until XSPEC has gone through everything sent to it so far. The output is thrown away.
+
+        XSPEC commands run in Tcl so ask Tcl to print a unique line and wait until it appears.
+        """
+        self._syncs += 1
+        token = f"XSPEC_SESSION_READY_{self._syncs}"
+        self._send(f"puts {token}")
+        while True:
+            line = self._readline()
+            if (token in line) and ("puts" not in line):
+                return
+
+    def run(self, xspecBatchFile, logFile=False, overwrite=False, directory=None, compressLog=False):
+        """Runs an XSPEC .xcm batch file and the manual commands to complete the fit, like runXSPEC(),
+        then resets XSPEC ready for the next fit.
+
+        Parameters
+        ----------
+        xspecBatchFile, logFile, overwrite, directory, compressLog :
+            See runXSPEC() in subprocessXspec.py.
+
+        Returns
+        -------
+        None.
+        """
+        # check the output files are clear to be written and get the commands to send to XSPEC
+        cmds, logFile = prepareXSPECrun(xspecBatchFile, logFile=logFile, overwrite=overwrite, directory=directory, compressLog=compressLog)
+        self.runCommands(cmds, logFile, directory=directory, compressLog=compressLog)
+
+    def runCommands(self, cmds, logFile, directory=None, compressLog=False):
+        """Runs the commands from prepareXSPECrun() (see run()) then resets XSPEC ready for the next fit.
+
+        Parameters
+        ----------
+        cmds, logFile :
+            The output of prepareXSPECrun() in subprocessXspec.py.
+
+        directory, compressLog :
+            See runXSPEC() in subprocessXspec.py.
+
+        Returns
+        -------
+        None.
+        """
+        # the last "exit" would close XSPEC so leave it off
+        cmds = cmds[:-1]
+
+        # XSPEC has its own working directory (Tcl's) so move it to where the fit should be run
+        self._send("cd "+os.path.abspath("./" if directory is None else directory))
+        self._sync()
+
+        self.jobs += 1
+        with LogSink(logFile, compress=compressLog) as log:
+            for number, command in enumerate(cmds):
+                self._send(command)
+
+                # see runXSPEC() and checkXSPECline() for how we know when each command is done
+                state = {"errors_ran":False, "outputLines":0}
+                while True:
+                    line = self._readline()
+
+                    log.write(line)
+
+                    reply, marker = checkXSPECline(cmds, number, line, state)
+                    if reply is not None:
+                        self.xspec.stdin.write(reply)
+                    if marker is not None:
+                        log.write(marker)
+                        log.flush()
+                        break
+            log.write(f"\n***FINISHED COMMANDS {cmds}.***")
+
+        self.reset()
+
+    def reset(self):
+        """Put XSPEC back to a clean state (see resetCommands) for the next fit."""
+        for command in self.resetCommands:
+            self._send(command)
+        self._sync()
+
+    def close(self, kill=False):
+        """Close XSPEC, killing it if it does not exit nicely (or straight away if kill is True)."""
+        if self.xspec.poll() is None:
+            try:
+                if kill:
+                    raise subprocess.TimeoutExpired("xspec", 0)
+                self._send("exit")
+                self.xspec.wait(timeout=10)
+            except (BrokenPipeError, OSError, subprocess.TimeoutExpired):
+                self.xspec.kill()
+                self.xspec.wait()
+        for stream in [self.xspec.stdin, self.xspec.stdout, self.xspec.stderr]:
+            stream.close()
+
+
+class XspecSessionPool:
+    """A number of XspecSession that are kept open and reused to run many fits at the same time.
+
+    Parameters
+    ----------
+    size : int
+        The number of XSPEC sessions (and so the number of fits that can run at the same time).
+
+    maxJobs : int or None
+        The number of fits a session runs before it is closed and replaced with a new one. None to keep
+        using the session for as long as it works.
+        Default: 20
+
+    resetCommands, commandTimeout :
+        See XspecSession.
+
+    Example
+    -------
+    # run three fits with two XSPEC sessions
+    with XspecSessionPool(2) as pool:
+        results = pool.run(["./", "./", "./"], ["f1.xcm", "f2.xcm", "f3.xcm"], logFile=True, overwrite=True)
+    """
+    def __init__(self, size, maxJobs=20, resetCommands=RESET_COMMANDS, commandTimeout=None):
+        self.size = size
+        self.maxJobs = maxJobs
+        self.resetCommands = resetCommands
+        self.commandTimeout = commandTimeout
+
+        # idle sessions to hand the fits to, None is a slot for a session that has not been started (yet or again)
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(None)
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _fit(self, directory, xspecBatchFile, logFile, overwrite, compressLog):
+        """Run one fit on an idle session, recycling the session if it has done enough or something went wrong."""
+        start = time.time()
+        result = {"xspecBatchFile":xspecBatchFile, "directory":directory, "status":"Passed", "message":"", "time":0}
+
+        # check the .xcm file and its outputs before taking a session, a problem with them isn't a problem with XSPEC
+        try:
+            cmds, logFile = prepareXSPECrun(xspecBatchFile, logFile=logFile, overwrite=overwrite, directory=directory, compressLog=compressLog)
+        except (AssertionError, OSError) as e:
+            result.update(status="Failed", message=str(e), time=time.time()-start)
+            return result
+
+        session = self._idle.get()
+        try:
+            if session is None:
+                session = XspecSession(resetCommands=self.resetCommands, commandTimeout=self.commandTimeout)
+                with self._lock:
+                    self._sessions.append(session)
+            session.runCommands(cmds, logFile, directory=directory, compressLog=compressLog)
+        except (TimeoutError, RuntimeError, OSError) as e:
+            result.update(status="Failed", message=str(e))
+        finally:
+            # start again with a new session after an error or once this one has been used enough
+            if (session is not None) and ((result["status"]!="Passed") or ((self.maxJobs is not None) and (session.jobs>=self.maxJobs))):
+                self._retire(session, kill=result["status"]!="Passed")
+                session = None
+            self._idle.put(session)
+
+        result["time"] = time.time()-start
+        return result
+
+    def _retire(self, session, kill=False):
+        """Close a session and forget about it."""
+        session.close(kill=kill)
+        with self._lock:
+            self._sessions.remove(session)
+
+    def run(self, directory, xspecBatchFile, logFile=False, overwrite=False, compressLog=False):
+        """Runs XSPEC .xcm batch file(s) in the corresponding directory(s) on the pool's sessions.
+
+        Parameters
+        ----------
+        directory, xspecBatchFile, logFile, overwrite, compressLog :
+            See XSPECfit() in subprocessXspec.py.
+
+        Returns
+        -------
+        A list of dictionaries with the result of each fit (keys "xspecBatchFile", "directory", "status",
+        "message", and "time"), in the same order as xspecBatchFile.
+        """
+        # make them loops and so loop-able
+        directory = directory if type(directory)==list else[directory]
+        xspecBatchFile = xspecBatchFile if type(xspecBatchFile)==list else[xspecBatchFile]
+        assert len(directory)==len(xspecBatchFile), "The \'directory\' and \'xspecBatchFile\' inputs must have the same number of entries."
+
+        with ThreadPoolExecutor(max_workers=self.size) as workers:
+            fits = [workers.submit(self._fit, d, xcm, logFile, overwrite, compressLog) for d,xcm in zip(directory, xspecBatchFile)]
+            return [f.result() for f in fits]
+
+    def close(self):
+        """Close all the XSPEC sessions."""
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__=="__main__":
+    test=False
+    if test:
+        with XspecSessionPool(2) as pool:
+            results = pool.run(["./", "./", "./"],
+                               ["apec1fit_fpma_cstat.xcm", "apec1fit_fpmb_cstat.xcm", "apec1fit_fpmab_cstat.xcm"],
+                               logFile=True, overwrite=True)
+        fitResultsSummary(results)
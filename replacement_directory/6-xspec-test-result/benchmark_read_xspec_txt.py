@@ -0,0 +1,119 @@
+import sys
+import os
+import time
+import tempfile
+import numpy as np
+
+from plots import read_xspec_txt
+
+""" Times read_xspec_txt() against the way it used to read the XSPEC .txt files (reading the whole file into one string, 
+    splitting it up, and building each row with a Python loop).
+
+    Run as `python3 benchmark_read_xspec_txt.py [<number of energy bins>] [<repeats>]` or give it real files with 
+    `python3 benchmark_read_xspec_txt.py mod_apec1fit_fpma_cstat.txt ...`.
+"""
+
+def read_xspec_txt_previous(f):
+    ''' The previous version of read_xspec_txt(), kept here to compare against.
+    '''
+    f = f if f.endswith('.txt') else f+'.txt'
+    
+    asc = open(f, 'r')  # We need to re-open the file
+    data = asc.read()
+    asc.close()
+    
+    sep_lists = data.split('!')[1].split('NO NO NO NO NO') #seperate counts info from photon info from ratio info
+    _file = {}
+    for l in range(len(sep_lists)):
+        tmp_list = sep_lists[l].split('\n')[1:-1] # seperate list by lines and remove the blank space from list ends
+        num_list = []
+        for s in tmp_list:
+            new_line = s.split(' ') # numbers are seperated by spaces
+            for c, el in enumerate(new_line):
+                if el == 'NO':
+                    # if a value is NO then make it a NaN
+                    new_line[c] = np.nan
+            num_line = list(map(float, new_line)) # have the values as strings, map them to floats
+            num_list.append(num_line)
+        num_list = np.array(num_list)
+        ## first block of NO NO NO... should be counts, second photons, third ratio
+        if l == 0:
+            _file['counts'] = num_list
+        if l == 1:
+            _file['photons'] = num_list
+        if l == 2:
+            _file['ratio'] = num_list
+    return _file
+
+def fakeXspecTxt(f, n_bins=4096, n_models=2):
+    ''' Write a file that looks like the output of "wdata" after "iplot ldata ufspec rat".
+
+    Parameters
+    ----------
+    f : str
+            The file to write.
+
+    n_bins : int
+            The number of energy bins.
+            Default: 4096
+
+    n_models : int
+            The number of model components (extra columns).
+            Default: 2
+            
+    Returns
+    -------
+    None.
+    '''
+    rng = np.random.default_rng(0)
+    energy = np.linspace(1.6, 79, n_bins)
+    def _rows(n_columns, no_column=None):
+        values = rng.random((n_bins, n_columns))
+        values[:,0] = energy
+        rows = [" ".join([f"{v:g}" for v in r]) for r in values]
+        if no_column is not None:
+            rows = [" ".join(r.split(" ")[:no_column]+["NO"]*(n_columns-no_column)) for r in rows]
+        return "\n".join(rows)+"\n"
+    separator = " ".join(["NO"]*(5+n_models))+"\n"
+    with open(f, "w") as txt:
+        txt.write("@mod.pco\n!\n")
+        txt.write(_rows(5+n_models))
+        txt.write(separator)
+        txt.write(_rows(5+n_models))
+        txt.write(separator)
+        txt.write(_rows(5+n_models, no_column=4))
+
+def timeIt(function, f, repeats):
+    ''' Best time (in seconds) of running function(f) a number of times.
+    '''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(f)
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+def compare(f, repeats=5):
+    ''' Check both versions give the same output for a file and print how long each took.
+    '''
+    new, previous = read_xspec_txt(f), read_xspec_txt_previous(f)
+    assert new.keys()==previous.keys(), f"Different blocks found in {f}."
+    for k in new.keys():
+        np.testing.assert_array_equal(new[k], previous[k])
+
+    t_new, t_previous = timeIt(read_xspec_txt, f, repeats), timeIt(read_xspec_txt_previous, f, repeats)
+    print(f"{os.path.basename(f)} ({os.path.getsize(f)/1e6:.2f} MB): previous {t_previous*1e3:.1f} ms, new {t_new*1e3:.1f} ms, speed-up {t_previous/t_new:.1f}x")
+
+
+if __name__=="__main__":
+    if len(sys.argv)>1 and sys.argv[1].endswith(".txt"):
+        for f in sys.argv[1:]:
+            compare(f)
+    else:
+        n_bins = int(sys.argv[1]) if len(sys.argv)>1 else 4096
+        repeats = int(sys.argv[2]) if len(sys.argv)>2 else 5
+        with tempfile.TemporaryDirectory() as tmp:
+            for n in [n_bins//8, n_bins, n_bins*8]:
+                f = os.path.join(tmp, f"mod_fake_{n}bins.txt")
+                fakeXspecTxt(f, n_bins=n)
+                compare(f, repeats=repeats)
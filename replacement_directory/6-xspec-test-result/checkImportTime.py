@@ -0,0 +1,82 @@
+import sys
+import os
+import subprocess
+
+""" Checks that the modules used without plotting (e.g., by getXspecParameters.py and compareFits.py) import quickly and
+    don't pull in matplotlib (or astropy, which is only needed once a fits file is opened).
+
+    Each module is imported in a fresh Python with `-X importtime` (best of a few tries) and the time is compared to a budget.
+    Run as `python3 checkImportTime.py [<budget in seconds>] [<repeats>]`, the exit code is 1 if a module is over the budget
+    or imports something it shouldn't.
+"""
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# module: the packages it shouldn't import when it's imported
+MODULES = {"plots":["matplotlib", "mpl_toolkits", "astropy"],
+           "fitResult":["astropy"],
+           "xspecCache":["matplotlib", "astropy"],
+           "getXspecParameters":["matplotlib", "mpl_toolkits", "astropy"],
+           "goodnessOfFit":["matplotlib", "mpl_toolkits", "astropy"],
+           "compareFits":["matplotlib", "mpl_toolkits", "astropy"],
+           }
+
+def importTime(module):
+    ''' Import a module in a new Python process.
+
+    Parameters
+    ----------
+    module : str
+            The module (in this directory) to import.
+
+    Returns
+    -------
+    The import time of the module (in seconds, including everything it imports) and the set of top-level
+    packages that got imported.
+    '''
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=HERE,
+                         capture_output=True, universal_newlines=True, check=True)
+    total, imported = None, set()
+    # lines look like "import time:      self [us] |  cumulative | imported package"
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imported.add(name.strip().split(".")[0])
+        if name.strip()==module:
+            total = int(cumulative)/1e6
+    return total, imported
+
+def check(budget=0.25, repeats=3):
+    ''' Check every module in MODULES against the import time budget and its list of packages to avoid.
+
+    Parameters
+    ----------
+    budget : float
+            The most time (in seconds) each module can take to import.
+            Default: 0.25
+
+    repeats : int
+            Number of times to import each module, the fastest is used.
+            Default: 3
+
+    Returns
+    -------
+    True if every module is within budget and avoids its packages.
+    '''
+    passed = True
+    for module, avoid in MODULES.items():
+        results = [importTime(module) for _ in range(repeats)]
+        t, imported = min([r[0] for r in results]), results[0][1]
+        pulled_in = sorted(set(avoid) & imported)
+        ok = (t<=budget) and (len(pulled_in)==0)
+        passed &= ok
+        print(f"{module.ljust(20)} {t*1e3:7.1f} ms (budget {budget*1e3:.0f} ms)"+
+              (f", imports {', '.join(pulled_in)}" if len(pulled_in)>0 else "")+("" if ok else "  <- FAILED"))
+    return passed
+
+
+if __name__=="__main__":
+    budget = float(sys.argv[1]) if len(sys.argv)>1 else 0.25
+    repeats = int(sys.argv[2]) if len(sys.argv)>2 else 3
+    sys.exit(0 if check(budget=budget, repeats=repeats) else 1)
@@ -0,0 +1,253 @@
+'''
+Compare the XSPEC fit results (every mod_*.fits) of a benchmark run to any number of other runs in one go.
+
+Every fitted parameter (any column with a matching "E<column>" error column) and the fit STATISTIC are loaded from each
+run directory in parallel, lined up into arrays (runs x parameters) with their error bounds, and checked against the
+benchmark with absolute, relative and/or sigma tolerances all at once. A parameter passes if it is within any of the
+tolerances given (only if it is exactly the same when none are given). The result is written as a JSON or CSV report and
+the exit code is 1 if anything failed or a run has no fits to compare.
+
+Run as, e.g.,
+    python3 compareFits.py ../../benchmark/6-xspec-test-result ./ --rtol 1e-3 --nsigma 0.1 --report comparison.json
+'''
+
+import os
+import sys
+import csv
+import json
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from fitResult import fitParameters
+
+
+def loadRun(directory, pattern="mod_*.fits", max_workers=None):
+    ''' Load the fitted parameters from every XSPEC fits file in a run directory.
+
+    Parameters
+    ----------
+    directory : str
+            The run's directory with the XSPEC outputs (e.g., ".../6-xspec-test-result").
+
+    pattern : str
+            Which files in directory to load.
+            Default: "mod_*.fits"
+
+    max_workers : int or None
+            Number of processes to load the files with. None for as many as there are CPUs.
+            Default: None
+
+    Returns
+    -------
+    A dictionary with each file name (without the directory) and its parameters from fitParameters().
+    '''
+    return loadRuns([directory], pattern=pattern, max_workers=max_workers)[0]
+
+
+def loadRuns(directories, pattern="mod_*.fits", max_workers=None):
+    ''' Load the fitted parameters from every XSPEC fits file in many run directories, all files at the same time.
+
+    Parameters
+    ----------
+    directories : list of str
+            The runs' directories with the XSPEC outputs.
+
+    pattern, max_workers :
+            See loadRun().
+
+    Returns
+    -------
+    A list (one entry per directory) of dictionaries from loadRun().
+    '''
+    files = [sorted(glob.glob(os.path.join(d, pattern))) for d in directories]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        loaded = {f:pool.submit(fitParameters, f) for run in files for f in run}
+        return [{os.path.basename(f):loaded[f].result() for f in run} for run in files]
+
+
+def alignRuns(runs):
+    ''' Line up the parameters from different runs into arrays.
+
+    Parameters
+    ----------
+    runs : list of dict
+            Output from loadRuns().
+
+    Returns
+    -------
+    A tuple of (rows, values, lower, upper) where rows is a list of (file, parameter) and values, lower,
+    and upper are (runs, rows) arrays of the parameter values and error bounds (NaN where a run doesn't
+    have that parameter or the errors weren't calculated).
+    '''
+    rows = sorted({(f, p) for run in runs for f in run for p in run[f]})
+    values, lower, upper = np.full((3, len(runs), len(rows)), np.nan)
+    for r, run in enumerate(runs):
+        for c, (f, p) in enumerate(rows):
+            if (f in run) and (p in run[f]):
+                values[r,c], lower[r,c], upper[r,c] = run[f][p]
+    return rows, values, lower, upper
+
+
+def compareAligned(values, lower, upper, atol=None, rtol=None, nsigma=None, reference=0):
+    ''' Check every run's parameters against the reference run with the given tolerances, all at once.
+
+    Parameters
+    ----------
+    values, lower, upper : numpy arrays (runs, rows)
+            Output from alignRuns().
+
+    atol : float or None
+            Pass if |value - reference| <= atol. None to not use this.
+            Default: None
+
+    rtol : float or None
+            Pass if |value - reference| <= rtol*|reference|. None to not use this.
+            Default: None
+
+    nsigma : float or None
+            Pass if |value - reference| <= nsigma*sqrt(sigma_value**2 + sigma_reference**2) where sigma
+            is half the error range. None to not use this.
+            Default: None
+
+    reference : int
+            The index of the reference (benchmark) run.
+            Default: 0
+
+    Returns
+    -------
+    A dictionary of (runs, rows) arrays: "diff", "rel_diff", "sigma" (the combined sigma), and "passed".
+    '''
+    ref = values[reference]
+    diff = values - ref
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel_diff = np.abs(diff)/np.abs(ref)
+        half_range = (upper - lower)/2
+        sigma = np.sqrt(half_range**2 + half_range[reference]**2)
+
+    # same if they're equal (including both being NaN, e.g., a parameter that is NaN in both)
+    passed = (diff==0) | (np.isnan(values) & np.isnan(ref))
+    if atol is not None:
+        passed |= np.abs(diff)<=atol
+    if rtol is not None:
+        passed |= np.abs(diff)<=rtol*np.abs(ref)
+    if nsigma is not None:
+        passed |= np.abs(diff)<=nsigma*sigma
+    # a parameter only in one of the runs is always a fail
+    passed &= ~(np.isnan(values) ^ np.isnan(ref))
+
+    return {"diff":diff, "rel_diff":rel_diff, "sigma":sigma, "passed":passed}
+
+
+def writeReport(report, rows, labels, values, comparison, reference=0):
+    ''' Write the comparison of each run against the reference as a JSON or CSV file (from report's extension).
+
+    Parameters
+    ----------
+    report : str
+            The file to write, ".csv" for CSV, anything else is JSON.
+
+    rows, values :
+            From alignRuns().
+
+    labels : list of str
+            The name of each run (e.g., its directory).
+
+    comparison : dict
+            Output from compareAligned().
+
+    reference : int
+            The index of the reference (benchmark) run.
+            Default: 0
+
+    Returns
+    -------
+    None.
+    '''
+    def _number(x):
+        return None if not np.isfinite(x) else float(x)
+
+    entries = []
+    for r, label in enumerate(labels):
+        if r==reference:
+            continue
+        for c, (f, p) in enumerate(rows):
+            entries.append({"run":label, "file":f, "parameter":p,
+                            "reference":_number(values[reference,c]), "value":_number(values[r,c]),
+                            "diff":_number(comparison["diff"][r,c]), "rel_diff":_number(comparison["rel_diff"][r,c]),
+                            "sigma":_number(comparison["sigma"][r,c]), "passed":bool(comparison["passed"][r,c])})
+
+    if report.endswith(".csv"):
+        with open(report, "w", newline="") as rep:
+            writer = csv.DictWriter(rep, fieldnames=list(entries[0].keys()) if len(entries)>0 else ["run"])
+            writer.writeheader()
+            writer.writerows(entries)
+    else:
+        with open(report, "w") as rep:
+            json.dump({"reference":labels[reference], "passed":(len(entries)>0) and all([e["passed"] for e in entries]), "results":entries}, rep, indent=1)
+
+
+def compareRuns(directories, atol=None, rtol=None, nsigma=None, report=None, pattern="mod_*.fits", max_workers=None):
+    ''' Compare the XSPEC results of runs to the first run given (the benchmark) and print a summary.
+
+    Parameters
+    ----------
+    directories : list of str
+            The runs' directories with the XSPEC outputs, the first is the benchmark.
+
+    atol, rtol, nsigma :
+            See compareAligned().
+
+    report : str or None
+            File to write the report to (see writeReport()).
+            Default: None
+
+    pattern, max_workers :
+            See loadRun().
+
+    Returns
+    -------
+    True if every parameter of every run passed, False otherwise (including when a run has no files to compare).
+    '''
+    runs = loadRuns(directories, pattern=pattern, max_workers=max_workers)
+    rows, values, lower, upper = alignRuns(runs)
+    comparison = compareAligned(values, lower, upper, atol=atol, rtol=rtol, nsigma=nsigma)
+
+    if report is not None:
+        writeReport(report, rows, directories, values, comparison)
+
+    _l = max([len(f"{f}:{p}") for (f,p) in rows]+[len("Parameter")])
+    for r, d in enumerate(directories[1:], start=1):
+        print(f"{d} compared to {directories[0]}: {np.sum(comparison['passed'][r])}/{len(rows)} passed")
+        for c in np.flatnonzero(~comparison["passed"][r]):
+            f, p = rows[c]
+            print(f"    FAILED {f'{f}:{p}'.ljust(_l)}  benchmark: {values[0,c]:<14.6g} new: {values[r,c]:<14.6g} diff: {comparison['diff'][r,c]:.3g}")
+    # nothing to compare isn't a pass
+    empty = [d for d, run in zip(directories, runs) if len(run)==0]
+    for d in empty:
+        print(f"    FAILED no {pattern} files in {d}")
+    return (len(empty)==0) and (len(rows)>0) and bool(np.all(comparison["passed"]))
+
+
+def _tolerance(value):
+    ''' A tolerance from the command line, "none" to not use it.'''
+    return None if value.lower()=="none" else float(value)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Compare XSPEC fit results of runs to a benchmark run.")
+    parser.add_argument("directories", nargs="+", help="Run directories with the mod_*.fits files, the first is the benchmark.")
+    parser.add_argument("--atol", type=_tolerance, default=None, help="Absolute tolerance (default: none).")
+    parser.add_argument("--rtol", type=_tolerance, default=None, help="Relative tolerance (default: none).")
+    parser.add_argument("--nsigma", type=_tolerance, default=None, help="Tolerance in units of the combined fit errors (default: none).")
+    parser.add_argument("--report", default=None, help="Write a .json or .csv report to this file.")
+    parser.add_argument("--pattern", default="mod_*.fits", help="Files to compare in each directory (default: mod_*.fits).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes to load the files with.")
+    args = parser.parse_args()
+
+    assert len(args.directories)>1, "Need a benchmark directory and at least one to compare to it."
+
+    passed = compareRuns(args.directories, atol=args.atol, rtol=args.rtol, nsigma=args.nsigma, report=args.report,
+                         pattern=args.pattern, max_workers=args.workers)
+    sys.exit(0 if passed else 1)
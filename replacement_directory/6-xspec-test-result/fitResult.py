@@ -0,0 +1,228 @@
+'''
+A class to look after an XSPEC "writefits" output file so it is only opened once, however many times it is looked at.
+'''
+
+import os
+from collections import OrderedDict
+import numpy as np
+
+from xspecCache import cached
+
+# map easy to search for terms to the terms used in the xspec files
+ALIASES = {"t":"kt", "temp":"kt", "temperature":"kt",
+           "norm":"norm", "normalisation":"norm",
+           "break":"break", "ebreak":"break", "e_break":"break",
+           "photonindex":"phoindx", "phoindx":"phoindx", "index":"phoindx"}
+
+# conversion factors for the EM and T that are always given with the parameters
+CONVERSIONS = {"emfact":3.5557e-42, "kev2mk":0.0861733}
+
+
+def _fitsKeysAndValues(xspec_fits):
+    ''' Get the header values and the (first row of the) columns from an XSPEC fits file.
+
+    Parameters
+    ----------
+    xspec_fits : str
+        The fits file in question.
+
+    Returns
+    -------
+    A dictionary with the header values (as strings) under "__keys__" and each column name with
+    an array of its first row.
+    '''
+    from astropy.io import fits
+
+    with fits.open(xspec_fits) as hdul:
+        keys = list(dict(hdul[1].header).values())
+        values = hdul[1].data
+        arrays = {"__keys__":np.array([str(x) for x in keys])}
+        arrays.update({name:np.array(values[name][:1]) for name in values.columns.names})
+    return arrays
+
+
+class FitResult:
+    ''' The result of an XSPEC fit from its "writefits" fits file.
+
+    The file is opened once (memory-mapped), the header values are put into an index of lower case
+    keywords, and columns are only read the first time they are asked for.
+
+    Parameters
+    ----------
+    xspec_fits : str
+        The fits file in question.
+
+    cache : bool or str
+        Read the values from a binary sidecar instead of the fits file (see xspecCache.py).
+        Default: False
+
+    Example
+    -------
+    # get the temperature(s) and normalisation(s) from a fit
+    result = FitResult("mod_apec1fit_fpma_cstat.fits")
+    result.params("temp", "norm")
+    result.close()
+    '''
+    def __init__(self, xspec_fits, cache=False):
+        self.path = xspec_fits
+        self.cache = cache
+        self._columns = {}
+
+        if cache is False:
+            # astropy is only imported when a fits file is actually opened (not when reading from a cache sidecar)
+            from astropy.io import fits
+            self._hdul = fits.open(xspec_fits, memmap=True)
+            keys = [x for x in dict(self._hdul[1].header).values()]
+        else:
+            self._hdul = None
+            self._columns = cached(xspec_fits, _fitsKeysAndValues, cache)
+            keys = [str(k) for k in self._columns.pop("__keys__")]
+
+        # the keywords to search, with their lower case version ready to be compared
+        self.keys = [(x, str(x).lower()) for x in keys if "__" not in str(x)]
+        # what each (normalised) search word found, filled in as words are used (the aliases are done straight away)
+        self.index = {}
+        for word in set(ALIASES.values()):
+            self.find(word)
+
+    @staticmethod
+    def normalise(word):
+        ''' Change a search word to the term used in the XSPEC files, e.g., "temp" to "kt".
+        '''
+        return ALIASES.get(word.lower(), word.lower())
+
+    def find(self, word):
+        ''' All the keywords in the file that contain the (normalised) word.
+
+        Parameters
+        ----------
+        word : str
+            The keyword (or general guess at it). E.g. "temp" will give temperature ("kt#" in the file)
+            but if you want a specific parameter/temperature then can have "kt1".
+
+        Returns
+        -------
+        List of the keywords found.
+        '''
+        w = self.normalise(word)
+        if w not in self.index:
+            self.index[w] = [x for (x, lower) in self.keys if w in lower]
+        return self.index[w]
+
+    def column(self, name):
+        ''' The values of a column, read from the file the first time they're needed.
+        '''
+        if name not in self._columns:
+            if (self._hdul is None) and (self.cache is False):
+                # was closed, open again
+                from astropy.io import fits
+                self._hdul = fits.open(self.path, memmap=True)
+            if self._hdul is None:
+                # reading from a cache sidecar, which has every column, so it isn't one (the same error as astropy gives)
+                raise KeyError(name)
+            self._columns[name] = np.array(self._hdul[1].data[name])
+        return self._columns[name]
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def params(self, *args):
+        ''' Get the parameters your words refer to with some other (hopefully) useful information.
+
+        Parameters
+        ----------
+        *args : str
+            The keywords (or general guess) at the parameters you want from the fits file.
+
+        Returns
+        -------
+        A dictionary with the keyword from the fits file as the keys, each with a list of
+        the values obtained from that keyword and the (normalised) word which got that keyword.
+        '''
+        words = []
+        for a in args:
+            w = self.normalise(a)
+            if w not in words:
+                words.append(w)
+
+        # now find the values of the keywords found, include the conversion factors for the EM and T
+        output = dict(CONVERSIONS)
+        for w in words:
+            for x in self.find(w):
+                output[x] = [self.column(x)[0], w]
+        return output
+
+    def close(self):
+        ''' Close the fits file (columns already read can still be used).
+        '''
+        if self._hdul is not None:
+            self._hdul.close()
+            self._hdul = None
+
+
+def fitParameters(xspec_fits, cache=False):
+    ''' Get all the fitted parameters (and their error bounds) and the fit statistic from an XSPEC fits file.
+
+    Parameters
+    ----------
+    xspec_fits : str
+        The fits file in question.
+
+    cache : bool or str
+        See FitResult.
+        Default: False
+
+    Returns
+    -------
+    A dictionary with the parameter names as keys (e.g., "kT1", "norm4", "STATISTIC"), each with a tuple of the
+    (value, lower bound, upper bound). The bounds are NaN if they weren't calculated.
+    '''
+    result = FitResult(xspec_fits, cache=cache)
+    names = [x for (x,_) in result.keys if isinstance(x, str)]
+    columns = set(names)
+
+    parameters = {}
+    for name in names:
+        if (("E"+name) in columns) or (name=="STATISTIC"):
+            value = float(np.ravel(result[name][0])[0])
+            bounds = np.ravel(result["E"+name][0]).astype(float) if ("E"+name) in columns else np.array([0., 0.])
+            # no errors calculated (or the parameter was frozen) then XSPEC gives 0 for both
+            lower, upper = (np.nan, np.nan) if np.all(bounds==0) else (bounds[0], bounds[-1])
+            parameters[name] = (value, float(lower), float(upper))
+    result.close()
+    return parameters
+
+
+# FitResults that are open, so different functions looking at the same file share one
+_OPEN = OrderedDict()
+MAX_OPEN = 32
+
+def openFitResult(xspec_fits, cache=False):
+    ''' Get the FitResult for a fits file, only opening the file if it hasn't been opened already
+    (or if it has changed since).
+
+    Parameters
+    ----------
+    xspec_fits : str
+        The fits file in question.
+
+    cache : bool or str
+        See FitResult.
+        Default: False
+
+    Returns
+    -------
+    The FitResult.
+    '''
+    stat = os.stat(xspec_fits)
+    key = (os.path.abspath(xspec_fits), stat.st_size, stat.st_mtime_ns, cache)
+    if key in _OPEN:
+        _OPEN.move_to_end(key)
+        return _OPEN[key]
+
+    result = FitResult(xspec_fits, cache=cache)
+    _OPEN[key] = result
+    if len(_OPEN)>MAX_OPEN:
+        _, oldest = _OPEN.popitem(last=False)
+        oldest.close()
+    return result
@@ -0,0 +1,90 @@
+'''
+Collect the fitted parameters of many XSPEC fits into one numpy structured array.
+
+Each row of the table is described by some fields of its own (e.g., the grid point's model and energy range, or a time
+slice's start and stop) and the XSPEC "writefits" files of its fits, each under a prefix for its columns (e.g., "" for
+one fit per row, or "fpma_", "fpmb_" and "fpmab_" for a fit of each FPM). The parameters are read with fitParameters()
+(see fitResult.py) and every parameter found in any row gets a column for its value and bounds, NaN where a row's fit
+doesn't have it, with a "<prefix>passed" column saying whether the fit could be read.
+
+It is used by 5-xspec-test/xcmGrid.py and pipeline/timeSlices.py, which give the rows as JSON, e.g.,
+    python3 fitTable.py rows.json grid_results.npy
+with rows.json like
+    {"fields":[["name", "U64"], ["time", "f8"]],
+     "rows":[{"name":"grid_1apec_fpma_2.5-7.4_cstat", "time":12.3, "fits":{"":"mod_grid_1apec_fpma_2.5-7.4_cstat.fits"}}],
+     "sort":null}
+'''
+
+import sys
+import json
+import argparse
+import numpy as np
+
+from fitResult import fitParameters
+
+
+def _readFit(xspec_fits):
+    ''' The parameters of a fit, an empty dictionary if there is no file or it can't be read.'''
+    if xspec_fits is None:
+        return {}
+    try:
+        return fitParameters(xspec_fits)
+    except (OSError, KeyError, IndexError, TypeError, ValueError) as e:
+        # XSPEC finished but the result can't be read, count it as a failed fit
+        print(f"Could not read {xspec_fits}: {type(e).__name__}: {e}")
+        return {}
+
+
+def parameterTable(rows, fields, sort=None):
+    ''' Build the table of the fitted parameters.
+
+    Parameters
+    ----------
+    rows : list of dict
+            Each row's value for every field and "fits", a dictionary of column prefix and fits file (None for a fit
+            that failed).
+
+    fields : list of (name, dtype)
+            The fields of each row, put in the table before the parameters.
+
+    sort : str or None
+            The field to sort the rows by, None to keep them in the order given.
+            Default: None
+
+    Returns
+    -------
+    A numpy structured array with the fields, "<prefix>passed" for every prefix, then for every prefix and parameter
+    its value (e.g., "fpma_kT1") and bounds ("fpma_kT1_lower", "fpma_kT1_upper"). Parameters a fit doesn't have are NaN.
+    '''
+    fields = [tuple(f) for f in fields]
+    parameters = [{prefix:_readFit(f) for prefix, f in row["fits"].items()} for row in rows]
+
+    # keep the prefixes and parameters in the order they are first seen (i.e., XSPEC's order)
+    prefixes = list(dict.fromkeys([prefix for row in rows for prefix in row["fits"]]))
+    names = {prefix:list(dict.fromkeys([p for params in parameters for p in params.get(prefix, {}).keys()])) for prefix in prefixes}
+    dtype = fields+[(f"{prefix}passed", "?") for prefix in prefixes]
+    dtype += [(f"{prefix}{p}{s}", "f8") for prefix in prefixes for p in names[prefix] for s in ["", "_lower", "_upper"]]
+
+    table = np.zeros(len(rows), dtype=dtype)
+    for name, _ in dtype[len(fields)+len(prefixes):]:
+        table[name] = np.nan
+    for n, (row, params) in enumerate(zip(rows, parameters)):
+        for name, _ in fields:
+            table[name][n] = row[name]
+        for prefix, fitParams in params.items():
+            table[f"{prefix}passed"][n] = len(fitParams)>0
+            for p, (value, lower, upper) in fitParams.items():
+                table[f"{prefix}{p}"][n], table[f"{prefix}{p}_lower"][n], table[f"{prefix}{p}_upper"][n] = value, lower, upper
+    return table if sort is None else table[np.argsort(table[sort], kind="stable")]
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Collect the fitted parameters of XSPEC fits into one table.")
+    parser.add_argument("rows", help="JSON file with the \"fields\", \"rows\" and \"sort\" of the table, - to read it from stdin.")
+    parser.add_argument("table", help="The .npy file to save the table to.")
+    args = parser.parse_args()
+
+    spec = json.load(sys.stdin) if args.rows=="-" else json.load(open(args.rows, "r"))
+    table = parameterTable(spec["rows"], spec["fields"], sort=spec.get("sort"))
+    np.save(args.table, table, allow_pickle=False)
+    sys.exit(0)
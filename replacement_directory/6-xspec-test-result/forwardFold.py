@@ -0,0 +1,271 @@
+'''
+Fold photon models through the NuSTAR response (RMF and ARF) with NumPy, without XSPEC.
+
+The RMF (MATRIX and EBOUNDS extensions) is kept as the CSR arrays of its non-zero elements (never as a dense matrix,
+see responseCache.py) and used as they are, so folding a model is one sparse matrix-vector product after the model is
+multiplied by the ARF. Many models (a 2D array, one model per row)
+are folded at the same time. SciPy is used for the product if it is installed, otherwise np.bincount does the same sum.
+
+It is used to check the folded model XSPEC wrote out (model_total in the counts block of the wdata .txt file) against an
+independent calculation: the unfolded model from the photons block is put on the response's energy grid, folded, and
+compared channel by channel.
+
+Run as, e.g.,
+    python3 forwardFold.py ./mod_apec1fit_fpma_cstat ../5-xspec-test/
+'''
+
+import os
+import sys
+import glob
+import numpy as np
+
+from plots import read_xspec_txt, fpmFromFilename
+from responseCache import loadCsr
+
+
+def loadRmf(rmf, cache=False):
+    ''' Read a redistribution matrix file into its non-zero elements.
+
+    Parameters
+    ----------
+    rmf : str
+            The .rmf file.
+
+    cache : bool or str
+            Keep the RMF as memory-mapped CSR arrays so it is only converted once (see responseCache.py).
+            Default: False
+
+    Returns
+    -------
+    The dictionary from loadCsr(): the response energy bin edges ("energ_lo", "energ_hi"), the channel energy edges
+    ("e_min", "e_max") and the (energy bins, channels) matrix as CSR arrays "indptr", "indices" (channel index, from 0)
+    and "data", memory-mapped if they came from the cache.
+    '''
+    return loadCsr(rmf, cache=cache)
+
+
+def loadArf(arf):
+    ''' Read the effective area (cm^2) of each energy bin from an ancillary response file.
+
+    Parameters
+    ----------
+    arf : str
+            The .arf file.
+
+    Returns
+    -------
+    A dictionary with the energy bin edges ("energ_lo", "energ_hi") and "specresp".
+    '''
+    from astropy.io import fits
+
+    with fits.open(arf) as hdul:
+        data = hdul["SPECRESP"].data
+        return {"energ_lo":np.array(data["ENERG_LO"], dtype=np.float64),
+                "energ_hi":np.array(data["ENERG_HI"], dtype=np.float64),
+                "specresp":np.array(data["SPECRESP"], dtype=np.float64)}
+
+
+class Response:
+    ''' A spectral response (RMF times ARF) to fold photon models with.
+
+    Parameters
+    ----------
+    rmf : str or dict
+            The .rmf file (or the output of loadRmf()).
+
+    arf : str, dict or None
+            The .arf file (or the output of loadArf()), None if the RMF already includes the effective area.
+            Default: None
+
+    cache : bool or str
+            Passed to loadRmf().
+            Default: False
+
+    Example
+    -------
+    # fold a flat spectrum (1 photon/cm^2/s/keV) and a power law at the same time
+    response = Response("nu80414202001A06_cl_grade0_sr.rmf", "nu80414202001A06_cl_grade0_sr.arf")
+    e = response.energies
+    counts = response.fold(np.stack([np.ones(e.size), e**-2])*response.widths)
+    '''
+    def __init__(self, rmf, arf=None, cache=False):
+        rmf = loadRmf(rmf, cache=cache) if isinstance(rmf, str) else rmf
+        arf = loadArf(arf) if isinstance(arf, str) else arf
+
+        self.energ_lo, self.energ_hi = rmf["energ_lo"], rmf["energ_hi"]
+        self.e_min, self.e_max = rmf["e_min"], rmf["e_max"]
+        # kept as they are (no copies) so memory-mapped arrays stay shared between processes
+        self.indptr, self.indices, self.data = rmf["indptr"], rmf["indices"], rmf["data"]
+        self.specresp = None
+        if arf is not None:
+            assert np.allclose(arf["energ_lo"], self.energ_lo) and np.allclose(arf["energ_hi"], self.energ_hi), "The ARF and RMF energy grids do not match."
+            self.specresp = arf["specresp"]
+        self._matrixCache = None
+        self._coo = None
+
+    @property
+    def energies(self):
+        ''' The middle of each response energy bin (keV).'''
+        return (self.energ_lo+self.energ_hi)/2
+
+    @property
+    def widths(self):
+        ''' The width of each response energy bin (keV).'''
+        return self.energ_hi-self.energ_lo
+
+    @property
+    def channelEnergies(self):
+        ''' The middle of each channel (keV).'''
+        return (self.e_min+self.e_max)/2
+
+    @property
+    def channelWidths(self):
+        ''' The width of each channel (keV).'''
+        return self.e_max-self.e_min
+
+    def _matrix(self):
+        ''' The (channels, energy bins) sparse matrix if SciPy is there, otherwise None.'''
+        if self._matrixCache is None:
+            try:
+                from scipy import sparse
+            except ImportError:
+                self._matrixCache = False
+            else:
+                # the CSR arrays of the (energy bins, channels) matrix are the CSC arrays of its transpose
+                self._matrixCache = sparse.csc_matrix((self.data, self.indices, self.indptr), shape=(self.e_min.size, self.energ_lo.size))
+        return self._matrixCache if self._matrixCache is not False else None
+
+    def _elements(self):
+        ''' The energy bin and channel of every non-zero element, only needed without SciPy.'''
+        if self._coo is None:
+            self._coo = (np.repeat(np.arange(self.energ_lo.size), np.diff(self.indptr)), np.asarray(self.indices, dtype=np.int64))
+        return self._coo
+
+    def fold(self, models, perKeV=True):
+        ''' Fold photon models through the response.
+
+        Parameters
+        ----------
+        models : array
+                Photons/cm^2/s in each response energy bin, shape (energy bins,) or (models, energy bins).
+
+        perKeV : bool
+                Give counts/s/keV (like XSPEC's "ldata" plots), otherwise counts/s in each channel.
+                Default: True
+
+        Returns
+        -------
+        The counts in each channel, shape (channels,) or (models, channels).
+        '''
+        models = np.asarray(models, dtype=np.float64)
+        batch = np.atleast_2d(models)
+        assert batch.shape[-1]==self.energ_lo.size, f"Models need {self.energ_lo.size} energy bins, got {batch.shape[-1]}."
+        n_chan = self.e_min.size
+        if self.specresp is not None:
+            # the effective area goes on the models, not the matrix
+            batch = batch*self.specresp
+
+        matrix = self._matrix()
+        if matrix is not None:
+            counts = np.asarray((matrix @ batch.T).T)
+        else:
+            # every model's contribution to every channel in one weighted bincount, each model's channels offset by n_chan
+            rows, cols = self._elements()
+            contributions = batch[:, rows]*self.data
+            index = cols+n_chan*np.arange(batch.shape[0])[:, None]
+            counts = np.bincount(index.ravel(), weights=contributions.ravel(), minlength=n_chan*batch.shape[0]).reshape(batch.shape[0], n_chan)
+
+        counts = counts/self.channelWidths if perKeV else counts
+        return counts if models.ndim>1 else counts[0]
+
+
+def responseFiles(xspec_output, responseDir):
+    ''' Find the RMF and ARF for a single FPM fit from its XSPEC output name.
+
+    Parameters
+    ----------
+    xspec_output : str
+            The name of the XSPEC output .txt and .fits file (e.g., "./mod_apec1fit_fpma_cstat").
+
+    responseDir : str
+            The directory with the nu<OBSID><FPM>06_cl_grade0_sr.rmf/.arf files (e.g., "../5-xspec-test/").
+
+    Returns
+    -------
+    A tuple of the (RMF, ARF) file names.
+    '''
+    fpm = fpmFromFilename(xspec_output)
+    assert fpm in ["A", "B"], f"Can only fold single FPM fits, {xspec_output} is FPM {fpm}."
+    files = []
+    for ext in ["rmf", "arf"]:
+        found = sorted(glob.glob(os.path.join(responseDir, f"nu*{fpm}06_cl_grade0_sr.{ext}")))
+        assert len(found)==1, f"Expected one FPM{fpm} .{ext} file in {responseDir}, found {found}."
+        files.append(found[0])
+    return tuple(files)
+
+
+def crossCheck(xspec_output, responseDir, rtol=0.05, response=None, cache=False):
+    ''' Fold the unfolded XSPEC model (photons block) through the response and compare it to XSPEC's folded model
+    (model_total in the counts block).
+
+    The photon model is only given at the channel energies so it is interpolated onto the response's energy bins,
+    the comparison is therefore approximate (to a few percent where there are sharp lines).
+
+    Parameters
+    ----------
+    xspec_output : str
+            The name of the XSPEC output .txt file (single FPM fits only).
+
+    responseDir : str
+            The directory with the RMF and ARF (see responseFiles()).
+
+    rtol : float
+            The largest median relative difference allowed.
+            Default: 0.05
+
+    response : Response or None
+            The response to use, None to load it from responseDir.
+            Default: None
+
+    cache : bool or str
+            Passed to read_xspec_txt() and Response().
+            Default: False
+
+    Returns
+    -------
+    A dictionary with "energy" (keV), "xspec" and "numpy" (counts/s/keV for every channel in the .txt file),
+    "rel_diff", its "median" and "max" (of the channels where XSPEC's model is above 1% of its peak), and "passed".
+    '''
+    xspec_output = xspec_output[:-4] if xspec_output.endswith(".txt") else xspec_output
+    xspec_data = read_xspec_txt(xspec_output+".txt", cache=cache)
+    response = Response(*responseFiles(xspec_output, responseDir), cache=cache) if response is None else response
+
+    counts, photons = xspec_data["counts"], xspec_data["photons"]
+    # photons/cm^2/s/keV at the channel energies to photons/cm^2/s in each response energy bin
+    photonModel = np.interp(response.energies, photons[:,0], photons[:,4], left=0, right=0)*response.widths
+    folded = response.fold(photonModel)
+
+    # the channel each row of the .txt file is (the channel its energy is in)
+    channels = np.clip(np.searchsorted(response.e_max, counts[:,0]), 0, response.e_max.size-1)
+    numpyModel, xspecModel = folded[channels], counts[:,4]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel_diff = (numpyModel-xspecModel)/xspecModel
+    significant = np.isfinite(rel_diff) & (xspecModel>0.01*np.nanmax(xspecModel))
+    median = float(np.median(np.abs(rel_diff[significant]))) if np.any(significant) else np.nan
+    largest = float(np.max(np.abs(rel_diff[significant]))) if np.any(significant) else np.nan
+    return {"energy":counts[:,0], "xspec":xspecModel, "numpy":numpyModel, "rel_diff":rel_diff,
+            "median":median, "max":largest, "passed":bool(median<=rtol)}
+
+
+if __name__=="__main__":
+    # check the single FPM fits
+    xspec_outputs = sys.argv[1:-1] if len(sys.argv)>2 else ["./mod_apec1fit_fpma_cstat", "./mod_apec1fit_fpmb_cstat"]
+    responseDir = sys.argv[-1] if len(sys.argv)>2 else "../5-xspec-test/"
+
+    passed = True
+    for xo in xspec_outputs:
+        check = crossCheck(xo, responseDir)
+        passed &= check["passed"]
+        print(f"{xo}: median |rel. diff.| {check['median']:.2e}, max {check['max']:.2e} - {'Passed' if check['passed'] else 'Failed'}")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,234 @@
+'''
+Recalculate the Cash statistic (C-stat) of XSPEC fits from their wdata output and check it against the STATISTIC XSPEC
+wrote to the .fits file.
+
+The counts block of the .txt file has the count rate (counts/s/keV) of the data and the total model in every channel.
+Multiplied by the channel width and the EXPOSURE these give the counts in each channel, and over the channels in the
+fitting range the C-stat is the sum of
+    2*(model - data + data*ln(data/model))
+(2*model for channels with no counts). The channels of every fit given are put into one array so the contributions,
+residuals and the C-stat of every fit are worked out all at once, independently of XSPEC.
+
+The STATISTIC of a fit of FPMA and FPMB together is over both spectra but the .txt file only has the first, so these are
+marked as not comparable. The check assumes the plot wasn't rebinned (XSPEC's "setplot rebin") when the .txt file was
+written.
+
+Without --ranges the fitting range of each fit is taken from the .xcm file that wrote it (the one whose "writefits" is
+the output's .fits file, looked for in --xcm-dir and the output's own directory), from its ignore/notice commands before
+the fit (see 5-xspec-test/xcmManifest.py).
+
+Run as, e.g.,
+    python3 goodnessOfFit.py ./mod_apec1fit_fpma_cstat ./mod_apec1fit_fpmb_cstat
+    python3 goodnessOfFit.py ./mod_apec1fit_fpma_cstat ./mod_apec1fit_fpmb_cstat --ranges 2.5-7.4 2.5-7.0
+'''
+
+import os
+import sys
+import glob
+import json
+import argparse
+import subprocess
+import numpy as np
+
+from plots import read_xspec_txt, meta_info, fpmFromFilename
+
+# prints the manifests of .xcm files, from the run's 5-xspec-test directory
+XCM_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "5-xspec-test", "xcmManifest.py")
+
+
+def cashContributions(data, model):
+    ''' The contribution of each channel to the Cash statistic.
+
+    Parameters
+    ----------
+    data, model : arrays
+            The observed and model counts (not rates) in each channel.
+
+    Returns
+    -------
+    An array of 2*(model - data + data*ln(data/model)), 2*model where data is 0 and inf where the model is 0 but
+    there are counts.
+    '''
+    data, model = np.asarray(data, dtype=np.float64), np.asarray(model, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_term = np.where(data>0, data*np.log(data/model), 0)
+    contributions = 2*(model-data+log_term)
+    contributions[(model<=0) & (data>0)] = np.inf
+    return contributions
+
+
+def inRanges(energy, fitting_ranges):
+    ''' Which energies are in any of the fitting ranges, e.g., [[2.5,7.4]] (keV).'''
+    fitting_ranges = np.atleast_2d(np.asarray(fitting_ranges, dtype=np.float64))
+    return np.any((energy[:, None]>=fitting_ranges[:, 0]) & (energy[:, None]<=fitting_ranges[:, 1]), axis=1)
+
+
+def fitChannels(xspec_output, fitting_ranges, cache=False):
+    ''' The channels of a fit in its fitting range, in counts.
+
+    Parameters
+    ----------
+    xspec_output : str
+            The name of the XSPEC output .txt and .fits file.
+
+    fitting_ranges : list of length==2 lists
+            The energy ranges (keV) the fit was over, e.g., [[2.5,7.4]].
+
+    cache : bool or str
+            Passed to read_xspec_txt() and meta_info().
+            Default: False
+
+    Returns
+    -------
+    A dictionary with the "energy" and "e_energy" (keV) of each channel, the "data" and "model" counts, the
+    "rate"/"e_rate"/"model_rate" (counts/s/keV as in the .txt file), the "exposure" (s) and the "stored" STATISTIC.
+    '''
+    xspec_output = xspec_output[:-4] if xspec_output.endswith(".txt") else xspec_output
+    counts = read_xspec_txt(xspec_output+".txt", cache=cache)["counts"]
+    meta = meta_info(xspec_output, cache=cache)
+    exposure = float(np.ravel(meta["EXPOSURE"][0])[0])
+
+    counts = counts[inRanges(counts[:,0], fitting_ranges)]
+    to_counts = 2*counts[:,1]*exposure
+    return {"energy":counts[:,0], "e_energy":counts[:,1],
+            "rate":counts[:,2], "e_rate":counts[:,3], "model_rate":counts[:,4],
+            # the counts are whole numbers, rounding takes out the precision lost writing the rates to the .txt file
+            "data":np.round(counts[:,2]*to_counts), "model":counts[:,4]*to_counts,
+            "exposure":exposure, "stored":float(np.ravel(meta["STATISTIC"][0])[0])}
+
+
+def goodnessOfFit(xspec_outputs, fitting_ranges, rtol=1e-3, cache=False):
+    ''' Recalculate the C-stat of many fits at once and compare each to the STATISTIC XSPEC found.
+
+    Parameters
+    ----------
+    xspec_outputs : list of str
+            The names of the XSPEC output .txt and .fits files.
+
+    fitting_ranges : list
+            The fitting ranges of each fit (see fitChannels()), or one set of ranges for all of them.
+
+    rtol : float
+            The largest relative difference from the stored STATISTIC allowed.
+            Default: 1e-3
+
+    cache : bool or str
+            Passed to fitChannels().
+            Default: False
+
+    Returns
+    -------
+    A list of dictionaries (one for each fit) with "xspec_output", "fpm", "channels" (number in the fitting range),
+    "cstat" (recalculated), "stored", "rel_diff", "status" ("Passed", "Failed" or "Not comparable"), and the
+    "energy", "contribution" (to the C-stat) and "residual" ((data-model)/error, as plotted) of each channel.
+    '''
+    if np.ndim(fitting_ranges[0])==1:
+        fitting_ranges = [fitting_ranges]*len(xspec_outputs)
+    assert len(fitting_ranges)==len(xspec_outputs), "Need fitting ranges for every XSPEC output (or one for all)."
+
+    fits = [fitChannels(xo, fr, cache=cache) for xo, fr in zip(xspec_outputs, fitting_ranges)]
+
+    # every channel of every fit in one go, the sums for each fit from a bincount over which fit each channel is from
+    sizes = np.array([f["energy"].size for f in fits])
+    fit_index = np.repeat(np.arange(len(fits)), sizes)
+    data, model = np.concatenate([f["data"] for f in fits]), np.concatenate([f["model"] for f in fits])
+    rate, e_rate, model_rate = [np.concatenate([f[k] for f in fits]) for k in ["rate", "e_rate", "model_rate"]]
+
+    contributions = cashContributions(data, model)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        residuals = np.where(e_rate>0, (rate-model_rate)/e_rate, 0)
+    cstat = np.bincount(fit_index, weights=contributions, minlength=len(fits))
+    stored = np.array([f["stored"] for f in fits])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel_diff = np.abs(cstat-stored)/np.abs(stored)
+    passed = np.abs(cstat-stored)<=rtol*np.abs(stored)
+
+    splits = np.cumsum(sizes)[:-1]
+    results = []
+    for n, (xo, e, c, r) in enumerate(zip(xspec_outputs, np.split(np.concatenate([f["energy"] for f in fits]), splits),
+                                          np.split(contributions, splits), np.split(residuals, splits))):
+        fpm = fpmFromFilename(xo)
+        status = "Not comparable" if fpm=="A&B" else ("Passed" if passed[n] else "Failed")
+        results.append({"xspec_output":xo, "fpm":fpm, "channels":int(sizes[n]), "cstat":float(cstat[n]),
+                        "stored":float(stored[n]), "rel_diff":float(rel_diff[n]), "status":status,
+                        "energy":e, "contribution":c, "residual":r})
+    return results
+
+
+def xcmRanges(xspec_outputs, xcm_dir="../5-xspec-test/"):
+    ''' The fitting ranges of each fit from the .xcm file that made it.
+
+    Parameters
+    ----------
+    xspec_outputs : list of str
+            The names of the XSPEC output .txt and .fits files.
+
+    xcm_dir : str
+            Where to look for the .xcm files (as well as the directory of each output).
+            Default: "../5-xspec-test/"
+
+    Returns
+    -------
+    A list of the fitting ranges (see fitChannels()) of the first spectrum of each fit.
+    '''
+    names = [os.path.basename(xo[:-4] if xo.endswith(".txt") else xo)+".fits" for xo in xspec_outputs]
+    directories = list(dict.fromkeys([xcm_dir]+[os.path.dirname(xo) or "./" for xo in xspec_outputs]))
+    xcms = {d:sorted(glob.glob(os.path.join(d, "*.xcm"))) for d in directories}
+    assert sum([len(x) for x in xcms.values()])>0, f"No .xcm files in {directories} to get the fitting ranges from, give them with --ranges."
+
+    # the .xcm files in each directory are read by one run of xcmManifest.py, XSPEC is run where they are so any
+    # "@file" in them are found from there
+    ranges = {}
+    for d, x in xcms.items():
+        if len(x)==0:
+            continue
+        out = subprocess.run([sys.executable, XCM_MANIFEST, "--directory", d]+x, capture_output=True, universal_newlines=True, check=True)
+        ranges.update({os.path.basename(m["writefits"]):m["fittingRanges"][0] for m in json.loads(out.stdout) if m["writefits"] is not None})
+
+    missing = [n for n in names if n not in ranges]
+    assert len(missing)==0, f"No .xcm file in {directories} writes {missing}, give the fitting ranges with --ranges."
+    return [ranges[n] for n in names]
+
+
+def writeReport(results, report):
+    ''' Print a table of the results and write them (without the channel arrays) to a .json file (or None to only print).'''
+    _l = max([len(r["xspec_output"]) for r in results]+[len("Fit")])
+    print("Fit".ljust(_l)+"    Channels    C-stat (NumPy)    STATISTIC (XSPEC)    Rel. diff.    Result")
+    for r in results:
+        print(f"{r['xspec_output'].ljust(_l)}    {r['channels']:>8}    {r['cstat']:>14.4f}    {r['stored']:>17.4f}    {r['rel_diff']:>10.2e}    {r['status']}")
+
+    if report is not None:
+        def _number(x):
+            return None if not np.isfinite(x) else x
+        with open(report, "w") as rep:
+            json.dump({"passed":all([r["status"]!="Failed" for r in results]),
+                       "results":[{k:(_number(v) if isinstance(v, float) else v) for k,v in r.items() if not isinstance(v, np.ndarray)} for r in results]},
+                      rep, indent=1)
+
+
+def _ranges(text):
+    ''' "2.5-4,5-7.4" to [[2.5,4],[5,7.4]].'''
+    return [[float(e) for e in r.split("-")] for r in text.split(",")]
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Recalculate the C-stat of XSPEC fits and check it against the stored STATISTIC.")
+    parser.add_argument("xspec_outputs", nargs="*", default=["./mod_apec1fit_fpma_cstat", "./mod_apec1fit_fpmb_cstat", "./mod_apec1fit_fpmab_cstat"],
+                        help="XSPEC outputs (.txt and .fits) to check (default: the apec1fit outputs).")
+    parser.add_argument("--ranges", nargs="+", default=None,
+                        help="Fitting range(s) in keV for each output (or one for all), e.g., 2.5-7.4 or 2.5-4,5-7.4 (default: those of the .xcm file that wrote each output).")
+    parser.add_argument("--xcm-dir", default="../5-xspec-test/", help="Where to find the .xcm files when --ranges isn't given (default: ../5-xspec-test/).")
+    parser.add_argument("--rtol", type=float, default=1e-3, help="Relative tolerance (default: 1e-3).")
+    parser.add_argument("--cache", action="store_true", help="Use the .xspec_cache sidecars (see xspecCache.py).")
+    parser.add_argument("--report", default=None, help="Write a .json report to this file.")
+    args = parser.parse_args()
+
+    if args.ranges is not None:
+        fitting_ranges = [_ranges(r) for r in args.ranges]
+        fitting_ranges = fitting_ranges[0] if len(fitting_ranges)==1 else fitting_ranges
+    else:
+        fitting_ranges = xcmRanges(args.xspec_outputs, xcm_dir=args.xcm_dir)
+
+    results = goodnessOfFit(args.xspec_outputs, fitting_ranges, rtol=args.rtol, cache=args.cache)
+    writeReport(results, args.report)
+    sys.exit(0 if all([r["status"]!="Failed" for r in results]) else 1)
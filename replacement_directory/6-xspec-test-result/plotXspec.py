@@ -1,7 +1,107 @@
+import os
+import matplotlib
+# only saving the plots to files so never need a window, set before pyplot is imported anywhere
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 
 from plots import plotXspec_allTogether
 
+# fixed space around the axes so the figure doesn't need laying out twice with bbox_inches="tight"
+FIGSIZE = (5,7)
+MARGINS = {"left":0.16, "right":0.96, "top":0.95, "bottom":0.07}
+
+# each worker keeps one figure and clears it for every plot
+_FIGURE = None
+
+
+def _initWorker(backend="Agg"):
+    ''' Set up a plotting worker process with a non-interactive backend.
+    '''
+    matplotlib.use(backend, force=True)
+
+
+def renderPlot(xspec_output, fitting_mode, fitting_ranges=None, figsize=FIGSIZE, margins=MARGINS, **kwargs):
+    ''' Plot one XSPEC fit with plotXspec_allTogether() and save it as a PDF, reusing this process' figure.
+
+    Parameters
+    ----------
+    xspec_output : str
+            The name of the XSPEC output .txt and .fits file (without the extension).
+
+    fitting_mode : str
+            The fitting mode used when fitting the spectrum (see plotXspec_allTogether()).
+
+    fitting_ranges : list of length==2 lists
+            The fitting range(s) the fit(s) took place over.
+            Default: None
+
+    figsize : tuple
+            The figure size in inches.
+            Default: FIGSIZE
+
+    margins : dict
+            Passed to fig.subplots_adjust().
+            Default: MARGINS
+
+    **kwargs : passed to plotXspec_allTogether()
+
+    Returns
+    -------
+    The PDF file name.
+    '''
+    global _FIGURE
+    if (_FIGURE is None) or (tuple(_FIGURE.get_size_inches())!=tuple(figsize)):
+        if _FIGURE is not None:
+            plt.close(_FIGURE)
+        _FIGURE = plt.figure(figsize=figsize)
+    else:
+        _FIGURE.clf()
+
+    _FIGURE.subplots_adjust(**margins)
+    axs = _FIGURE.add_subplot(111)
+    plotXspec_allTogether(xspec_output, fitting_mode, fitting_ranges=fitting_ranges, axes=axs, **kwargs)
+    _FIGURE.savefig(xspec_output+".pdf")
+    return xspec_output+".pdf"
+
+
+def renderPlots(xspec_output, fitting_mode, fitting_ranges, max_workers=None, backend="Agg", **kwargs):
+    ''' Plot many XSPEC fits at the same time, each worker process with its own (reused) figure.
+
+    Parameters
+    ----------
+    xspec_output, fitting_mode, fitting_ranges : lists
+            One entry for each fit (see renderPlot()).
+
+    max_workers : int or None
+            The number of processes to plot with, 1 to plot one after the other in this process, or
+            None for the number of CPUs.
+            Default: None
+
+    backend : str
+            The (non-interactive) matplotlib backend to use.
+            Default: "Agg"
+
+    **kwargs : passed to every renderPlot()
+
+    Returns
+    -------
+    A list of the PDF files, in the same order as xspec_output.
+
+    Example
+    -------
+    renderPlots(["./mod_apec1fit_fpma_cstat", "./mod_apec1fit_fpmb_cstat"], ["1apec", "1apec"], [[[2.5,7.4]], [[2.5,7.0]]], x_lim=[2,8])
+    '''
+    assert len(xspec_output)==len(fitting_mode)==len(fitting_ranges), "Need a fitting mode and fitting ranges for every XSPEC output."
+
+    if max_workers==1:
+        _initWorker(backend)
+        return [renderPlot(xo, fm, fitting_ranges=fr, **kwargs) for xo, fm, fr in zip(xspec_output, fitting_mode, fitting_ranges)]
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_initWorker, initargs=(backend,)) as pool:
+        plots = [pool.submit(renderPlot, xo, fm, fitting_ranges=fr, **kwargs) for xo, fm, fr in zip(xspec_output, fitting_mode, fitting_ranges)]
+        return [p.result() for p in plots]
+
 
 if __name__=="__main__":
     # run plot
@@ -19,11 +119,5 @@ if __name__=="__main__":
                       [[2.5,7.4]],
                         ]
 
-    for xo, fm, fr in zip(xspec_output, fitting_mode, fitting_ranges):
-        fig, axs = plt.subplots(figsize=(5,7))
-        plotXspec_allTogether(xo, fm, fitting_ranges=fr, x_lim=[2,8], y_lim=[1e-1,3e3])
-        plt.savefig(xo+".pdf", bbox_inches="tight")
-        plt.close()
-
-
-    
\ No newline at end of file
+    # each plot is independent so make them all at once
+    renderPlots(xspec_output, fitting_mode, fitting_ranges, max_workers=min(len(xspec_output), os.cpu_count()), x_lim=[2,8], y_lim=[1e-1,3e3])
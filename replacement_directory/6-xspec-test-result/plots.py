@@ -2,11 +2,11 @@
 Functions to help plot Xspec outputs.
 '''
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 import numpy as np
 from copy import copy
-from astropy.io import fits
+
+from xspecCache import cached
+from fitResult import openFitResult
 
 
 def plotMarkers(markers, span=True, axis=None, customColours=None, **kwargs):
@@ -37,6 +37,9 @@ def plotMarkers(markers, span=True, axis=None, customColours=None, **kwargs):
     The colour and marker range.
     """
 
+    # matplotlib is only imported when plotting so reading the XSPEC files (e.g., xspecParams()) starts quickly
+    import matplotlib.pyplot as plt
+
     colours = ['k', 'r', 'g', 'c', 'm', 'b', 'y'] if type(customColours)==type(None) else customColours
     markers_out = {}
     axis = {'ax':plt} if axis is None else {'ax':axis}
@@ -55,7 +58,7 @@ def plotMarkers(markers, span=True, axis=None, customColours=None, **kwargs):
 
     return markers_out
 
-def xspecParams(xspec_fits, *args):
+def xspecParams(xspec_fits, *args, cache=False):
     """Takes an XSPEC fits file and your guess at some keywords and returns those parameters 
     with some other (hopefully) useful information.
     
@@ -68,6 +71,12 @@ def xspecParams(xspec_fits, *args):
         The keywords (or general guess) at the parameters you want from the fits file. 
         E.g. "temp" will give temperature ("kt#" in the file) but if you want a specific 
         parameter/temperature then can have "kt1".
+
+    cache : bool or str
+        Keep the values from the fits file in a binary sidecar (see xspecCache.py) so the fits file 
+        is only opened again if it changes. True for the default cache directory next to the fits 
+        file or give the directory to use.
+        Default: False
             
     Returns
     -------
@@ -75,50 +84,49 @@ def xspecParams(xspec_fits, *args):
     the values obtained from that keyword and the arg you provided which got that keyword.
     """
     
-    # map easy to search for terms to the terms used in the xspec files
-    xspec_words = []
-    for a in args:
-        if a.lower() in ["t", "temp", "temperature"] and "kt" not in xspec_words:
-            xspec_words.append("kt")
-        elif a.lower() in ["norm", "normalisation"] and "norm" not in xspec_words:
-            xspec_words.append("norm")
-        elif a.lower() in ["break", "ebreak", "e_break"] and "break" not in xspec_words:
-            xspec_words.append("break")
-        elif a.lower() in ["photonindex", "phoindx", "index"] and "phoindx" not in xspec_words:
-            xspec_words.append("phoindx")
-        else:
-            xspec_words.append(a.lower())
-    
-    # what keywords are in the fits file
-    hdul = fits.open(xspec_fits)
-    keys = list(dict(hdul[1].header).values())
-    values = hdul[1].data
-    hdul.close()
-    
-    # find the keywords your words refer to
-    findings = []
-    for w in xspec_words:
-        for x in keys:
-            if "__" in str(x):
-                continue
-            if w in str(x).lower():
-                findings.append([x, w])
-    
-    # now find the values of the keywords found, include the conversion factors for the EM and T
-    output = {"emfact":3.5557e-42, "kev2mk":0.0861733}
-    
-    for f in findings:
-        output[f[0]] = [values[f[0]][0], f[1]]
-    
-    return output
+    # the file is opened once and shared with other functions looking at it, see fitResult.py
+    return openFitResult(xspec_fits, cache=cache).params(*args)
 
-def read_xspec_txt(f):
+def _block2array(lines, f=""):
+    ''' Convert the lines of one block of an XSPEC .txt file into a 2D float64 array ("NO" becomes NaN).
+
+    Parameters
+    ----------
+    lines : list of str
+            The rows of the block, numbers separated by spaces.
+
+    f : str
+            The file the lines came from, only used in the error message.
+            Default: ""
+            
+    Returns
+    -------
+    A (rows, columns) numpy array.
+    '''
+    if len(lines)==0:
+        return np.empty((0,0))
+    n_columns = len(lines[0].split())
+    # one parse of the whole block straight into a single float64 buffer, then view it as rows and columns
+    values = np.fromstring("".join(lines).replace("NO", "nan"), dtype=np.float64, sep=" ")
+    if values.size!=n_columns*len(lines):
+        raise ValueError(f"Rows of a block in {f} do not all have {n_columns} numbers.")
+    return values.reshape(len(lines), n_columns)
+
+def read_xspec_txt(f, cache=False):
     ''' Takes a the output .txt file from XSPEC and extracts useful information from it.
+
+    The file is read line by line once and each block of data is converted in one go into a float64 array.
     
     Parameters
     ----------
     f : Str
             String for the .txt file.
+
+    cache : bool or str
+            Keep the arrays in a binary sidecar (see xspecCache.py) that is memory-mapped on later reads 
+            instead of parsing the file again (as long as it hasn't changed). True for the default cache 
+            directory next to the file or give the directory to use.
+            Default: False
             
     Returns
     -------
@@ -126,32 +134,37 @@ def read_xspec_txt(f):
     '''
 
     f = f if f.endswith('.txt') else f+'.txt'
-    
-    asc = open(f, 'r')  # We need to re-open the file
-    data = asc.read()
-    asc.close()
-    
-    sep_lists = data.split('!')[1].split('NO NO NO NO NO') #seperate counts info from photon info from ratio info
+    return cached(f, _parse_xspec_txt, cache)
+
+def _parse_xspec_txt(f):
+    ''' Does the reading for read_xspec_txt().
+    '''
+
+    ## first block of NO NO NO... should be counts, second photons, third ratio
+    blocks = ['counts', 'photons', 'ratio']
     _file = {}
-    for l in range(len(sep_lists)):
-        tmp_list = sep_lists[l].split('\n')[1:-1] # seperate list by lines and remove the blank space from list ends
-        num_list = []
-        for s in tmp_list:
-            new_line = s.split(' ') # numbers are seperated by spaces
-            for c, el in enumerate(new_line):
-                if el == 'NO':
-                    # if a value is NO then make it a NaN
-                    new_line[c] = np.nan
-            num_line = list(map(float, new_line)) # have the values as strings, map them to floats
-            num_list.append(num_line)
-        num_list = np.array(num_list)
-        ## first block of NO NO NO... should be counts, second photons, third ratio
-        if l == 0:
-            _file['counts'] = num_list
-        if l == 1:
-            _file['photons'] = num_list
-        if l == 2:
-            _file['ratio'] = num_list
+    lines = []
+    with open(f, 'r') as asc:
+        # the data start after the line with the first '!' 
+        for line in asc:
+            if '!' in line:
+                break
+
+        for line in asc:
+            if '!' in line:
+                # the data end at the next '!', if there is one
+                break
+            if 'NO NO NO NO NO' in line:
+                # seperate counts info from photon info from ratio info
+                _file[blocks[len(_file)]] = _block2array(lines, f)
+                lines = []
+                if len(_file)==len(blocks):
+                    break
+            elif len(line.strip())>0:
+                lines.append(line)
+
+    if len(_file)<len(blocks) and len(lines)>0:
+        _file[blocks[len(_file)]] = _block2array(lines, f)
     return _file
 
 # I realise I have spelled separate wrong...
@@ -242,7 +255,7 @@ def fpmFromFilename(filename):
         return "B"
 
 
-def searchAndLoad(xspec_output, fitting_mode):
+def searchAndLoad(xspec_output, fitting_mode, cache=False):
     ''' Get the XSPEC output parameters, the count rate data, and the output file names without the extension.
     
     Parameters
@@ -252,6 +265,10 @@ def searchAndLoad(xspec_output, fitting_mode):
 
     fitting_mode : str
             The fitting mode used when fitting the spectrum. This gets passed to seperate() in nu_spec.
+
+    cache : bool or str
+            Passed to xspecParams() and read_xspec_txt().
+            Default: False
             
     Returns
     -------
@@ -267,20 +284,24 @@ def searchAndLoad(xspec_output, fitting_mode):
         keys_to_check.append("break")
         keys_to_check.append("photonindex")
 
-    fitting_values = xspecParams(xspec_output+".fits", *keys_to_check)
+    fitting_values = xspecParams(xspec_output+".fits", *keys_to_check, cache=cache)
 
-    xspec_data = read_xspec_txt(xspec_output+".txt")
+    xspec_data = read_xspec_txt(xspec_output+".txt", cache=cache)
     counts_data = seperate(xspec_data, fitting_mode=fitting_mode)
     return fitting_values, counts_data, xspec_output
 
 
-def meta_info(xspec_output):
+def meta_info(xspec_output, cache=False):
     ''' Get meta data for the spectral fitting like the final statistic, livetime, FPMA/B scaling factor.
     
     Parameters
     ----------
     xspec_output : str
             The name of the XSPEC output .txt and .fits file.
+
+    cache : bool or str
+            Passed to xspecParams().
+            Default: False
             
     Returns
     -------
@@ -290,7 +311,7 @@ def meta_info(xspec_output):
     livetime = 'EXPOSURE'
     c_stat = 'STATISTIC'
     factor = 'factor'  # if A and B have been fit together this is the relative scaling
-    return xspecParams(xspec_output+".fits", livetime, c_stat, factor)
+    return xspecParams(xspec_output+".fits", livetime, c_stat, factor, cache=cache)
 
 
 def gain_info(xspec_output):
@@ -484,6 +505,10 @@ def plotXspec(xspec_output, counts_data, matched_submodels, fitting_ranges=None,
     The axes object of the plotted XSPEC fit (if plot_res=True then the axes for the data and 
     residuals plot is returned). 
     '''
+    # matplotlib is only imported when plotting (see plotMarkers())
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+
     defaults = {"axes":plt, 
                 "meta_data":None,
                 "total_model_colour":"purple", "model_colours":plt.rcParams['axes.prop_cycle'].by_key()['color'], "fitting_range_colours":None, "fitting_range_display":True, 
@@ -632,7 +657,7 @@ def plotXspec(xspec_output, counts_data, matched_submodels, fitting_ranges=None,
 
 
 
-def plotXspec_allTogether(xspec_output, fitting_mode, **kwargs):
+def plotXspec_allTogether(xspec_output, fitting_mode, cache=False, **kwargs):
     ''' Plots the output from an XSPEC fit while doing all the data seperation too.
     So sets everything up and runs plotXspec().
     
@@ -644,6 +669,10 @@ def plotXspec_allTogether(xspec_output, fitting_mode, **kwargs):
     fitting_mode : str
             The fitting mode used when fitting the spectrum. This gets passed to seperate() in nu_spec.
 
+    cache : bool or str
+            Use the binary sidecar cache when reading the XSPEC output (see xspecParams()).
+            Default: False
+
     **kwargs -- all passed to plotXspec()
             
     Returns
@@ -653,10 +682,10 @@ def plotXspec_allTogether(xspec_output, fitting_mode, **kwargs):
     '''
 
     # get the fitted parameters, the count rate data and the file name without an extension
-    fitting_values, counts_data, xspec_output = searchAndLoad(xspec_output, fitting_mode)
+    fitting_values, counts_data, xspec_output = searchAndLoad(xspec_output, fitting_mode, cache=cache)
 
     # get the livetime, c-stat, and FPMA&B scaling factor if you can
-    plotting_values = meta_info(xspec_output)
+    plotting_values = meta_info(xspec_output, cache=cache)
 
     # get all the models that go into making the total model
     subMods = getSubModels(counts_data)
@@ -0,0 +1,243 @@
+'''
+Convert an RMF to a compressed sparse row (CSR) matrix once and keep it on disk as memory-mappable arrays.
+
+The MATRIX extension of an RMF has, for each energy bin, groups of channels (F_CHAN, N_CHAN, often variable-length
+columns) with their matrix elements one after another. rmfToCsr() turns all of the groups into CSR arrays (one row for
+each energy bin: indptr, indices (channel from 0), data) with whole-array operations, never making the dense matrix:
+variable-length columns are read from their descriptors and the heap directly rather than row by row.
+loadCsr() keeps these as .npy files in the cache directory (".xspec_cache" next to the RMF by default, see xspecCache.py)
+under the sha256 of the RMF's contents, so a copy of the same RMF anywhere (e.g., the benchmark and new runs) shares one
+entry. Later loads memory-map the arrays read-only, so they are almost instant and worker processes share the same pages.
+The sha256 of each RMF is remembered by its path, size and modification time so it is only worked out once.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+from xspecCache import CACHE_DIR
+
+HASH_CHUNK = 1<<22
+ARRAYS = ["energ_lo", "energ_hi", "e_min", "e_max", "indptr", "indices", "data"]
+
+
+def _cacheBase(rmf, cache):
+    ''' The directory the RMF cache entries go in (True for CACHE_DIR next to the RMF, or the directory to use).
+    '''
+    base = os.path.join(os.path.dirname(os.path.abspath(rmf)), CACHE_DIR) if cache is True else cache
+    return os.path.join(base, "rmf")
+
+
+def fileDigest(path, cache=True):
+    ''' The sha256 of a file's contents, only read again if its size or modification time has changed.
+
+    Parameters
+    ----------
+    path : str
+            The file.
+
+    cache : bool or str
+            Where to remember the digests (see loadCsr()), False to always read the file.
+            Default: True
+
+    Returns
+    -------
+    The hex digest.
+    '''
+    stat = os.stat(path)
+    key = {"size":stat.st_size, "mtime_ns":stat.st_mtime_ns}
+    index_file = os.path.join(_cacheBase(path, cache), "digests.json") if cache is not False else None
+
+    index = {}
+    if index_file is not None:
+        try:
+            with open(index_file, "r") as i:
+                index = json.load(i)
+        except (OSError, ValueError):
+            index = {}
+        known = index.get(os.path.abspath(path))
+        if (known is not None) and all([known[k]==v for k,v in key.items()]):
+            return known["sha256"]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            sha.update(chunk)
+
+    if index_file is not None:
+        index[os.path.abspath(path)] = dict(key, sha256=sha.hexdigest())
+        try:
+            os.makedirs(os.path.dirname(index_file), exist_ok=True)
+            tmp = index_file+f".tmp.{os.getpid()}"
+            with open(tmp, "w") as i:
+                json.dump(index, i)
+            os.replace(tmp, index_file)
+        except OSError:
+            pass
+    return sha.hexdigest()
+
+
+# reading variable-length columns straight from the heap uses astropy internals (FITS2NUMPY, Column.format.p_format,
+# FITS_rec._get_heap_data() and the descriptors in the raw field), checked against astropy 8.0.1, if they aren't there or
+# have changed then the (slower) per-row arrays astropy gives are used instead
+_HEAP_ERRORS = (AttributeError, KeyError, IndexError, TypeError, ValueError)
+
+
+def _heapFlatten(data, name, counts):
+    ''' The first counts[row] elements of every row of a variable-length (P or Q) column, gathered straight from the heap.
+
+    The column's raw values are (number of elements, byte offset into the heap) descriptors, so the bytes of every row
+    are picked out of the heap with one fancy index and viewed as the column's (big-endian) type.
+    '''
+    from astropy.io.fits.column import FITS2NUMPY
+
+    column = data.columns[name]
+    dtype = np.dtype(FITS2NUMPY[column.format.p_format]).newbyteorder(">")
+    descriptors = np.asarray(np.rec.recarray.field(data, name), dtype=np.int64)
+    counts = np.minimum(np.asarray(counts, dtype=np.int64), descriptors[:,0])
+
+    nbytes = counts*dtype.itemsize
+    row_start = np.cumsum(nbytes)-nbytes
+    index = np.repeat(descriptors[:,1]-row_start, nbytes)+np.arange(int(nbytes.sum()))
+    # astropy keeps the heap as one uint8 array after the table rows
+    values = data._get_heap_data()[index].view(dtype)
+    if (column.bscale is not None) or (column.bzero is not None):
+        values = values*(1 if column.bscale is None else column.bscale)+(0 if column.bzero is None else column.bzero)
+    return values
+
+
+def _isVariableLength(data, name):
+    ''' Whether a column is a variable-length (P or Q) array.'''
+    return getattr(data.columns[name].format, "p_format", None) is not None
+
+
+def _rowFlatten(data, name, counts):
+    ''' The first counts[row] elements of every row of a variable-length column, from astropy's per-row arrays.'''
+    rows = [np.asarray(row)[:c] for row, c in zip(data[name], counts)]
+    return np.concatenate(rows) if len(rows)>0 else np.empty(0)
+
+
+def _rowLengths(data, name):
+    ''' The number of elements in each row of a variable-length column (from its descriptors if possible).'''
+    try:
+        return np.asarray(np.rec.recarray.field(data, name), dtype=np.int64)[:,0]
+    except _HEAP_ERRORS:
+        return np.array([len(row) for row in data[name]], dtype=np.int64)
+
+
+def _flatten(data, name, counts):
+    ''' All the values of a (variable-length or fixed-width) column, row after row, keeping counts[row] from each row.
+    '''
+    if _isVariableLength(data, name):
+        try:
+            return _heapFlatten(data, name, counts)
+        except _HEAP_ERRORS:
+            return _rowFlatten(data, name, counts)
+    column = np.asarray(data[name])
+    if column.ndim==1:
+        # one value per row
+        return column[counts>0]
+    # fixed-width: only the first counts[row] of each row are used
+    return column[np.arange(column.shape[1])[None, :]<counts[:, None]]
+
+
+def rmfToCsr(rmf):
+    ''' Read an RMF into CSR arrays.
+
+    Parameters
+    ----------
+    rmf : str
+            The .rmf file.
+
+    Returns
+    -------
+    A dictionary with the response energy bin edges ("energ_lo", "energ_hi"), the channel energy edges ("e_min",
+    "e_max") and the matrix (energy bins, channels) as CSR arrays "indptr", "indices" and "data".
+    '''
+    # astropy is only needed to read the file
+    from astropy.io import fits
+
+    with fits.open(rmf) as hdul:
+        matrix = hdul["MATRIX"] if "MATRIX" in hdul else hdul["SPECRESP MATRIX"]
+        ebounds = hdul["EBOUNDS"].data
+        offset = int(matrix.header.get(f"TLMIN{matrix.columns.names.index('F_CHAN')+1}", ebounds["CHANNEL"][0]))
+        data = matrix.data
+        n_energy = len(data)
+
+        # the number of groups in each row (N_GRP if it's there, otherwise the length of each row of F_CHAN)
+        if "N_GRP" in matrix.columns.names:
+            n_grp = np.asarray(data["N_GRP"], dtype=np.int64)
+        elif _isVariableLength(data, "F_CHAN"):
+            n_grp = _rowLengths(data, "F_CHAN")
+        else:
+            f_shape = np.shape(data["F_CHAN"])
+            n_grp = np.full(n_energy, 1 if len(f_shape)==1 else f_shape[1], dtype=np.int64)
+
+        # every group of every row at once
+        f_chan = _flatten(data, "F_CHAN", n_grp).astype(np.int64)
+        n_chan = _flatten(data, "N_CHAN", n_grp).astype(np.int64)
+        group_row = np.repeat(np.arange(n_energy), n_grp)
+        keep = n_chan>0
+        f_chan, n_chan, group_row = f_chan[keep], n_chan[keep], group_row[keep]
+
+        # the matrix elements of each row are the elements of its groups one after another
+        row_nnz = np.bincount(group_row, weights=n_chan, minlength=n_energy).astype(np.int64)
+        values = _flatten(data, "MATRIX", row_nnz).astype(np.float32)
+
+        # the channel of each element: the start of its group plus how far into the group it is
+        nnz = int(n_chan.sum())
+        group_start = np.cumsum(n_chan)-n_chan
+        indices = np.repeat(f_chan-offset-group_start, n_chan)+np.arange(nnz)
+
+        csr = {"energ_lo":np.array(data["ENERG_LO"], dtype=np.float64),
+               "energ_hi":np.array(data["ENERG_HI"], dtype=np.float64),
+               "e_min":np.array(ebounds["E_MIN"], dtype=np.float64),
+               "e_max":np.array(ebounds["E_MAX"], dtype=np.float64),
+               "indptr":np.concatenate([[0], np.cumsum(row_nnz)]).astype(np.int64),
+               "indices":indices.astype(np.int32),
+               "data":values}
+    assert csr["data"].size==nnz, f"The MATRIX column of {rmf} does not have the N_CHAN elements it should."
+    return csr
+
+
+def loadCsr(rmf, cache=True):
+    ''' Get the CSR arrays of an RMF, from the cache if the same RMF has been converted before.
+
+    Parameters
+    ----------
+    rmf : str
+            The .rmf file.
+
+    cache : bool or str
+            False to just convert the RMF, True to use CACHE_DIR next to the RMF, or the directory to keep the cache in.
+            Default: True
+
+    Returns
+    -------
+    The dictionary from rmfToCsr(), memory-mapped read-only if it came from the cache.
+    '''
+    if cache is False:
+        return rmfToCsr(rmf)
+
+    entry = os.path.join(_cacheBase(rmf, cache), fileDigest(rmf, cache))
+    try:
+        return {name:np.load(os.path.join(entry, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+    except (OSError, ValueError):
+        pass
+
+    csr = rmfToCsr(rmf)
+    try:
+        # written to a temporary directory and renamed so a half-written entry is never read
+        tmp = entry+f".tmp.{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp, f"{name}.npy"), csr[name], allow_pickle=False)
+        with open(os.path.join(tmp, "meta.json"), "w") as m:
+            json.dump({"source":os.path.abspath(rmf), "nnz":int(csr["data"].size)}, m)
+        os.rename(tmp, entry)
+    except OSError:
+        # can't write the cache (e.g., read-only directory or made by another process at the same time), carry on without it
+        shutil.rmtree(tmp, ignore_errors=True)
+    return csr
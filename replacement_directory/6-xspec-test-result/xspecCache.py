@@ -0,0 +1,144 @@
+'''
+Binary sidecar cache for the parsed XSPEC outputs (the "wdata" .txt and "writefits" .fits files).
+
+The arrays made from a file are saved as .npy files in a cache directory (".xspec_cache" next to the file by default)
+along with the size and modification time of the file they came from. Later reads memory-map the .npy files (no parsing
+and no copies) as long as the original file has not changed, otherwise the cache is made again.
+'''
+
+import os
+import json
+import numpy as np
+
+CACHE_DIR = ".xspec_cache"
+
+
+def _cacheDirectory(source, cache):
+    ''' Where the sidecar for a file goes.
+
+    Parameters
+    ----------
+    source : str
+            The file that has been parsed.
+
+    cache : bool or str
+            True to use CACHE_DIR next to source, or the directory to keep the cache in.
+
+    Returns
+    -------
+    The directory for the sidecar of source.
+    '''
+    base = os.path.join(os.path.dirname(os.path.abspath(source)), CACHE_DIR) if cache is True else cache
+    return os.path.join(base, os.path.basename(source))
+
+
+def _sourceKey(source):
+    ''' What identifies the version of a file, its absolute path, size and modification time.
+    '''
+    stat = os.stat(source)
+    return {"source":os.path.abspath(source), "size":stat.st_size, "mtime_ns":stat.st_mtime_ns}
+
+
+def loadArrays(source, cache=True):
+    ''' Load the cached arrays of a file if they are there and the file has not changed.
+
+    Parameters
+    ----------
+    source : str
+            The file that was parsed.
+
+    cache : bool or str
+            True to use CACHE_DIR next to source, or the directory the cache is kept in.
+            Default: True
+
+    Returns
+    -------
+    A dictionary of the (memory-mapped, copy-on-write) arrays or None if there is no valid cache.
+    '''
+    sidecar = _cacheDirectory(source, cache)
+    try:
+        with open(os.path.join(sidecar, "meta.json"), "r") as m:
+            meta = json.load(m)
+    except (OSError, ValueError):
+        return None
+
+    if meta["key"]!=_sourceKey(source):
+        return None
+
+    try:
+        # copy-on-write so the arrays can still be changed in memory (like plotXspec() does) without touching the cache
+        return {name:np.load(os.path.join(sidecar, f"{n}.npy"), mmap_mode="c") for n,name in enumerate(meta["names"])}
+    except (OSError, ValueError):
+        return None
+
+
+def saveArrays(source, arrays, cache=True):
+    ''' Save the arrays parsed from a file as a sidecar.
+
+    Parameters
+    ----------
+    source : str
+            The file that was parsed.
+
+    arrays : dict
+            The arrays (numpy arrays) made from source with string keys.
+
+    cache : bool or str
+            True to use CACHE_DIR next to source, or the directory to keep the cache in.
+            Default: True
+
+    Returns
+    -------
+    None.
+    '''
+    sidecar = _cacheDirectory(source, cache)
+    os.makedirs(sidecar, exist_ok=True)
+
+    # remove the meta file first so a half-written cache is never read, it is written last
+    meta_file = os.path.join(sidecar, "meta.json")
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+
+    names = list(arrays.keys())
+    for n,name in enumerate(names):
+        tmp = os.path.join(sidecar, f"{n}.tmp.{os.getpid()}.npy")
+        np.save(tmp, np.asarray(arrays[name]), allow_pickle=False)
+        os.replace(tmp, os.path.join(sidecar, f"{n}.npy"))
+
+    tmp = meta_file+f".tmp.{os.getpid()}"
+    with open(tmp, "w") as m:
+        json.dump({"key":_sourceKey(source), "names":names}, m)
+    os.replace(tmp, meta_file)
+
+
+def cached(source, parser, cache=True):
+    ''' Get the arrays from a file, either from its sidecar or by parsing it (and then saving the sidecar).
+
+    Parameters
+    ----------
+    source : str
+            The file to parse.
+
+    parser : function
+            Takes source and returns a dictionary of arrays.
+
+    cache : bool or str
+            False to just run parser, True to use CACHE_DIR next to source, or the directory to keep the cache in.
+            Default: True
+
+    Returns
+    -------
+    The dictionary of arrays.
+    '''
+    if cache is False:
+        return parser(source)
+
+    arrays = loadArrays(source, cache)
+    if arrays is None:
+        arrays = parser(source)
+        try:
+            saveArrays(source, arrays, cache)
+        except (OSError, ValueError):
+            # can't write the cache (e.g., read-only directory or arrays numpy can't save without pickling), just carry on without it
+            pass
+    return arrays
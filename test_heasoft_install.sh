@@ -15,6 +15,8 @@ OBSID="80414202001"
 BENCHMARK_DIR="/benchmark"
 BENCHMARK_DIR_EXT=""
 COMPARE_TO_BENCHMARK="no"
+PARALLEL="no"
+STAGE_CACHE=""
 
 function dir_exist_check() {
     # if this dir exists then don't want to overwrite so produce warning for user to delete if necessary
@@ -109,6 +111,15 @@ function usage() {
     echo "                                 - Default is \"80414202001\""
     echo "                                 - Must correspond to the <w3browse-*.tar> file that"
     echo "                                   was downloaded"
+    echo " -p , --parallel             Run the stages after nupipeline as a dependency graph so"
+    echo "                             the FPMA and FPMB stages (and XSPEC fits) run at the same"
+    echo "                             time (see pipeline/nustarPipeline.py)"
+    echo " -c*, --cache*               Reuse the nupipeline, nuscreen and nuproducts products of"
+    echo "                             an earlier run with identical inputs (implies -p)"
+    echo "                                 - Default cache directory is:"
+    echo "                                   \"$SCRIPT_DIR/stage_cache\""
+    echo "                                 - If given an argument then it is used as the cache"
+    echo "                                   directory."
     echo ""
     echo "Standard Eamples:"
     echo "-----------------"
@@ -174,10 +185,11 @@ function test_line() {
     echo "OUTPUT:" >> $TERM_OUTFILE 2>&1
     echo $4 >> $TERM_OUTFILE 2>&1
 
-    # $2 can be multiple separated inputs (e.g., 'command -flags inputs') so eval
+    # $2 can be multiple separated inputs (e.g., 'command -flags inputs') so run it through the shell (like eval)
     # dump output to file with warnings and all
     # update terminal string (blah - Running) to either 'blah - Passed' or 'blah - Failed', if failed then terminate the test
-    eval $2 >> $TERM_OUTFILE 2>&1 && EXIT_VALUE=0 || EXIT_VALUE=1
+    # the command is run under the profiler so its wall/CPU time, memory and I/O are added to STAGE_PROFILE_FILE
+    python3 $SCRIPT_DIR"/pipeline/stageProfile.py" run --name "Test$3:$1" --profile $STAGE_PROFILE_FILE -- zsh -c "$2" >> $TERM_OUTFILE 2>&1 && EXIT_VALUE=0 || EXIT_VALUE=1
 
     if [[ $EXIT_VALUE = 0 ]]
     then
@@ -274,6 +286,16 @@ function handle_options() {
                 fi
                 OBSID=$(extract_argument $@)
                 ;;
+            -p | --parallel)
+                PARALLEL="yes"
+                ;;
+            -c* | --cache*)
+                PARALLEL="yes"
+                STAGE_CACHE=$SCRIPT_DIR"/stage_cache"
+                if has_argument $@; then
+                    STAGE_CACHE=$(extract_argument $@)
+                fi
+                ;;
         esac
         shift
     done
@@ -283,7 +305,6 @@ function handle_options() {
 handle_options "$@"
 
 DOWNLOADED_DATA=$1 # "w3browse-68892.tar"
-DOWNLOADED_DATA_FILE=$(basename "$DOWNLOADED_DATA")
 if [[ $DOWNLOADED_DATA = "" ]] then
     err
 fi
@@ -300,6 +321,11 @@ else
     echo $BEGIN_STATEMENT"starting HEASoft install to create cached examples." | tee $TERM_OUTFILE 2>&1
 fi
 
+# record the resources each stage (and XSPEC fit) uses in a file next to the run log
+STAGE_PROFILE_FILE=${TERM_OUTFILE%.log}"_stage_profile.json"
+rm -f $STAGE_PROFILE_FILE
+export STAGE_PROFILE_FILE
+
 # add some stuff to terminal and log files
 echo "Testing will be based on the succesful execution of the code and final XSPEC results." | tee -a $TERM_OUTFILE 2>&1
 echo "Run Date & Time: "$(date +%d.%m.%y-%H:%M:%S) | tee -a $TERM_OUTFILE 2>&1
@@ -322,73 +348,83 @@ STATUSEXPR="STATUS==b0000xx00xx0xx000"
 FIRST_FILES_DIR=$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/2-nuproducts-test"
 MOVING_STUFF_LINE="Moving stuff around, beep beep."
 
-# start by moving the data over, unzipping it ready to be used in HEASoft
+# start by extracting the data straight from the download, unzipping it ready to be used in HEASoft
 echo $MOVING_STUFF_LINE >> $TERM_OUTFILE 2>&1
 normal_line cd $FIRST_FILES_DIR
-normal_line cp $DOWNLOADED_DATA "./"
-normal_line tar -xf $DOWNLOADED_DATA_FILE
-normal_line gunzip -r $OBSID
-normal_line rm $DOWNLOADED_DATA_FILE
+normal_line python3 $SCRIPT_DIR"/pipeline/extractTar.py" $DOWNLOADED_DATA "./" --obsid $OBSID
 check_obsid_dir $OBSID
 normal_line cd $OBSID 
 normal_lines_end
 
-# test nupipeline
-test_line "Get orbit and CHU EVT files (nupipeline)     " "nupipeline obsmode=SCIENCE_SC indir=$FIRST_FILES_DIR/$OBSID steminputs=nu$OBSID outdir=event_cl entrystage=1 exitstage=2 pntra=OBJECT pntdec=OBJECT statusexpr=$STATUSEXPR cleanflick=no hkevtexpr=NONE clobber=yes runsplitsc=yes splitmode=STRICT" 1
-
-# move directory to where the event files are
-normal_line cd "./event_cl"
-
-# screen the event files, testing nuscreen
-test_line "Screen counts to grade 0 (FPMA, nuscreen)   " "nuscreen infile=nu"$OBSID"A06_cl.evt gtiscreen=no evtscreen=yes gtiexpr=NONE gradeexpr=0 statusexpr=NONE outdir="$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/ hkfile=./nu"$OBSID"A_fpm.hk outfile=nu"$OBSID"A06_cl_grade0.evt" 2a
-test_line "Screen counts to grade 0 (FPMB, nuscreen)   " "nuscreen infile=nu"$OBSID"B06_cl.evt gtiscreen=no evtscreen=yes gtiexpr=NONE gradeexpr=0 statusexpr=NONE outdir="$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/ hkfile=./nu"$OBSID"B_fpm.hk outfile=nu"$OBSID"B06_cl_grade0.evt" 2b
-
-# get ready to filter with time and space so move the files needed to de-clutter
-echo $MOVING_STUFF_LINE >> $TERM_OUTFILE 2>&1
-normal_line cp "./nu"$OBSID"_att.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
-normal_line cp "./nu"$OBSID"_mast.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
-normal_line cp "./nu"$OBSID"A_fpm.hk" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
-normal_line cp "./nu"$OBSID"A_det1.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
-normal_line cp "./nu"$OBSID"A_oa.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
-normal_line cp "./nu"$OBSID"B_fpm.hk" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
-normal_line cp "./nu"$OBSID"B_det1.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
-normal_line cp "./nu"$OBSID"B_oa.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
-normal_line cd $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
-normal_lines_end
-
-# filter w.r.t. time and space, testing nuproducts
-test_line "Filter to time and region (FPMA, nuproducts)" "nuproducts indir=./ instrument=FPMA steminputs=nu"$OBSID" outdir=../4-nuproducts-timeAndSpaceSelection-test/ extended=no runmkarf=yes runmkrmf=yes infile=nu"$OBSID"A06_cl_grade0.evt bkgextract=no srcregionfile="$REGION_FILEA" attfile=./nu"$OBSID"_att.fits hkfile=./nu"$OBSID"A_fpm.hk usrgtifile="$TIME_INTERVAL_FILE 3a
-test_line "Filter to time and region (FPMB, nuproducts)" "nuproducts indir=./ instrument=FPMB steminputs=nu"$OBSID" outdir=../4-nuproducts-timeAndSpaceSelection-test/ extended=no runmkarf=yes runmkrmf=yes infile=nu"$OBSID"B06_cl_grade0.evt bkgextract=no srcregionfile="$REGION_FILEB" attfile=./nu"$OBSID"_att.fits hkfile=./nu"$OBSID"B_fpm.hk usrgtifile="$TIME_INTERVAL_FILE 3b
-
-# take the spectral files outputted and move them to another directory
-echo $MOVING_STUFF_LINE >> $TERM_OUTFILE 2>&1
-normal_line cd $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/4-nuproducts-timeAndSpaceSelection-test/"
-normal_line cp "./nu"$OBSID"A06_cl_grade0_sr.pha" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
-normal_line cp "./nu"$OBSID"A06_cl_grade0_sr.arf" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
-normal_line cp "./nu"$OBSID"A06_cl_grade0_sr.rmf" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
-normal_line cp "./nu"$OBSID"B06_cl_grade0_sr.pha" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
-normal_line cp "./nu"$OBSID"B06_cl_grade0_sr.arf" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
-normal_line cp "./nu"$OBSID"B06_cl_grade0_sr.rmf" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
-normal_line cd $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
-normal_line python3  "create_xcm.py" $OBSID
-normal_lines_end
+if [[ $PARALLEL = "yes" ]]
+then
+    # run nupipeline to the plots as a dependency graph, independent stages (e.g., FPMA and FPMB) at the same time
+    # with a stage cache, HEASoft stages with the same inputs as an earlier run reuse its products
+    CACHE_ARGS=()
+    if [[ $STAGE_CACHE != "" ]] then
+        CACHE_ARGS=(--cache $STAGE_CACHE --tarball $DOWNLOADED_DATA)
+    fi
+    python3 $SCRIPT_DIR"/pipeline/nustarPipeline.py" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE $TERM_OUTFILE --obsid $OBSID --gti $TIME_INTERVAL_FILE --rega $REGION_FILEA --regb $REGION_FILEB $CACHE_ARGS
+    normal_line cd $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
+    normal_lines_end
+else
+    # test nupipeline
+    test_line "Get orbit and CHU EVT files (nupipeline)     " "nupipeline obsmode=SCIENCE_SC indir=$FIRST_FILES_DIR/$OBSID steminputs=nu$OBSID outdir=event_cl entrystage=1 exitstage=2 pntra=OBJECT pntdec=OBJECT statusexpr=$STATUSEXPR cleanflick=no hkevtexpr=NONE clobber=yes runsplitsc=yes splitmode=STRICT" 1
+
+    # move directory to where the event files are
+    normal_line cd "./event_cl"
+
+    # screen the event files, testing nuscreen
+    test_line "Screen counts to grade 0 (FPMA, nuscreen)   " "nuscreen infile=nu"$OBSID"A06_cl.evt gtiscreen=no evtscreen=yes gtiexpr=NONE gradeexpr=0 statusexpr=NONE outdir="$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/ hkfile=./nu"$OBSID"A_fpm.hk outfile=nu"$OBSID"A06_cl_grade0.evt" 2a
+    test_line "Screen counts to grade 0 (FPMB, nuscreen)   " "nuscreen infile=nu"$OBSID"B06_cl.evt gtiscreen=no evtscreen=yes gtiexpr=NONE gradeexpr=0 statusexpr=NONE outdir="$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/ hkfile=./nu"$OBSID"B_fpm.hk outfile=nu"$OBSID"B06_cl_grade0.evt" 2b
+
+    # get ready to filter with time and space so move the files needed to de-clutter
+    echo $MOVING_STUFF_LINE >> $TERM_OUTFILE 2>&1
+    normal_line cp "./nu"$OBSID"_att.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
+    normal_line cp "./nu"$OBSID"_mast.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
+    normal_line cp "./nu"$OBSID"A_fpm.hk" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
+    normal_line cp "./nu"$OBSID"A_det1.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
+    normal_line cp "./nu"$OBSID"A_oa.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
+    normal_line cp "./nu"$OBSID"B_fpm.hk" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
+    normal_line cp "./nu"$OBSID"B_det1.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
+    normal_line cp "./nu"$OBSID"B_oa.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
+    normal_line cd $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/3-nuscreen-test/"
+    normal_lines_end
 
-# fit the data, testing XSPEC
-test_line "Run XSPEC code (xspec)                       " "python3 runXspec.py" 4 "See log files in "$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"5-xspec-test directory."
+    # filter w.r.t. time and space, testing nuproducts
+    test_line "Filter to time and region (FPMA, nuproducts)" "nuproducts indir=./ instrument=FPMA steminputs=nu"$OBSID" outdir=../4-nuproducts-timeAndSpaceSelection-test/ extended=no runmkarf=yes runmkrmf=yes infile=nu"$OBSID"A06_cl_grade0.evt bkgextract=no srcregionfile="$REGION_FILEA" attfile=./nu"$OBSID"_att.fits hkfile=./nu"$OBSID"A_fpm.hk usrgtifile="$TIME_INTERVAL_FILE 3a
+    test_line "Filter to time and region (FPMB, nuproducts)" "nuproducts indir=./ instrument=FPMB steminputs=nu"$OBSID" outdir=../4-nuproducts-timeAndSpaceSelection-test/ extended=no runmkarf=yes runmkrmf=yes infile=nu"$OBSID"B06_cl_grade0.evt bkgextract=no srcregionfile="$REGION_FILEB" attfile=./nu"$OBSID"_att.fits hkfile=./nu"$OBSID"B_fpm.hk usrgtifile="$TIME_INTERVAL_FILE 3b
+
+    # take the spectral files outputted and move them to another directory
+    echo $MOVING_STUFF_LINE >> $TERM_OUTFILE 2>&1
+    normal_line cd $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/4-nuproducts-timeAndSpaceSelection-test/"
+    normal_line cp "./nu"$OBSID"A06_cl_grade0_sr.pha" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
+    normal_line cp "./nu"$OBSID"A06_cl_grade0_sr.arf" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
+    normal_line cp "./nu"$OBSID"A06_cl_grade0_sr.rmf" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
+    normal_line cp "./nu"$OBSID"B06_cl_grade0_sr.pha" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
+    normal_line cp "./nu"$OBSID"B06_cl_grade0_sr.arf" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
+    normal_line cp "./nu"$OBSID"B06_cl_grade0_sr.rmf" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
+    normal_line cd $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/5-xspec-test/"
+    normal_line python3  "create_xcm.py" $OBSID
+    normal_lines_end
 
-# take the products from fitting, read to be plotted
-echo $MOVING_STUFF_LINE >> $TERM_OUTFILE 2>&1
-normal_line cp "./mod_apec1fit_fpma_cstat.txt" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
-normal_line cp "./mod_apec1fit_fpma_cstat.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
-normal_line cp "./mod_apec1fit_fpmb_cstat.txt" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
-normal_line cp "./mod_apec1fit_fpmb_cstat.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
-normal_line cp "./mod_apec1fit_fpmab_cstat.txt" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
-normal_line cp "./mod_apec1fit_fpmab_cstat.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
-normal_line cd $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
-normal_lines_end
+    # fit the data, testing XSPEC
+    test_line "Run XSPEC code (xspec)                       " "python3 runXspec.py" 4 "See log files in "$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"5-xspec-test directory."
+
+    # take the products from fitting, read to be plotted
+    echo $MOVING_STUFF_LINE >> $TERM_OUTFILE 2>&1
+    normal_line cp "./mod_apec1fit_fpma_cstat.txt" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
+    normal_line cp "./mod_apec1fit_fpma_cstat.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
+    normal_line cp "./mod_apec1fit_fpmb_cstat.txt" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
+    normal_line cp "./mod_apec1fit_fpmb_cstat.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
+    normal_line cp "./mod_apec1fit_fpmab_cstat.txt" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
+    normal_line cp "./mod_apec1fit_fpmab_cstat.fits" $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
+    normal_line cd $SCRIPT_DIR$HEASOFT_OUTPUT_FILE"/6-xspec-test-result/"
+    normal_lines_end
 
-# plot the fits to the data, testing the output of xspec makes sense
-test_line "Plot XSPEC result (xspec)                    " "python3 plotXspec.py" 5 "See plots in "$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"6-xspec-test-result directory."
+    # plot the fits to the data, testing the output of xspec makes sense
+    test_line "Plot XSPEC result (xspec)                    " "python3 plotXspec.py" 5 "See plots in "$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"6-xspec-test-result directory."
+fi
 
 # record the results other than just in the plots, can output to terminal too if 'print-result'is given too
 XSPEC_RESULT_LINE="XSPEC Results:"
@@ -401,6 +437,12 @@ then
 
     echo $XSPEC_RESULT_LINE 
     python3 "getXspecParameters.py" "compare" "$BENCHMARK_DIR"
+
+    # check the fit results numerically against the benchmark, fails if any parameter is out of tolerance
+    test_line "Compare XSPEC result to benchmark (xspec)    " "python3 compareFits.py "$SCRIPT_DIR$BENCHMARK_DIR"/6-xspec-test-result/ ./ --rtol 1e-3 --report comparison_report.json" 6 "See comparison_report.json in "$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"6-xspec-test-result directory."
+
+    # check the screened events against the benchmark, event by event
+    test_line "Compare events to benchmark (nuscreen)       " "python3 ../3-nuscreen-test/evtDiff.py "$SCRIPT_DIR$BENCHMARK_DIR"/3-nuscreen-test/ ../3-nuscreen-test/ --report ../3-nuscreen-test/evt_diff_report.json" 7 "See evt_diff_report.json in "$SCRIPT_DIR$HEASOFT_OUTPUT_FILE"3-nuscreen-test directory."
 else
     # Just run the benchmark so nothing to compare to
     echo $XSPEC_RESULT_LINE >> $TERM_OUTFILE 2>&1
@@ -411,5 +453,10 @@ else
     python3 "getXspecParameters.py" "no-compare"
 fi
 
+# summarise the resources used by each stage
+echo "\nStage profile ($STAGE_PROFILE_FILE):" | tee -a $TERM_OUTFILE 2>&1
+python3 $SCRIPT_DIR"/pipeline/stageProfile.py" summary $STAGE_PROFILE_FILE | tee -a $TERM_OUTFILE 2>&1
+echo "\n" | tee -a $TERM_OUTFILE 2>&1
+
 # final line
 echo "Finished testing. Now get sciencing if all the tests passed!" | tee -a $TERM_OUTFILE 2>&1